@@ -3,6 +3,12 @@ document.addEventListener('DOMContentLoaded', () => {
     const userInput = document.getElementById('userInput');
     const sendButton = document.getElementById('sendButton');
     const flaskApiUrl = 'http://127.0.0.1:5000/chat'; // URL da sua API Flask
+    // Sessão da conversa: o id é gerado aqui e o histórico vale enquanto a
+    // aba estiver aberta
+    const sessionKey = 'chatSessionId';
+    if (!sessionStorage.getItem(sessionKey)) {
+        sessionStorage.setItem(sessionKey, crypto.randomUUID());
+    }
 
     // Função para adicionar mensagem à caixa de chat
     function addMessage(text, sender, messageElement) {
@@ -57,7 +63,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ message: messageText }),
+                body: JSON.stringify({
+                    message: messageText,
+                    session_id: sessionStorage.getItem(sessionKey),
+                }),
             });
             
             // Remove o indicador "Bot está digitando..." assim que a resposta (headers) chegar
@@ -73,47 +82,71 @@ document.addEventListener('DOMContentLoaded', () => {
             }
             console.log('[FETCH] Resposta OK, iniciando leitura do stream.'); // Log
 
-            // Lida com o corpo da resposta como um stream de texto
+            // Lida com o corpo da resposta como um stream SSE (text/event-stream)
             const reader = response.body.getReader();
             const decoder = new TextDecoder('utf-8'); // Garante a decodificação correta
-            let firstChunk = true;
-            let receivedAnything = false; // Flag para verificar se algo foi recebido
+            let buffer = '';
+            let receivedAnything = false; // Flag para verificar se algum token foi recebido
+
+            // Processa um evento SSE completo ("event: ...\ndata: ...")
+            function handleEvent(rawEvent) {
+                let eventName = 'message';
+                let dataText = '';
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event:')) {
+                        eventName = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataText += line.slice(5).trim();
+                    }
+                }
+                const payload = dataText ? JSON.parse(dataText) : {};
+
+                if (eventName === 'metadata') {
+                    console.log('[STREAM] Fontes recuperadas:', payload.sources);
+                } else if (eventName === 'token') {
+                    receivedAnything = true;
+                    if (!botMessageElement) {
+                        botMessageElement = addMessage(payload.text, 'bot'); // Cria a mensagem do bot com o primeiro token
+                    } else {
+                        addMessage(payload.text, 'bot', botMessageElement); // Adiciona os tokens subsequentes
+                    }
+                } else if (eventName === 'error') {
+                    receivedAnything = true;
+                    console.error('[STREAM] Erro do servidor:', payload.error);
+                    addMessage(`Erro ao gerar a resposta: ${payload.error}`, 'bot');
+                }
+            }
 
             // Loop para ler o stream
             while (true) {
                 const { done, value } = await reader.read();
-                
+
                 if (done) {
                     console.log('[STREAM] Leitura finalizada (done=true).'); // Log
-                    if (!receivedAnything && !botMessageElement) { // Se nada foi recebido E nenhum balão de bot foi criado
-                        console.log('[STREAM] Nenhum dado recebido antes do stream finalizar.');
-                        addMessage("O bot não enviou uma resposta ou a resposta foi vazia.", 'bot');
-                    }
-                    break; 
+                    break;
                 }
-                
-                receivedAnything = true; // Marcar que recebemos dados
-                const chunkText = decoder.decode(value, { stream: true }); // Decodifica o chunk
-                console.log('[STREAM] Chunk recebido e decodificado:', chunkText); // Log do chunk no console do navegador
-
-                if (chunkText) { // Processa apenas se o chunk decodificado não for vazio
-                    if (firstChunk) {
-                        botMessageElement = addMessage(chunkText, 'bot'); // Cria a mensagem do bot com o primeiro chunk
-                        firstChunk = false;
-                    } else {
-                        addMessage(chunkText, 'bot', botMessageElement); // Adiciona aos chunks subsequentes
+
+                buffer += decoder.decode(value, { stream: true }); // Decodifica o chunk
+
+                // Eventos SSE são separados por uma linha em branco
+                let separatorIndex;
+                while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, separatorIndex);
+                    buffer = buffer.slice(separatorIndex + 2);
+                    if (rawEvent.trim()) {
+                        handleEvent(rawEvent);
                     }
                 }
             }
-             // Se o stream terminar e a última mensagem do decoder não foi processada
-            const remainingText = decoder.decode(); // Pega qualquer texto restante no buffer do decoder
-            if (remainingText) {
-                console.log('[STREAM] Texto restante no decoder:', remainingText); // Log
-                if (botMessageElement) { 
-                    addMessage(remainingText, 'bot', botMessageElement);
-                } else if (receivedAnything) { 
-                    addMessage(remainingText, 'bot');
-                }
+            // Processa qualquer evento restante no buffer
+            buffer += decoder.decode();
+            if (buffer.trim()) {
+                handleEvent(buffer);
+            }
+
+            if (!receivedAnything && !botMessageElement) { // Se nenhum token foi recebido
+                console.log('[STREAM] Nenhum token recebido antes do stream finalizar.');
+                addMessage("O bot não enviou uma resposta ou a resposta foi vazia.", 'bot');
             }
 
 
@@ -1,4 +1,5 @@
 from document_processor import DocumentProcessor
+from reindex import CollectionAlias
 
 
 if __name__ == "__main__":
@@ -7,7 +8,7 @@ if __name__ == "__main__":
     COLLECTION_NAME = "utfpr"
     processor = DocumentProcessor(
         data_path=DATA_DIR,
-        chroma_path=CHROMA_DIR,
+        chroma_path=CollectionAlias(CHROMA_DIR, COLLECTION_NAME).resolve(),
         collection_name=COLLECTION_NAME
     )
     processor.query()
@@ -0,0 +1,328 @@
+"""
+Benchmark reproduzível de ingestão e consulta do ``DocumentProcessor``.
+
+Gera corpora sintéticos de licitações/compras públicas em português com
+vários tamanhos, mede a vazão da ingestão por etapa e depois repete um
+conjunto de perguntas contra ``query_async`` em vários níveis de
+concorrência, com um LLM falso (atraso por token configurável) no lugar do
+Gemini. O resultado vai para um JSON, para comparar execuções entre commits.
+
+Uso:
+    python benchmark.py --pages 100 1000 --concurrency 1 8 32 --output bench.json
+    python benchmark.py --pages 10000 --fake-embeddings   # só o overhead do pipeline
+    python benchmark.py --pages 1000 --lazy-load --memory-limit 1024   # RSS por arquivo em ingest.memory
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+from llm import ConcurrencyLimiter
+
+# Vocabulário do corpus sintético
+_SUBJECTS = [
+    "a dispensa de licitação", "a inexigibilidade", "o pregão eletrônico",
+    "o termo de referência", "o estudo técnico preliminar", "a pesquisa de preços",
+    "o documento de formalização da demanda", "o plano de contratações anual",
+    "a ata de registro de preços", "o contrato administrativo", "a garantia contratual",
+    "o processo no SEI", "a adesão à ata", "o reajuste contratual", "a fiscalização do contrato",
+]
+_VERBS = [
+    "deverá observar", "será instruído com", "dependerá de", "poderá ser substituído por",
+    "exige", "dispensa", "será publicado junto com", "deverá conter",
+]
+_OBJECTS = [
+    "a justificativa do preço", "a razão da escolha do fornecedor", "a estimativa da despesa",
+    "o parecer jurídico", "a autorização da autoridade competente", "a comprovação de regularidade fiscal",
+    "a disponibilidade orçamentária", "o mapa de riscos", "a descrição da solução como um todo",
+    "os requisitos da contratação", "o cronograma de execução", "a matriz de alocação de riscos",
+]
+_LAWS = ["Lei 14.133/2021", "Decreto 10.024/2019", "IN SEGES 65/2021", "Lei 8.666/1993", "Decreto 11.462/2023"]
+
+_QUESTIONS = [
+    "Como fazer {subject}?",
+    "O que diz o Art. {article} da {law}?",
+    "Quando {subject} {verb} {object}?",
+    "Quais documentos compõem {subject}?",
+    "Qual o prazo para {subject} segundo a {law}?",
+    "Quem assina {object} no processo de compra?",
+]
+
+# Caracteres por página sintética (~uma página de PDF)
+PAGE_CHARS = 1800
+
+
+def _sentence(rng: random.Random, article: int) -> str:
+    subject = rng.choice(_SUBJECTS)
+    sentence = f"{subject.capitalize()} {rng.choice(_VERBS)} {rng.choice(_OBJECTS)}"
+    if rng.random() < 0.3:
+        sentence += f", nos termos do Art. {article} da {rng.choice(_LAWS)}"
+    if rng.random() < 0.2:
+        sentence += f", conforme o § {rng.randint(1, 6)}º, inciso {rng.choice('IVX') * rng.randint(1, 3)}"
+    if rng.random() < 0.1:
+        sentence += f" (processo 23064.{rng.randint(0, 999999):06d}/{rng.randint(2019, 2025)}-{rng.randint(10, 99)})"
+    return sentence + "."
+
+
+def generate_corpus(path: str, pages: int, pages_per_file: int = 10, seed: int = 0) -> dict:
+    """
+    Gera um corpus sintético de arquivos .txt (``pages_per_file`` páginas
+    cada). A mesma semente gera sempre o mesmo corpus.
+
+    Retorna:
+        dict: Arquivos, páginas e bytes gerados.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    files, total_bytes, article = 0, 0, 1
+    for start in range(0, pages, pages_per_file):
+        page_texts = []
+        for _ in range(min(pages_per_file, pages - start)):
+            sentences, size = [f"Art. {article}."], 0
+            while size < PAGE_CHARS:
+                sentence = _sentence(rng, rng.randint(1, 200))
+                sentences.append(sentence)
+                size += len(sentence) + 1
+            article += 1
+            page_texts.append(" ".join(sentences))
+        text = "\n\n".join(page_texts)
+        with open(os.path.join(path, f"documento_{files:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write(text)
+        files += 1
+        total_bytes += len(text.encode("utf-8"))
+    return {"files": files, "pages": pages, "bytes": total_bytes}
+
+
+def generate_queries(count: int, seed: int = 1) -> list:
+    """
+    Perguntas sintéticas no mesmo domínio do corpus.
+    """
+    rng = random.Random(seed)
+    return [
+        rng.choice(_QUESTIONS).format(
+            subject=rng.choice(_SUBJECTS), verb=rng.choice(_VERBS),
+            object=rng.choice(_OBJECTS), law=rng.choice(_LAWS), article=rng.randint(1, 200))
+        for _ in range(count)
+    ]
+
+
+class FakeStreamingLLM:
+    """
+    LLM falso com a mesma interface do ``GeminiClient``: produz
+    ``tokens`` partes de texto com ``token_delay`` segundos entre elas.
+
+    Args:
+        tokens (int): Partes de texto por resposta.
+        token_delay (float): Atraso entre partes, em segundos.
+        first_token_delay (float): Atraso até a primeira parte.
+        max_concurrency (int): Gerações simultâneas (``ConcurrencyLimiter``).
+    """
+
+    def __init__(self, tokens: int = 50, token_delay: float = 0.01, first_token_delay: float = 0.2,
+                 max_concurrency: int = 1000):
+        self.model_name = "fake-streaming-llm"
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.limiter = ConcurrencyLimiter(max_concurrency, max_queue=max_concurrency, queue_timeout=None)
+
+    def _token(self, index: int) -> str:
+        return f"palavra{index} "
+
+    def stream(self, prompt: str):
+        time.sleep(self.first_token_delay)
+        for index in range(self.tokens):
+            if index:
+                time.sleep(self.token_delay)
+            yield self._token(index)
+
+    async def astream(self, prompt: str):
+        await asyncio.sleep(self.first_token_delay)
+        for index in range(self.tokens):
+            if index:
+                await asyncio.sleep(self.token_delay)
+            yield self._token(index)
+
+
+class HashEmbedder(EmbeddingFunction):
+    """
+    Embedding determinístico e barato (hash do texto), para medir só o
+    custo do pipeline, sem o modelo. As buscas não têm relevância real.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def __call__(self, input):
+        embeddings = []
+        for text in input:
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            embeddings.append(vector / np.linalg.norm(vector))
+        return embeddings
+
+
+def percentiles(latencies: list) -> dict:
+    values = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+async def replay(processor, queries: list, concurrency: int, n_results: int = 6) -> dict:
+    """
+    Envia as perguntas a ``query_async`` com ``concurrency`` clientes
+    simultâneos e mede a latência de cada uma.
+    """
+    pending = list(reversed(queries))
+    latencies, errors = [], 0
+
+    async def client():
+        nonlocal errors
+        while pending:
+            user_query = pending.pop()
+            started = time.perf_counter()
+            try:
+                await processor.query_async(user_query, n_results)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "queries": len(latencies),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "qps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        **(percentiles(latencies) if latencies else {}),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_size(args, pages: int, llm: FakeStreamingLLM, queries: list) -> dict:
+    """
+    Gera o corpus de um tamanho, ingere e repete as perguntas em cada nível
+    de concorrência.
+    """
+    from document_processor import DocumentProcessor
+
+    workdir = tempfile.mkdtemp(prefix=f"rag-bench-{pages}-", dir=args.workdir)
+    try:
+        data_path = os.path.join(workdir, "data")
+        corpus = generate_corpus(data_path, pages, args.pages_per_file, args.seed)
+        processor = DocumentProcessor(
+            data_path=data_path,
+            chroma_path=os.path.join(workdir, "db"),
+            collection_name="benchmark",
+            llm=llm,
+            embedding_backend=args.embedding_backend,
+            vector_backend=args.vector_backend,
+            hybrid_search=not args.no_hybrid,
+        )
+        if args.fake_embeddings:
+            processor._embedding_function = HashEmbedder()
+
+        started = time.perf_counter()
+        ingest = processor.process_and_ingest_documents(
+            chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, max_workers=args.workers,
+            chunker=args.chunker, lazy_load=args.lazy_load, memory_limit_mb=args.memory_limit)
+        ingest["pages_per_second"] = round(pages / (time.perf_counter() - started), 1)
+
+        async def replay_levels():
+            levels = []
+            for concurrency in args.concurrency:
+                # Cada nível começa com os caches de consulta vazios
+                processor.embedding_cache.clear()
+                processor.retrieval_cache.clear()
+                levels.append(await replay(processor, queries, concurrency, args.n_results))
+                print(f"  {pages} páginas, concorrência {concurrency}: {levels[-1]}")
+            return levels
+
+        # Um único event loop: o limitador do LLM fica preso ao loop do primeiro uso
+        levels = asyncio.run(replay_levels())
+        return {"pages": pages, "corpus": corpus, "ingest": ingest,
+                "queries": levels, "cache": processor.cache_stats()}
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--pages-per-file", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--queries", type=int, default=200, help="Perguntas por nível de concorrência")
+    parser.add_argument("--distinct-queries", type=int, default=50,
+                        help="Perguntas distintas (o resto são repetições, como no uso real)")
+    parser.add_argument("--n-results", type=int, default=6)
+    parser.add_argument("--chunk-size", type=int, default=400)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--chunker", default="legal", choices=("legal", "recursive"))
+    parser.add_argument("--workers", type=int, default=None, help="Processos de parsing")
+    parser.add_argument("--lazy-load", action="store_true", help="Carrega os arquivos página a página")
+    parser.add_argument("--memory-limit", type=float, default=None, help="Teto de RSS da ingestão, em MB")
+    parser.add_argument("--embedding-backend", default="torch")
+    parser.add_argument("--vector-backend", default="chroma")
+    parser.add_argument("--fake-embeddings", action="store_true")
+    parser.add_argument("--no-hybrid", action="store_true")
+    parser.add_argument("--llm-tokens", type=int, default=50)
+    parser.add_argument("--llm-token-delay", type=float, default=0.01)
+    parser.add_argument("--llm-first-token-delay", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--keep", action="store_true", help="Mantém corpus e banco gerados")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    llm = FakeStreamingLLM(args.llm_tokens, args.llm_token_delay, args.llm_first_token_delay)
+    distinct = generate_queries(args.distinct_queries, args.seed + 1)
+    rng = random.Random(args.seed + 2)
+    queries = [rng.choice(distinct) for _ in range(args.queries)]
+
+    runs = []
+    for pages in args.pages:
+        print(f"Corpus de {pages} páginas...")
+        runs.append(run_size(args, pages, llm, queries))
+
+    result = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "workdir", "keep")},
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Resultado gravado em {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """
+    Cache LRU com expiração (TTL) opcional, seguro para uso entre threads.
+
+    Args:
+        maxsize (int): Número máximo de entradas.
+        ttl (float): Tempo de vida das entradas em segundos (None = sem
+            expiração).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Retorna o valor da chave (e a marca como usada recentemente).
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Grava um valor, removendo a entrada menos usada se o cache estiver cheio.
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove todas as entradas.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """
+        Contadores de acertos, falhas e remoções.
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normaliza a pergunta para uso como chave de cache: minúsculas e espaços
+    colapsados. Só serve de chave: o modelo de embedding pode diferenciar
+    maiúsculas, então o texto embedado é sempre o original.
+    """
+    return " ".join(text.lower().split())
+
+
+def chunk_keys(ids: list, documents: list) -> list:
+    """
+    Identifica os chunks recuperados pelo ID e pelo hash do texto. O ID
+    (arquivo, página e posição) se mantém quando o chunker, o tamanho do
+    chunk ou o pré-processamento mudam o texto; com o hash, uma resposta
+    guardada não vale para o texto novo, mesmo depois de reiniciar.
+    """
+    return [
+        f"{chunk_id}#{hashlib.sha256(document.encode('utf-8')).hexdigest()[:16]}"
+        for chunk_id, document in zip(ids, documents)
+    ]
+
+
+class SemanticAnswerCache:
+    """
+    Cache de respostas por similaridade semântica da pergunta.
+
+    Uma resposta guardada é reutilizada quando a nova pergunta tem
+    similaridade de cosseno acima de ``threshold`` com uma pergunta já
+    respondida *e* a busca recuperou exatamente os mesmos chunks, com o mesmo
+    texto (``chunk_keys``), ou seja, o contexto enviado ao LLM seria o mesmo.
+
+    Args:
+        maxsize (int): Número máximo de respostas (remoção LRU).
+        threshold (float): Similaridade mínima para reaproveitar a resposta.
+        path (str): Arquivo JSON para persistir o cache entre reinícios.
+        autosave_every (int): Grava o arquivo a cada N respostas novas.
+    """
+
+    def __init__(self, maxsize: int = 1000, threshold: float = 0.95,
+                 path: str = None, autosave_every: int = 20):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.path = path
+        self.autosave_every = autosave_every
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # pergunta -> (embedding, chunks, resposta)
+        self._by_chunks = {}  # chunks -> set de perguntas
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def _chunks_key(chunks) -> tuple:
+        return tuple(sorted(chunks))
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, chunks):
+        """
+        Procura uma resposta para uma pergunta semelhante com o mesmo contexto.
+
+        Args:
+            embedding: Embedding da pergunta.
+            chunks (list): ``chunk_keys`` dos chunks recuperados.
+
+        Retorna:
+            str | None: A resposta guardada, ou None.
+        """
+        chunks = self._chunks_key(chunks)
+        vector = self._normalize(embedding)
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for key in self._by_chunks.get(chunks, ()):
+                score = float(np.dot(self._entries[key][0], vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key][2]
+
+    def store(self, question: str, embedding, chunks, answer: str):
+        """
+        Guarda a resposta de uma pergunta.
+        """
+        with self._lock:
+            self._insert(question, embedding, chunks, answer)
+            self._unsaved += 1
+            autosave = self.path and self._unsaved >= self.autosave_every
+        if autosave:
+            self.save()
+
+    def _insert(self, question: str, embedding, chunks, answer: str):
+        chunks = self._chunks_key(chunks)
+        self._remove(question)
+        self._entries[question] = (self._normalize(embedding), chunks, answer)
+        self._by_chunks.setdefault(chunks, set()).add(question)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, question: str):
+        entry = self._entries.pop(question, None)
+        if entry is not None:
+            questions = self._by_chunks[entry[1]]
+            questions.discard(question)
+            if not questions:
+                del self._by_chunks[entry[1]]
+
+    def clear(self):
+        """
+        Remove todas as respostas.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._by_chunks.clear()
+
+    def save(self):
+        """
+        Grava o cache no arquivo configurado, de forma atômica.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            data = [
+                {"question": question, "embedding": embedding.tolist(),
+                 "chunks": list(chunks), "answer": answer}
+                for question, (embedding, chunks, answer) in self._entries.items()
+            ]
+            self._unsaved = 0
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """
+        Carrega o cache do arquivo configurado.
+        """
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            for entry in data[-self.maxsize:]:
+                self._insert(entry["question"], entry["embedding"], entry["chunks"], entry["answer"])
+
+    def stats(self) -> dict:
+        """
+        Contadores de acertos e falhas.
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class ParseCache:
+    """
+    Cache persistente do texto extraído dos arquivos, num SQLite.
+
+    A chave é o hash do conteúdo do arquivo mais a versão do loader, então
+    mudar o chunking ou o modelo de embedding reaproveita o parsing, e
+    atualizar o loader (ou a biblioteca de PDF) invalida as entradas. As
+    páginas são gravadas em lotes de JSON comprimido com zlib, para que
+    arquivos enormes possam ser gravados e lidos aos poucos (``writer`` e
+    ``iter_pages``); uma entrada só aparece depois de gravada por inteiro.
+
+    Args:
+        path (str): Arquivo do banco SQLite.
+    """
+
+    # Versão do esquema (PRAGMA user_version); bancos mais antigos são
+    # recriados, já que é só um cache
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL: a reindexação e a ingestão normal podem usar o mesmo cache
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        if self._connection.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS pages")
+            self._connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " file_hash TEXT NOT NULL,"
+            " loader_version TEXT NOT NULL,"
+            " pages INTEGER NOT NULL,"
+            " batches INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (file_hash, loader_version))")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            " file_hash TEXT NOT NULL,"
+            " loader_version TEXT NOT NULL,"
+            " batch INTEGER NOT NULL,"
+            " data BLOB NOT NULL,"
+            " PRIMARY KEY (file_hash, loader_version, batch))")
+        self._connection.commit()
+
+    def get(self, file_hash: str, loader_version: str):
+        """
+        Páginas extraídas de um arquivo.
+
+        Retorna:
+            list | None: Pares (texto, metadados) por página, ou None.
+        """
+        pages = self.iter_pages(file_hash, loader_version)
+        return None if pages is None else list(pages)
+
+    def iter_pages(self, file_hash: str, loader_version: str):
+        """
+        Como ``get``, mas lendo um lote de páginas por vez.
+
+        Retorna:
+            generator | None: Pares (texto, metadados), ou None.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT batches FROM entries WHERE file_hash = ? AND loader_version = ?",
+                (file_hash, loader_version)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return self._iter_batches(file_hash, loader_version, row[0])
+
+    def _iter_batches(self, file_hash: str, loader_version: str, batches: int):
+        for batch in range(batches):
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT data FROM batches WHERE file_hash = ? AND loader_version = ? AND batch = ?",
+                    (file_hash, loader_version, batch)).fetchone()
+            if row is None:
+                # Removida no meio da leitura (discard)
+                return
+            for page in json.loads(zlib.decompress(row[0])):
+                yield tuple(page)
+
+    def put(self, file_hash: str, loader_version: str, pages: list):
+        """
+        Guarda as páginas (pares texto, metadados) extraídas de um arquivo.
+        """
+        writer = self.writer(file_hash, loader_version)
+        writer.add(pages)
+        writer.commit()
+
+    def writer(self, file_hash: str, loader_version: str, batch_size: int = 64):
+        """
+        Grava as páginas de um arquivo aos poucos (``ParseCacheWriter``).
+        """
+        return ParseCacheWriter(self, file_hash, loader_version, batch_size)
+
+    def _write_batch(self, file_hash: str, loader_version: str, batch: int, pages: list):
+        data = zlib.compress(json.dumps(pages, ensure_ascii=False, default=str).encode("utf-8"))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?)",
+                (file_hash, loader_version, batch, data))
+            self._connection.commit()
+
+    def _commit(self, file_hash: str, loader_version: str, pages: int, batches: int):
+        # Lotes além de ``batches`` (restos de uma gravação interrompida com
+        # outro tamanho) nunca são lidos
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (file_hash, loader_version, pages, batches, time.time()))
+            self._connection.commit()
+
+    def discard(self, file_hashes: list):
+        """
+        Remove as entradas de conteúdos que não existem mais (arquivos
+        alterados ou apagados), em todas as versões do loader.
+        """
+        rows = [(digest,) for digest in file_hashes]
+        with self._lock:
+            self._connection.executemany("DELETE FROM entries WHERE file_hash = ?", rows)
+            self._connection.executemany("DELETE FROM batches WHERE file_hash = ?", rows)
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        """
+        Contadores de acertos e falhas, entradas e tamanho comprimido.
+        """
+        with self._lock:
+            size = self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            stored = self._connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM batches").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "bytes": stored,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class ParseCacheWriter:
+    """
+    Gravação incremental das páginas de um arquivo no ``ParseCache``: cada
+    lote de ``batch_size`` páginas vai para o banco assim que completa, e a
+    entrada só passa a valer em ``commit``.
+    """
+
+    def __init__(self, cache: ParseCache, file_hash: str, loader_version: str, batch_size: int = 64):
+        self.cache = cache
+        self.file_hash = file_hash
+        self.loader_version = loader_version
+        self.batch_size = batch_size
+        self.pages = 0
+        self._batch = 0
+        self._buffer = []
+
+    def add(self, pages: list):
+        """
+        Acrescenta páginas (pares texto, metadados).
+        """
+        for page in pages:
+            self._buffer.append(page)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        self.cache._write_batch(self.file_hash, self.loader_version, self._batch, self._buffer)
+        self.pages += len(self._buffer)
+        self._batch += 1
+        self._buffer = []
+
+    def commit(self):
+        if self._buffer or not self._batch:
+            self._flush()
+        self.cache._commit(self.file_hash, self.loader_version, self.pages, self._batch)
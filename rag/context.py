@@ -0,0 +1,128 @@
+import os
+
+# Aproximação de tokens por caractere para textos em português no Gemini
+CHARS_PER_TOKEN = 4
+
+# Maior distância, em caracteres, entre o fim de um chunk e o início do
+# seguinte para considerá-los contíguos: os splitters tiram o separador e os
+# espaços das pontas de cada chunk, enquanto um chunk que ficou de fora
+# deixa um buraco do tamanho de um chunk
+MAX_CONTIGUOUS_GAP = 16
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimativa barata do número de tokens de um texto.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _overlap_length(previous: str, following: str, max_length: int) -> int:
+    """
+    Tamanho do maior sufixo de ``previous`` que é prefixo de ``following``.
+    Usado quando o chunk não tem ``start_index`` nos metadados.
+    """
+    for length in range(min(max_length, len(previous), len(following)), 0, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+def pack_context(documents: list, metadatas: list, token_budget: int = 1500,
+                 max_overlap: int = 200) -> list:
+    """
+    Monta o contexto do prompt a partir dos chunks recuperados.
+
+    Chunks da mesma fonte e página são unidos num único trecho, sem repetir
+    a sobreposição (``chunk_overlap``) entre chunks vizinhos; "[...]" marca
+    só o texto da página que ficou de fora entre dois chunks. Os trechos são
+    ordenados pela relevância do melhor chunk de cada um e incluídos até
+    esgotar ``token_budget``; o último trecho é cortado se não couber inteiro.
+
+    Args:
+        documents (list): Textos dos chunks, do mais ao menos relevante.
+        metadatas (list): Metadados dos chunks (source, page, start_index e,
+            se houver, article_path).
+        token_budget (int): Máximo de tokens (estimados) do contexto.
+        max_overlap (int): Maior sobreposição procurada quando não há
+            ``start_index``.
+
+    Retorna:
+        list: Trechos (dicts com source, page, file_type, article_path e
+        text). ``article_path`` junta os caminhos dos chunks do trecho, em
+        ordem, separados por "; ".
+    """
+    groups = {}
+    for rank, (text, metadata) in enumerate(zip(documents, metadatas)):
+        metadata = metadata or {}
+        key = (metadata.get("source"), metadata.get("page"))
+        group = groups.setdefault(key, {"rank": rank, "metadata": metadata, "chunks": []})
+        start = metadata.get("start_index")
+        group["chunks"].append(
+            (start if start is not None else rank, start is not None, text, metadata.get("article_path")))
+
+    passages = []
+    for (source, page), group in sorted(groups.items(), key=lambda item: item[1]["rank"]):
+        group["chunks"].sort(key=lambda chunk: chunk[0])
+        pieces = []
+        end = None
+        for start, has_offset, text, _ in group["chunks"]:
+            if not pieces:
+                pieces.append(text)
+            elif has_offset and end is not None and start <= end:
+                # Sobreposição conhecida pelo offset: só o que passa do fim
+                pieces[-1] += text[end - start:]
+            elif has_offset and end is not None and start - end <= MAX_CONTIGUOUS_GAP:
+                # Vizinhos sem sobreposição: só o separador ficou de fora
+                pieces[-1] = pieces[-1].rstrip() + "\n" + text.lstrip()
+            elif has_offset and end is not None:
+                pieces.append(text)
+            else:
+                overlap = _overlap_length(pieces[-1], text, max_overlap)
+                if overlap:
+                    pieces[-1] += text[overlap:]
+                else:
+                    pieces.append(text)
+            if has_offset:
+                end = max(end or 0, start + len(text))
+        passages.append({
+            "source": source,
+            "page": page,
+            "file_type": group["metadata"].get("file_type"),
+            "article_path": "; ".join(dict.fromkeys(
+                path for *_, path in group["chunks"] if path)) or None,
+            "text": "\n[...]\n".join(piece.strip() for piece in pieces if piece.strip()),
+        })
+
+    packed = []
+    remaining = token_budget
+    for passage in passages:
+        tokens = estimate_tokens(passage["text"])
+        if tokens <= remaining:
+            packed.append(passage)
+            remaining -= tokens
+            continue
+        # Corta o trecho no último espaço que cabe no orçamento restante
+        if remaining >= 50:
+            cut = passage["text"][:remaining * CHARS_PER_TOKEN]
+            cut = cut[:cut.rfind(" ")] if " " in cut else cut
+            packed.append({**passage, "text": cut + " [...]"})
+        break
+    return packed
+
+
+def format_context(passages: list) -> str:
+    """
+    Formata os trechos para o prompt, identificando fonte, página e, se
+    conhecido, o artigo.
+    """
+    blocks = []
+    for number, passage in enumerate(passages, start=1):
+        label = os.path.basename(passage["source"] or "desconhecido")
+        if passage["file_type"] == ".pdf" and passage["page"] is not None:
+            # O PyPDF numera as páginas a partir de 0
+            label += f", página {passage['page'] + 1}"
+        if passage.get("article_path"):
+            label += f", {passage['article_path']}"
+        blocks.append(f"[{number}] Fonte: {label}\n{passage['text']}")
+    return "\n\n".join(blocks)
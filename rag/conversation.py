@@ -0,0 +1,294 @@
+"""
+Memória das conversas do /chat.
+
+Cada sessão guarda as últimas trocas (pergunta e resposta) até um orçamento
+fixo de tokens e um resumo do que veio antes. Quando as trocas passam do
+orçamento, as mais antigas são incorporadas ao resumo (que também tem
+tamanho máximo), então o histórico enviado no prompt não cresce com a
+conversa.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+from context import CHARS_PER_TOKEN, estimate_tokens
+
+QUERY_REWRITE_MODES = ("none", "history", "llm")
+
+
+class Conversation(NamedTuple):
+    summary: str
+    turns: list  # [pergunta, resposta], da mais antiga para a mais recente
+    folded: int  # Trocas já incorporadas ao resumo
+
+
+_EMPTY = Conversation("", [], 0)
+
+
+def truncate_tokens(text: str, token_budget: int, keep_end: bool = False) -> str:
+    """
+    Corta o texto em ``token_budget`` tokens (estimados), numa fronteira de
+    palavra. Com ``keep_end``, mantém o final em vez do começo.
+    """
+    if estimate_tokens(text) <= token_budget:
+        return text
+    limit = max(token_budget, 0) * CHARS_PER_TOKEN
+    if keep_end:
+        cut = text[len(text) - limit:]
+        return cut.split(maxsplit=1)[-1] if " " in cut else cut
+    cut = text[:limit]
+    return cut.rsplit(maxsplit=1)[0] if " " in cut else cut
+
+
+def _render_turn(question: str, answer: str) -> str:
+    return f"Usuário: {question}\nAssistente: {answer}"
+
+
+def render_history(conversation: Conversation, turn_token_budget: int, summary_token_budget: int) -> str:
+    """
+    Histórico para o prompt: o resumo e as trocas mais recentes que cabem
+    em ``turn_token_budget`` (a última sempre entra, cortada se preciso).
+    """
+    recent, remaining = [], turn_token_budget
+    for question, answer in reversed(conversation.turns):
+        text = _render_turn(question, answer)
+        tokens = estimate_tokens(text)
+        if tokens > remaining:
+            if not recent:
+                recent.append(truncate_tokens(text, remaining))
+            break
+        recent.append(text)
+        remaining -= tokens
+    parts = []
+    if conversation.summary:
+        parts.append(f"Resumo da conversa até aqui: {truncate_tokens(conversation.summary, summary_token_budget)}")
+    if recent:
+        parts.append("Mensagens recentes:\n" + "\n".join(reversed(recent)))
+    return "\n\n".join(parts)
+
+
+def summary_prompt(summary: str, turns: list, token_budget: int) -> str:
+    """
+    Prompt que pede ao LLM o resumo atualizado com as trocas que saíram da
+    janela recente. Só recebe o resumo anterior e essas trocas, então o custo
+    de cada atualização não depende do tamanho da conversa.
+    """
+    words = token_budget * CHARS_PER_TOKEN // 6
+    exchanges = "\n".join(_render_turn(question, answer) for question, answer in turns)
+    return (
+        "Atualize o resumo de uma conversa entre um usuário e um assistente que responde "
+        "sobre documentos normativos.\n"
+        f"Escreva no máximo {words} palavras, em português, em texto corrido. Mantenha os "
+        "assuntos perguntados, os fatos, números, prazos, artigos e documentos citados nas "
+        "respostas e o que ficou em aberto. Responda só com o resumo.\n\n"
+        f"Resumo atual: {summary or '(vazio)'}\n\n"
+        f"Novas mensagens:\n{exchanges}"
+    )
+
+
+def fallback_summary(summary: str, turns: list, token_budget: int) -> str:
+    """
+    Resumo extrativo, sem LLM (usado quando ele está ocupado ou falha): as
+    perguntas e o começo das respostas, mantendo o trecho mais recente.
+    """
+    lines = [summary] if summary else []
+    for question, answer in turns:
+        lines.append(f"Usuário perguntou: {question} Resposta: {truncate_tokens(answer, 40)}")
+    return truncate_tokens(" ".join(lines), token_budget, keep_end=True)
+
+
+def expand_query(conversation: Conversation, question: str) -> str:
+    """
+    Consulta de busca para uma pergunta de continuação ("e o prazo?"):
+    junta a pergunta anterior à atual.
+    """
+    if not conversation.turns:
+        return question
+    return f"{conversation.turns[-1][0]} {question}"
+
+
+def rewrite_prompt(conversation: Conversation, question: str, token_budget: int) -> str:
+    """
+    Prompt que pede ao LLM a pergunta reescrita de forma independente do
+    histórico, para a busca.
+    """
+    history = render_history(conversation, token_budget, token_budget // 2)
+    return (
+        "Reescreva a última pergunta do usuário como uma pergunta completa e independente, "
+        "que possa ser entendida sem o histórico, para buscar nos documentos. Mantenha os "
+        "termos técnicos. Responda só com a pergunta reescrita.\n\n"
+        f"{history}\n\nÚltima pergunta: {question}"
+    )
+
+
+class ConversationStore:
+    """
+    Estado das conversas por sessão, num SQLite (compartilhado entre os
+    workers do servidor, já que os pedidos de uma sessão podem cair em
+    workers diferentes).
+
+    O número de sessões é limitado: as paradas há mais de ``ttl`` segundos e,
+    acima de ``max_sessions``, as usadas há mais tempo são removidas (a
+    verificação roda a cada ``EVICT_EVERY`` gravações). As respostas
+    guardadas são cortadas em ``turn_token_budget``.
+
+    Args:
+        path (str): Arquivo do banco SQLite.
+        max_sessions (int): Número máximo de sessões.
+        ttl (float): Tempo sem uso, em segundos, até a sessão expirar.
+        turn_token_budget (int): Tokens das trocas recentes no prompt.
+        summary_token_budget (int): Tokens do resumo das trocas anteriores.
+    """
+
+    EVICT_EVERY = 64
+
+    def __init__(self, path: str, max_sessions: int = 10000, ttl: float = 86400.0,
+                 turn_token_budget: int = 600, summary_token_budget: int = 250):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.turn_token_budget = turn_token_budget
+        self.summary_token_budget = summary_token_budget
+        self.evictions = 0
+        self.compactions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        # Aberto no primeiro uso: com --preload, o servidor é importado antes
+        # do fork e cada worker precisa da sua conexão
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " summary TEXT NOT NULL,"
+                " turns TEXT NOT NULL,"
+                " folded INTEGER NOT NULL,"
+                " updated_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _read(self, connection, session_id: str) -> Conversation:
+        row = connection.execute(
+            "SELECT summary, turns, folded, updated_at FROM sessions WHERE session_id = ?",
+            (session_id,)).fetchone()
+        if row is None or (self.ttl is not None and row[3] < time.time() - self.ttl):
+            return _EMPTY
+        return Conversation(row[0], json.loads(row[1]), row[2])
+
+    def load(self, session_id: str) -> Conversation:
+        """
+        Estado da sessão (vazio se ela não existe ou expirou).
+        """
+        with self._lock:
+            return self._read(self._connect(), session_id)
+
+    def history(self, conversation: Conversation) -> str:
+        """
+        Histórico da sessão para o prompt, dentro dos orçamentos de tokens.
+        """
+        return render_history(conversation, self.turn_token_budget, self.summary_token_budget)
+
+    def append(self, session_id: str, question: str, answer: str) -> Conversation:
+        """
+        Acrescenta uma troca à sessão.
+
+        Retorna:
+            Conversation: O estado atualizado.
+        """
+        answer = truncate_tokens(answer, self.turn_token_budget)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                current = self._read(connection, session_id)
+                conversation = current._replace(turns=current.turns + [[question, answer]])
+                self._write(connection, session_id, conversation)
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(connection)
+        return conversation
+
+    def overflow(self, conversation: Conversation) -> list:
+        """
+        Trocas mais antigas que não cabem mais em ``turn_token_budget`` e
+        devem ir para o resumo (a última fica sempre de fora).
+        """
+        remaining, keep = self.turn_token_budget, 0
+        for question, answer in reversed(conversation.turns):
+            remaining -= estimate_tokens(_render_turn(question, answer))
+            if remaining < 0 and keep:
+                break
+            keep += 1
+        return conversation.turns[:len(conversation.turns) - keep]
+
+    def compact(self, session_id: str, summary: str, folded: list) -> bool:
+        """
+        Troca as trocas ``folded`` (as mais antigas da sessão) pelo novo
+        resumo. Não faz nada se outro pedido já as compactou.
+
+        Retorna:
+            bool: Se a sessão foi atualizada.
+        """
+        summary = truncate_tokens(summary.strip(), self.summary_token_budget)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                current = self._read(connection, session_id)
+                if not folded or current.turns[:len(folded)] != folded:
+                    return False
+                self._write(connection, session_id, Conversation(
+                    summary, current.turns[len(folded):], current.folded + len(folded)))
+            self.compactions += 1
+        return True
+
+    @staticmethod
+    def _write(connection, session_id: str, conversation: Conversation):
+        connection.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, summary, turns, folded, updated_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (session_id, conversation.summary, json.dumps(conversation.turns, ensure_ascii=False),
+             conversation.folded, time.time()))
+
+    def _evict(self, connection):
+        with connection:
+            removed = 0
+            if self.ttl is not None:
+                removed += connection.execute(
+                    "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,)).rowcount
+            if self.max_sessions:
+                removed += connection.execute(
+                    "DELETE FROM sessions WHERE session_id IN ("
+                    " SELECT session_id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_sessions,)).rowcount
+        self.evictions += removed
+
+    def delete(self, session_id: str) -> bool:
+        """
+        Apaga uma sessão.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(
+                    "DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {
+            "sessions": sessions,
+            "max_sessions": self.max_sessions,
+            "evictions": self.evictions,
+            "compactions": self.compactions,
+        }
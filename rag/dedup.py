@@ -0,0 +1,383 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import zlib
+
+import numpy as np
+
+# Primo de Mersenne 2^31 - 1: com coeficientes e hashes abaixo de 2^32, o
+# produto cabe em 64 bits sem estourar
+_PRIME = (1 << 31) - 1
+_DIGITS = re.compile(r"\d+")
+# Números, valores, datas e identificadores de dispositivos (§, incisos,
+# alíneas): chunks que diferem num deles nunca são quase-duplicatas
+_IDENTIFIERS = re.compile(r"\S*\d\S*|§|\b[IVXLCDM]+(?=\s*[-–—.,;:)])|\b[a-z]\)")
+
+
+def _normalize_line(line: str) -> str:
+    # Números variam entre páginas ("Página 3 de 10", datas, nº do documento)
+    return _DIGITS.sub("#", " ".join(line.lower().split()))
+
+
+def strip_repeated_lines(documents: list, min_pages: int = 3, min_fraction: float = 0.5,
+                         edge_lines: int = 3) -> list:
+    """
+    Remove cabeçalhos e rodapés repetidos nas páginas de um arquivo.
+
+    Uma linha é considerada cabeçalho/rodapé quando aparece (ignorando
+    números) entre as ``edge_lines`` primeiras ou últimas linhas de pelo
+    menos ``min_fraction`` das páginas. Só as bordas de cada página são
+    removidas; o corpo do texto nunca é alterado.
+
+    Args:
+        documents (list): Páginas (Documents) de um mesmo arquivo.
+        min_pages (int): Arquivos com menos páginas não são alterados.
+        min_fraction (float): Fração mínima de páginas com a linha.
+        edge_lines (int): Linhas examinadas no topo e no fim de cada página.
+
+    Retorna:
+        list: Páginas sem as linhas repetidas (os objetos originais quando
+        não há nada a remover).
+    """
+    if len(documents) < min_pages:
+        return documents
+    pages = [_page_edges(document, edge_lines) for document in documents]
+    repeated = _repeated_lines(pages, min_pages, min_fraction)
+    if not repeated:
+        return documents
+    return [_strip_page(document, page, repeated) for document, page in zip(documents, pages)]
+
+
+def _page_edges(document, edge_lines: int) -> tuple:
+    """
+    Linhas da página e os índices das linhas não vazias do topo e do fim.
+    """
+    lines = document.page_content.split("\n")
+    content = [index for index, line in enumerate(lines) if line.strip()]
+    # Em páginas curtas, topo e fim não avançam sobre a metade oposta
+    edge = min(edge_lines, len(content) // 2)
+    return lines, content[:edge], content[len(content) - edge:]
+
+
+def _repeated_lines(pages: list, min_pages: int, min_fraction: float) -> set:
+    counts = {}
+    for lines, top, bottom in pages:
+        for key in {_normalize_line(lines[index]) for index in top + bottom}:
+            counts[key] = counts.get(key, 0) + 1
+    threshold = max(min_pages, min_fraction * len(pages))
+    return {key for key, count in counts.items() if count >= threshold}
+
+
+def _strip_page(document, page: tuple, repeated: set):
+    lines, top, bottom = page
+    removed = set()
+    for index in top:
+        if _normalize_line(lines[index]) not in repeated:
+            break
+        removed.add(index)
+    for index in reversed(bottom):
+        if _normalize_line(lines[index]) not in repeated:
+            break
+        removed.add(index)
+    if not removed:
+        return document
+    text = "\n".join(line for index, line in enumerate(lines) if index not in removed)
+    return type(document)(page_content=text.strip("\n"), metadata=dict(document.metadata))
+
+
+class RepeatedLineStripper:
+    """
+    Versão incremental de ``strip_repeated_lines``, para arquivos carregados
+    página a página.
+
+    As linhas repetidas são identificadas nas ``sample_pages`` primeiras
+    páginas, retidas até a amostra fechar; depois disso cada página é limpa
+    assim que chega. Arquivos com até ``sample_pages`` páginas têm o mesmo
+    resultado de ``strip_repeated_lines``.
+
+    Args:
+        sample_pages (int): Páginas usadas para identificar as repetições.
+        min_pages, min_fraction, edge_lines: Como em ``strip_repeated_lines``.
+    """
+
+    def __init__(self, sample_pages: int = 32, min_pages: int = 3, min_fraction: float = 0.5,
+                 edge_lines: int = 3):
+        self.sample_pages = sample_pages
+        self.min_pages = min_pages
+        self.min_fraction = min_fraction
+        self.edge_lines = edge_lines
+        self._sample = []
+        self._repeated = None
+
+    def feed(self, documents: list) -> list:
+        """
+        Recebe as próximas páginas e retorna as que já podem seguir (nenhuma
+        enquanto a amostra não fecha).
+        """
+        if self._repeated is None:
+            self._sample.extend(documents)
+            if len(self._sample) < self.sample_pages:
+                return []
+            pages = [_page_edges(document, self.edge_lines) for document in self._sample]
+            self._repeated = _repeated_lines(pages, self.min_pages, self.min_fraction)
+            sample, self._sample = self._sample, []
+            return [_strip_page(document, page, self._repeated) for document, page in zip(sample, pages)]
+        if not self._repeated:
+            return list(documents)
+        return [
+            _strip_page(document, _page_edges(document, self.edge_lines), self._repeated)
+            for document in documents
+        ]
+
+    def finish(self) -> list:
+        """
+        Páginas ainda retidas ao fim do arquivo.
+        """
+        sample, self._sample = self._sample, []
+        if self._repeated is not None:
+            return sample
+        return strip_repeated_lines(sample, self.min_pages, self.min_fraction, self.edge_lines)
+
+
+class MinHasher:
+    """
+    Assinaturas MinHash de textos (shingles de ``shingle_size`` palavras).
+
+    A fração de posições iguais entre duas assinaturas estima a similaridade
+    de Jaccard entre os conjuntos de shingles dos textos.
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = generator.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        words = text.split()
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64, count=len(shingles))
+        values = (hashes[:, None] * self._a + self._b) % _PRIME
+        return values.min(axis=0).astype(np.uint32)
+
+
+class DedupIndex:
+    """
+    Índice persistente (SQLite) para eliminar chunks duplicados antes do
+    embedding.
+
+    Cada chunk gravado no banco vetorial é "canônico" e tem aqui o hash do
+    texto normalizado (duplicatas exatas) e a assinatura MinHash, dividida em
+    faixas para LSH (quase-duplicatas: Jaccard estimado >= ``threshold``).
+    Uma quase-duplicata precisa ainda ter exatamente os mesmos números e
+    identificadores (valores, datas, artigos, incisos) que o canônico: em
+    textos normativos, é justamente isso que diferencia dois trechos
+    parecidos. Só chunks do mesmo arquivo são comparados: uma busca filtrada
+    por ``source`` precisa achar o conteúdo em cada arquivo que o contém.
+    Chunks repetidos não são embedados nem gravados; ficam registrados como
+    duplicatas do canônico, com seus metadados e texto, para que a origem não
+    se perca e para que um deles assuma o lugar do canônico se este sumir.
+
+    Args:
+        path (str): Arquivo do banco SQLite.
+        threshold (float): Similaridade mínima para considerar duplicata.
+        num_perm (int): Tamanho da assinatura MinHash.
+        bands (int): Faixas do LSH (``num_perm`` deve ser múltiplo).
+    """
+
+    def __init__(self, path: str, threshold: float = 0.85, num_perm: int = 128, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm deve ser múltiplo de bands.")
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.hasher = MinHasher(num_perm)
+        self._lock = threading.RLock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS canonical (
+                id TEXT PRIMARY KEY, source TEXT NOT NULL,
+                text_hash TEXT NOT NULL, signature BLOB NOT NULL);
+            CREATE INDEX IF NOT EXISTS canonical_text_hash ON canonical (text_hash);
+            CREATE INDEX IF NOT EXISTS canonical_source ON canonical (source);
+            CREATE TABLE IF NOT EXISTS bands (band_key INTEGER NOT NULL, id TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS bands_key ON bands (band_key);
+            CREATE INDEX IF NOT EXISTS bands_id ON bands (id);
+            CREATE TABLE IF NOT EXISTS duplicates (
+                id TEXT PRIMARY KEY, canonical TEXT NOT NULL, source TEXT NOT NULL,
+                metadata TEXT NOT NULL, text TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS duplicates_canonical ON duplicates (canonical);
+            CREATE INDEX IF NOT EXISTS duplicates_source ON duplicates (source);
+        """)
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(canonical)")}
+        if "identifiers" not in columns:
+            # Índices anteriores: sem os identificadores, esses canônicos só
+            # recebem duplicatas exatas
+            self._connection.execute("ALTER TABLE canonical ADD COLUMN identifiers TEXT")
+
+    def fingerprint(self, text: str) -> tuple:
+        """
+        Hash do texto normalizado, assinatura MinHash e hash dos números e
+        identificadores do texto, na ordem em que aparecem.
+        """
+        normalized = " ".join(text.lower().split())
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+        identifiers = " ".join(token.rstrip(".,;:") for token in _IDENTIFIERS.findall(text))
+        return (digest, self.hasher.signature(normalized),
+                hashlib.sha1(identifiers.encode("utf-8")).hexdigest()[:16])
+
+    def _band_keys(self, signature: np.ndarray) -> list:
+        keys = []
+        for band, values in enumerate(np.split(signature, self.bands)):
+            digest = hashlib.blake2b(values.tobytes(), digest_size=8, person=band.to_bytes(2, "big")).digest()
+            keys.append(int.from_bytes(digest, "big", signed=True))
+        return keys
+
+    def find(self, fingerprint: tuple, source: str):
+        """
+        ID do chunk canônico do arquivo ``source`` igual ou quase igual, ou
+        None.
+        """
+        digest, signature, identifiers = fingerprint
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id FROM canonical WHERE text_hash = ? AND source = ? LIMIT 1",
+                (digest, source)).fetchone()
+            if row is not None:
+                return row[0]
+            keys = self._band_keys(signature)
+            candidates = self._connection.execute(
+                "SELECT DISTINCT c.id, c.signature FROM bands b JOIN canonical c ON c.id = b.id "
+                f"WHERE b.band_key IN ({', '.join('?' for _ in keys)}) AND c.identifiers = ? AND c.source = ?",
+                [*keys, identifiers, source]).fetchall()
+        best_id, best_score = None, self.threshold
+        for chunk_id, stored in candidates:
+            score = float(np.mean(np.frombuffer(stored, dtype=np.uint32) == signature))
+            if score >= best_score:
+                best_id, best_score = chunk_id, score
+        return best_id
+
+    def add(self, chunk_id: str, source: str, fingerprint: tuple):
+        """
+        Registra um chunk canônico (gravado no banco vetorial).
+        """
+        digest, signature, identifiers = fingerprint
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO canonical (id, source, text_hash, signature, identifiers)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (chunk_id, source, digest, signature.tobytes(), identifiers))
+            self._connection.execute("DELETE FROM bands WHERE id = ?", (chunk_id,))
+            self._connection.executemany(
+                "INSERT INTO bands VALUES (?, ?)",
+                [(key, chunk_id) for key in self._band_keys(signature)])
+
+    def add_duplicate(self, chunk_id: str, canonical_id: str, metadata: dict, text: str):
+        """
+        Registra um chunk descartado como duplicata de ``canonical_id``.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO duplicates VALUES (?, ?, ?, ?, ?)",
+                (chunk_id, canonical_id, metadata["source"],
+                 json.dumps(metadata, ensure_ascii=False), text))
+
+    def remove_sources(self, sources: list) -> tuple:
+        """
+        Remove os chunks (canônicos e duplicatas) dos arquivos indicados,
+        que vão ser reprocessados ou foram apagados.
+
+        Retorna:
+            tuple: (órfãs, afetados). ``órfãs`` são as duplicatas de outros
+            arquivos cujo canônico foi removido (dicts com id, canonical,
+            source, metadata e text), a promover com ``promote``;
+            ``afetados`` são os canônicos restantes que perderam duplicatas.
+        """
+        orphans, touched = [], set()
+        with self._lock:
+            for start in range(0, len(sources), 500):
+                batch = list(sources[start:start + 500])
+                placeholders = ", ".join("?" for _ in batch)
+                touched.update(chunk_id for (chunk_id,) in self._connection.execute(
+                    f"SELECT DISTINCT canonical FROM duplicates WHERE source IN ({placeholders})", batch))
+                self._connection.execute(f"DELETE FROM duplicates WHERE source IN ({placeholders})", batch)
+                removed = [chunk_id for (chunk_id,) in self._connection.execute(
+                    f"SELECT id FROM canonical WHERE source IN ({placeholders})", batch)]
+                self._connection.execute(f"DELETE FROM canonical WHERE source IN ({placeholders})", batch)
+                for offset in range(0, len(removed), 500):
+                    ids = removed[offset:offset + 500]
+                    id_placeholders = ", ".join("?" for _ in ids)
+                    self._connection.execute(f"DELETE FROM bands WHERE id IN ({id_placeholders})", ids)
+                    orphans.extend(
+                        {"id": chunk_id, "canonical": canonical, "source": source,
+                         "metadata": json.loads(metadata), "text": text}
+                        for chunk_id, canonical, source, metadata, text in self._connection.execute(
+                            "SELECT id, canonical, source, metadata, text FROM duplicates "
+                            f"WHERE canonical IN ({id_placeholders}) ORDER BY id", ids))
+        removed_ids = {orphan["canonical"] for orphan in orphans}
+        return orphans, touched - removed_ids
+
+    def promote(self, orphans: list) -> list:
+        """
+        Para cada canônico removido, a primeira duplicata órfã vira o novo
+        canônico e as demais passam a apontar para ela.
+
+        Retorna:
+            list: As duplicatas promovidas, que precisam ser embedadas e
+            gravadas no banco vetorial.
+        """
+        promoted = {}
+        with self._lock:
+            for orphan in orphans:
+                new_canonical = promoted.get(orphan["canonical"])
+                if new_canonical is None:
+                    promoted[orphan["canonical"]] = orphan
+                    self._connection.execute("DELETE FROM duplicates WHERE id = ?", (orphan["id"],))
+                    self.add(orphan["id"], orphan["source"], self.fingerprint(orphan["text"]))
+                else:
+                    self._connection.execute(
+                        "UPDATE duplicates SET canonical = ? WHERE id = ?",
+                        (new_canonical["id"], orphan["id"]))
+        return list(promoted.values())
+
+    def duplicates(self, canonical_ids: list) -> dict:
+        """
+        Metadados das duplicatas de cada canônico (ID -> lista de dicts).
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(canonical_ids), 500):
+                batch = list(canonical_ids[start:start + 500])
+                placeholders = ", ".join("?" for _ in batch)
+                for canonical, metadata in self._connection.execute(
+                        f"SELECT canonical, metadata FROM duplicates WHERE canonical IN ({placeholders}) "
+                        "ORDER BY source, id", batch):
+                    found.setdefault(canonical, []).append(json.loads(metadata))
+        return found
+
+    def stats(self) -> dict:
+        with self._lock:
+            canonical = self._connection.execute("SELECT COUNT(*) FROM canonical").fetchone()[0]
+            duplicates = self._connection.execute("SELECT COUNT(*) FROM duplicates").fetchone()[0]
+        return {"canonical": canonical, "duplicates": duplicates, "threshold": self.threshold}
+
+    def save(self):
+        """
+        Confirma as alterações no disco.
+        """
+        with self._lock:
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,14 +1,40 @@
+import asyncio
+import atexit
+import hashlib
+import json
 import os
-import chromadb
-from chromadb.utils import embedding_functions
-from dotenv import load_dotenv
-from langchain_community.document_loaders import (
-    PyPDFDirectoryLoader,
-    TextLoader,
-    UnstructuredWordDocumentLoader,
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache, ParseCache, SemanticAnswerCache, chunk_keys, normalize_query
+from context import format_context, pack_context
+from conversation import (
+    QUERY_REWRITE_MODES, expand_query, fallback_summary, rewrite_prompt, summary_prompt,
+)
+from dedup import DedupIndex, RepeatedLineStripper, strip_repeated_lines
+from ingest_manifest import IngestManifest
+from ingest_pipeline import IngestPipeline
+from legal_splitter import LegalTextSplitter
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from llm import GeminiClient, LLMBusyError
+from loaders import (
+    LoadedPages,
+    chunk_id,
+    file_hash,
+    iter_load_files,
+    list_data_files,
+    loader_version,
+    stream_load_files,
+    text_hash,
 )
-import google.generativeai as genai
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from logger import get_logger
+from metrics import CACHE_LOOKUPS, CHAT_COALESCED, INGEST_FILES, record, run_in_context, span
+from singleflight import SingleFlight
+from vector_database import make_vector_base
+
+logger = get_logger(__name__)
 
 
 class DocumentProcessor:
@@ -16,81 +42,399 @@ class DocumentProcessor:
     Classe para processar documentos, gerar embeddings e armazenar no ChromaDB.
     """
 
-    def __init__(self, data_path: str, chroma_path: str, collection_name: str = "lei"):
-
-        load_dotenv()
-
-        api_key = os.getenv("GEMINI_API_KEY")
-
-        if not api_key:
-            raise ValueError(
-                "A chave da API 'GEMINI_API_KEY' não foi encontrada. Verifique o arquivo .env.")
+    def __init__(self, data_path: str, chroma_path: str, collection_name: str = "lei",
+                 embedding_cache_size: int = 1024, retrieval_cache_size: int = 512,
+                 retrieval_cache_ttl: float = 600.0, answer_cache_threshold: float = None,
+                 answer_cache_size: int = 1000, answer_cache_path: str = None,
+                 llm=None, retrieval_workers: int = 8, hybrid_search: bool = True,
+                 rrf_k: int = 60, context_token_budget: int = 1500,
+                 embedding_model: str = "all-MiniLM-L6-v2", embedding_backend: str = "torch",
+                 embedding_batch_size: int = 32, embedding_threads: int = None,
+                 vector_backend: str = "chroma", vector_options: dict = None,
+                 embedding_service: str = None, embedding_function=None,
+                 parse_cache: bool = True, parse_cache_path: str = None,
+                 strip_boilerplate: bool = True, dedup_threshold: float = 0.85,
+                 conversations=None, query_rewrite: str = "history", coalesce: bool = True):
 
-        genai.configure(api_key=api_key)
         self.data_path = data_path
         self.chroma_path = chroma_path
         self.collection_name = collection_name
+        self.manifest_path = os.path.join(
+            self.chroma_path, f"{self.collection_name}_manifest.json")
+        self.lexical_index_path = os.path.join(
+            self.chroma_path, f"{self.collection_name}_bm25.pkl")
+        # Texto extraído por arquivo, para não refazer o parsing ao mudar o
+        # chunking ou o modelo de embedding (aberto no primeiro uso)
+        self.parse_cache_path = parse_cache_path or os.path.join(self.chroma_path, "parse_cache.sqlite")
+        self._use_parse_cache = parse_cache
+        self._parse_cache = None
+        # Cabeçalhos/rodapés repetidos e chunks quase iguais (limiar de
+        # Jaccard; None desativa) não são embedados nem gravados
+        self.strip_boilerplate = strip_boilerplate
+        self.dedup_threshold = dedup_threshold
+        self.dedup_index_path = os.path.join(
+            self.chroma_path, f"{self.collection_name}_dedup.sqlite")
+        self.hybrid_search = hybrid_search
+        self.rrf_k = rrf_k
+        self.context_token_budget = context_token_budget
+        self.embedding_model = embedding_model
+        self.embedding_backend = embedding_backend
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_threads = embedding_threads
+        self.embedding_service = embedding_service
+        self.vector_backend = vector_backend
+        self.vector_options = vector_options or {}
 
         if not os.path.exists(self.data_path):
             raise FileNotFoundError(
                 f"O diretório de dados {self.data_path} não existe.")
 
-        # Função de embedding
-        embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="all-MiniLM-L6-v2"
-        )
+        # Componentes pesados (modelo de embedding, banco vetorial, índice
+        # BM25 e cliente do LLM) são criados no primeiro uso ou em warm_up(), para
+        # que importar/instanciar o processador seja rápido.
+        self._llm = llm
+        # Uma função de embedding já carregada pode ser compartilhada entre
+        # processadores (ex.: troca de versão da coleção no servidor)
+        self._embedding_function = embedding_function
+        self._vector_store = None
+        self._lexical_index = None
+        self._init_lock = threading.RLock()
+        # Tempo de inicialização de cada componente, em segundos
+        self.timings = {}
 
-        # Cliente e coleção do ChromaDB
-        self.chroma_client = chromadb.PersistentClient(path=self.chroma_path)
-        self.collection = self.chroma_client.get_or_create_collection(
-            name=self.collection_name,
-            embedding_function=embedding_function
-        )
+        # Caches da consulta: pergunta normalizada -> embedding e
+        # (embedding, n_results, filtros) -> chunks recuperados.
+        self.embedding_cache = LRUCache(maxsize=embedding_cache_size)
+        self.retrieval_cache = LRUCache(
+            maxsize=retrieval_cache_size, ttl=retrieval_cache_ttl)
+        self._cache_generation = self._collection_generation()
+
+        # Threads para a busca no modo async, que não pode bloquear o event loop
+        self._retrieval_executor = ThreadPoolExecutor(
+            max_workers=retrieval_workers, thread_name_prefix="retrieval")
+        # Busca vetorial em paralelo com a lexical (pool separado para não
+        # disputar vagas com as buscas que rodam no pool acima)
+        self._search_executor = ThreadPoolExecutor(
+            max_workers=retrieval_workers, thread_name_prefix="vector-search")
+
+        # Cache semântico de respostas (opcional): reaproveita a resposta de
+        # uma pergunta parecida quando os chunks recuperados são os mesmos.
+        self.answer_cache = None
+        if answer_cache_threshold is not None:
+            self.answer_cache = SemanticAnswerCache(
+                maxsize=answer_cache_size,
+                threshold=answer_cache_threshold,
+                path=answer_cache_path,
+            )
+            if answer_cache_path:
+                atexit.register(self.answer_cache.save)
+
+        # Memória das conversas (ConversationStore, opcional) e como a
+        # pergunta de continuação vira consulta de busca: "none" (como
+        # veio), "history" (junta a pergunta anterior) ou "llm" (reescrita
+        # pelo LLM)
+        if query_rewrite not in QUERY_REWRITE_MODES:
+            raise ValueError(f"query_rewrite deve ser um de {QUERY_REWRITE_MODES}.")
+        self.conversations = conversations
+        self.query_rewrite = query_rewrite
+        # Resumos das conversas em andamento (referências para não serem
+        # coletados antes de terminar)
+        self._background_tasks = set()
+        # Pedidos iguais em andamento no astream_answer compartilham uma
+        # única busca e geração
+        self.coalesce = coalesce
+        self._flights = SingleFlight()
+
+    def _init_component(self, attribute: str, name: str, factory):
+        """
+        Cria um componente preguiçosamente (uma única vez, mesmo com várias
+        threads) e registra o tempo gasto.
+        """
+        value = getattr(self, attribute)
+        if value is None:
+            with self._init_lock:
+                value = getattr(self, attribute)
+                if value is None:
+                    started = time.perf_counter()
+                    value = factory()
+                    setattr(self, attribute, value)
+                    self.timings[name] = round(time.perf_counter() - started, 3)
+        return value
+
+    @property
+    def embedding_function(self):
+        """
+        Função de embedding (carrega o modelo no primeiro acesso). Modelo e
+        runtime (PyTorch ou ONNX/int8) vêm de ``embedding_model`` e
+        ``embedding_backend``.
+
+        Com ``embedding_service`` (caminho de um socket Unix), o modelo não é
+        carregado neste processo: os textos vão para o serviço compartilhado
+        de ``embedding_service.py``, que agrupa pedidos de todos os workers.
+        """
+        if self.embedding_service:
+            from embedding_service import EmbeddingServiceClient
+
+            return self._init_component(
+                "_embedding_function", "embedding_model",
+                lambda: EmbeddingServiceClient(self.embedding_service))
+
+        from embeddings import SentenceTransformerEmbedder
+
+        return self._init_component(
+            "_embedding_function", "embedding_model",
+            lambda: SentenceTransformerEmbedder(
+                model_name=self.embedding_model,
+                backend=self.embedding_backend,
+                batch_size=self.embedding_batch_size,
+                num_threads=self.embedding_threads,
+            ))
+
+    @property
+    def vector_store(self):
+        """
+        Banco vetorial (aberto no primeiro acesso). ``vector_backend``
+        escolhe entre ChromaDB, matriz float16 em mmap e índices FAISS; ver
+        ``vector_database``.
+        """
+        def open_store():
+            store = make_vector_base(
+                self.vector_backend,
+                self.chroma_path,
+                self.collection_name,
+                # Só o ChromaDB guarda a função de embedding na coleção
+                embedding_function=self.embedding_function if self.vector_backend == "chroma" else None,
+                **self.vector_options,
+            )
+            logger.info(
+                f"Banco vetorial '{self.vector_backend}' inicializado. "
+                f"Coleção '{self.collection_name}' pronta em '{self.chroma_path}'.")
+            return store
+
+        return self._init_component("_vector_store", "vector_store", open_store)
+
+    @property
+    def lexical_index(self) -> BM25Index:
+        """
+        Índice BM25 sobre os mesmos chunks, para a busca híbrida.
+        """
+        return self._init_component(
+            "_lexical_index", "lexical_index",
+            lambda: BM25Index.load(self.lexical_index_path))
+
+    @lexical_index.setter
+    def lexical_index(self, index: BM25Index):
+        self._lexical_index = index
+
+    @property
+    def llm(self):
+        """
+        Cliente do LLM, criado uma vez e reutilizado em todas as consultas.
+        """
+        return self._init_component("_llm", "llm_client", GeminiClient)
+
+    def warm_up(self, dummy_embed: bool = True) -> dict:
+        """
+        Inicializa todos os componentes pesados antes da primeira consulta.
+
+        Args:
+            dummy_embed (bool): Faz um embedding de teste, para também
+                inicializar os kernels/threads do modelo. Desative ao aquecer
+                antes de um fork (ex.: ``gunicorn --preload``), pois pools de
+                threads do PyTorch não sobrevivem ao fork.
+
+        Retorna:
+            dict: Tempo de inicialização de cada componente, em segundos.
+        """
+        embedding_function = self.embedding_function
+        if dummy_embed:
+            started = time.perf_counter()
+            embedding_function(["aquecimento"])
+            self.timings["dummy_embed"] = round(time.perf_counter() - started, 3)
+        self.vector_store.count()
+        self.lexical_index
+        self.llm
+        return dict(self.timings)
 
-        print(
-            f"ChromaDB inicializado. Coleção '{self.collection_name}' pronta em '{self.chroma_path}'.")
+    def close(self):
+        """
+        Libera os pools de threads e o banco vetorial e grava o cache de
+        respostas. Chamado quando o processador é substituído (ex.: nova
+        versão da coleção).
+        """
+        self._retrieval_executor.shutdown(wait=False)
+        self._search_executor.shutdown(wait=False)
+        if self._vector_store is not None:
+            self._vector_store.close()
+        if self.answer_cache is not None and self.answer_cache.path:
+            self.answer_cache.save()
+        if self._parse_cache is not None:
+            self._parse_cache.close()
 
-    def _load_raw_documents(self) -> list:
+    def _load_raw_documents(self, file_paths: list = None, max_workers: int = None, file_timeout: float = None) -> list:
         """
         Carrega documentos do diretório.
 
+        Args:
+            file_paths (list): Arquivos a carregar. Se None, todos os
+                arquivos suportados de ``data_path``.
+            max_workers (int): Processos usados no parsing.
+            file_timeout (float): Tempo máximo por arquivo, em segundos.
+
         Retorna:
             list: Lista de objetos Document.
         """
-        loaders = []
         raw_documents = []
+        for _, documents in self._iter_raw_documents(file_paths, max_workers, file_timeout):
+            raw_documents.extend(documents)
 
-        pdf_files_exist = any(file.endswith(".pdf")
-                              for file in os.listdir(self.data_path))
-        if pdf_files_exist:
-            loaders.append(PyPDFDirectoryLoader(self.data_path))
-        else:
-            print(f"Nenhum arquivo PDF encontrado em {self.data_path}.")
-
-        for file_name in os.listdir(self.data_path):
-            file_path = os.path.join(self.data_path, file_name)
-            if file_name.endswith(".txt"):
-                loaders.append(TextLoader(file_path, encoding="utf-8"))
-            elif file_name.endswith(".docx"):
-                loaders.append(UnstructuredWordDocumentLoader(file_path))
-
-        if not loaders:
-            print(
-                f"Nenhum loader configurado. Verifique os arquivos em {self.data_path}.")
-            return []
+        logger.info(f"Total de {len(raw_documents)} documentos carregados.")
+        return raw_documents
 
-        for loader in loaders:
-            try:
-                print(
-                    f"Carregando documentos com: {loader.__class__.__name__}")
-                raw_documents.extend(loader.load())
-            except Exception as e:
-                print(f"Erro ao carregar com {loader.__class__.__name__}: {e}")
+    @property
+    def parse_cache(self):
+        """
+        Cache do texto extraído (``ParseCache``), ou None se desativado.
+        """
+        if self._use_parse_cache and self._parse_cache is None:
+            with self._init_lock:
+                if self._parse_cache is None:
+                    self._parse_cache = ParseCache(self.parse_cache_path)
+        return self._parse_cache
 
-        print(f"Total de {len(raw_documents)} documentos carregados.")
-        return raw_documents
+    def _iter_raw_documents(self, file_paths: list = None, max_workers: int = None,
+                            file_timeout: float = None, digests: dict = None):
+        """
+        Carrega os arquivos em paralelo, produzindo (caminho, documentos) à
+        medida que cada arquivo termina. Arquivos com erro são ignorados.
+
+        Arquivos já extraídos antes (mesmo conteúdo e mesma versão do loader)
+        vêm do cache de parsing, sem passar pelo pool de processos. Com
+        ``strip_boilerplate``, cabeçalhos e rodapés repetidos nas páginas de
+        cada arquivo são removidos (o cache guarda o texto original).
 
-    def _split_documents(self, raw_documents: list, chunk_size: int = 400, chunk_overlap: int = 100) -> list:
+        Args:
+            digests (dict): Hashes já calculados (caminho -> hash).
+        """
+        if file_paths is None:
+            file_paths = list_data_files(self.data_path)
+
+        if not file_paths:
+            logger.warning(
+                f"Nenhum arquivo suportado encontrado em {self.data_path}.")
+            return
+
+        from langchain_core.documents import Document
+
+        cache = self.parse_cache
+        digests = dict(digests or {})
+        to_load = file_paths
+        if cache is not None:
+            to_load = []
+            for file_path in file_paths:
+                digest = digests.get(file_path) or file_hash(file_path)
+                digests[file_path] = digest
+                pages = cache.get(digest, loader_version(file_path))
+                CACHE_LOOKUPS.labels("parse", "miss" if pages is None else "hit").inc()
+                if pages is None:
+                    to_load.append(file_path)
+                    continue
+                # O mesmo conteúdo pode estar em outro caminho
+                documents = [
+                    Document(page_content=text, metadata={**metadata, "source": file_path})
+                    for text, metadata in pages
+                ]
+                logger.info(f"Carregado do cache: {file_path} ({len(documents)} documentos)")
+                yield file_path, self._strip(documents)
+
+        for file_path, documents, error in iter_load_files(to_load, max_workers, file_timeout):
+            if error is not None:
+                logger.error(f"Erro ao carregar {file_path}: {error}")
+                INGEST_FILES.labels("error").inc()
+                continue
+            logger.info(f"Carregado: {file_path} ({len(documents)} documentos)")
+            if cache is not None:
+                cache.put(
+                    digests[file_path],
+                    loader_version(file_path),
+                    [(document.page_content, document.metadata) for document in documents],
+                )
+            yield file_path, self._strip(documents)
+
+    def _iter_raw_pages(self, file_paths: list, max_workers: int = None, file_timeout: float = None,
+                        digests: dict = None, memory_limit: int = None, batch_size: int = 64):
+        """
+        Como ``_iter_raw_documents``, mas entrega as páginas em lotes
+        (``LoadedPages``) à medida que são extraídas, sem montar a lista de
+        páginas de um arquivo inteiro (ver ``stream_load_files``). O cache de
+        parsing é lido e gravado aos poucos, e os cabeçalhos/rodapés são
+        identificados nas primeiras páginas de cada arquivo
+        (``RepeatedLineStripper``).
+
+        Args:
+            memory_limit (int): Teto de RSS do parsing, em bytes.
+            batch_size (int): Páginas por lote lidas do cache.
+        """
+        from langchain_core.documents import Document
+
+        cache = self.parse_cache
+        digests = dict(digests or {})
+        to_load = file_paths
+        if cache is not None:
+            to_load = []
+            for file_path in file_paths:
+                digest = digests.get(file_path) or file_hash(file_path)
+                digests[file_path] = digest
+                pages = cache.iter_pages(digest, loader_version(file_path))
+                CACHE_LOOKUPS.labels("parse", "miss" if pages is None else "hit").inc()
+                if pages is None:
+                    to_load.append(file_path)
+                    continue
+                stripper = RepeatedLineStripper() if self.strip_boilerplate else None
+                batch, count = [], 0
+                for text, metadata in pages:
+                    batch.append(Document(page_content=text, metadata={**metadata, "source": file_path}))
+                    if len(batch) >= batch_size:
+                        count += len(batch)
+                        yield LoadedPages(file_path, stripper.feed(batch) if stripper else batch)
+                        batch = []
+                count += len(batch)
+                logger.info(f"Carregado do cache: {file_path} ({count} documentos)")
+                if stripper:
+                    batch = stripper.feed(batch) + stripper.finish()
+                yield LoadedPages(file_path, batch, True)
+
+        # Estado dos arquivos em andamento: (stripper, gravação no cache, páginas)
+        loading = {}
+        for loaded in stream_load_files(to_load, max_workers, file_timeout, memory_limit=memory_limit):
+            file_path = loaded.file_path
+            if file_path not in loading:
+                writer = cache.writer(digests[file_path], loader_version(file_path)) if cache is not None else None
+                stripper = RepeatedLineStripper() if self.strip_boilerplate else None
+                loading[file_path] = [stripper, writer, 0]
+            state = loading[file_path]
+            stripper, writer = state[0], state[1]
+            state[2] += len(loaded.pages)
+            if writer is not None:
+                writer.add([(document.page_content, document.metadata) for document in loaded.pages])
+            pages = stripper.feed(loaded.pages) if stripper else loaded.pages
+            if loaded.last:
+                del loading[file_path]
+                if loaded.error is None:
+                    if writer is not None:
+                        writer.commit()
+                    if stripper:
+                        pages += stripper.finish()
+                    logger.info(f"Carregado: {file_path} ({state[2]} documentos)")
+            elif not pages:
+                continue
+            yield loaded._replace(pages=pages)
+
+    def _strip(self, documents: list) -> list:
+        return strip_repeated_lines(documents) if self.strip_boilerplate else documents
+
+    def _split_documents(self, raw_documents: list, chunk_size: int = 400, chunk_overlap: int = 100,
+                         chunker: str = "legal") -> list:
         """
         Divide documentos em chunks menores.
 
@@ -98,63 +442,411 @@ class DocumentProcessor:
             raw_documents (list): Lista de documentos carregados.
             chunk_size (int): Tamanho máximo dos chunks.
             chunk_overlap (int): Sobreposição entre os chunks.
+            chunker (str): "legal" ou "recursive" (ver ``_make_splitter``).
 
         Retorna:
             list: Lista de chunks.
         """
         if not raw_documents:
-            print("Nenhum documento para dividir.")
+            logger.warning("Nenhum documento para dividir.")
             return []
 
-        text_splitter = RecursiveCharacterTextSplitter(
+        text_splitter = self._make_splitter(chunk_size, chunk_overlap, chunker)
+        chunks = text_splitter.split_documents(raw_documents)
+        logger.info(f"{len(chunks)} chunks criados.")
+        return chunks
+
+    @staticmethod
+    def _make_splitter(chunk_size: int, chunk_overlap: int, chunker: str = "legal"):
+        """
+        Cria o splitter usado na ingestão: "legal" (``LegalTextSplitter``,
+        que respeita artigos, parágrafos, incisos e seções) ou "recursive"
+        (só por caracteres).
+        """
+        if chunker == "legal":
+            return LegalTextSplitter(chunk_size, chunk_overlap)
+        if chunker != "recursive":
+            raise ValueError(f"Chunker desconhecido: {chunker!r}. Use 'legal' ou 'recursive'.")
+
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        return RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            length_function=len
+            length_function=len,
+            add_start_index=True
         )
-        chunks = text_splitter.split_documents(raw_documents)
-        print(f"{len(chunks)} chunks criados.")
-        return chunks
 
-    def process_and_ingest_documents(self, chunk_size: int = 400, chunk_overlap: int = 100):
+    @staticmethod
+    def _chunk_metadata(chunk) -> dict:
         """
-        Processa os documentos e injeta no ChromaDB.
+        Metadados gravados no banco vetorial para um chunk.
         """
-        raw_documents = self._load_raw_documents()
-        if not raw_documents:
-            print("Nenhum documento carregado. Processo encerrado.")
-            return
+        source = chunk.metadata.get("source", "desconhecido")
+        file_type = os.path.splitext(
+            source)[1] if source != "desconhecido" else "unknown"
+        metadata = {
+            "source": str(source),
+            "file_type": str(file_type),
+            "page": int(chunk.metadata.get("page", 0)),
+            "start_index": int(chunk.metadata.get("start_index", 0)),
+        }
+        # Estrutura do texto, quando dividido pelo LegalTextSplitter
+        for key in ("section", "article", "article_path"):
+            if chunk.metadata.get(key):
+                metadata[key] = str(chunk.metadata[key])
+        return metadata
 
-        chunks = self._split_documents(
-            raw_documents, chunk_size, chunk_overlap)
-        if not chunks:
-            print("Nenhum chunk criado. Processo encerrado.")
-            return
+    def process_and_ingest_documents(self, chunk_size: int = 400, chunk_overlap: int = 100,
+                                     max_workers: int = None, file_timeout: float = None,
+                                     embed_batch_size: int = 64, write_batch_size: int = 256,
+                                     progress=None, delta: dict = None, lazy_load: bool = False,
+                                     memory_limit_mb: float = None, chunker: str = "legal") -> dict:
+        """
+        Processa os documentos e injeta no banco vetorial de forma incremental.
+
+        Arquivos inalterados (mesmo hash de conteúdo) são ignorados, arquivos
+        alterados são re-divididos e só os chunks com texto novo são
+        embedados, e os chunks de arquivos apagados são removidos.
 
-        documents_to_ingest = [chunk.page_content for chunk in chunks]
+        Parsing, divisão, embedding e escrita rodam em paralelo num pipeline
+        com filas limitadas (ver ``IngestPipeline``), então a memória não
+        cresce com o tamanho do corpus.
 
-        metadatas_to_ingest = []
-        for chunk in chunks:
-            source = chunk.metadata.get("source", "desconhecido")
-            file_type = os.path.splitext(
-                source)[1] if source != "desconhecido" else "unknown"
-            metadata_entry = {
-                "source": str(source),
-                "file_type": str(file_type)
+        Chunks iguais ou quase iguais a um já gravado do mesmo arquivo (mesmo
+        texto normalizado ou MinHash acima de ``dedup_threshold``, com os
+        mesmos números e identificadores) não são embedados nem gravados: o
+        chunk gravado recebe nos metadados quantas duplicatas tem e de onde
+        vêm (ver ``DedupIndex``).
+
+        Com ``lazy_load``, as páginas seguem do parsing até a escrita em
+        lotes, sem que nenhum arquivo seja carregado inteiro na memória (ver
+        ``stream_load_files``): o uso de memória não cresce com o tamanho dos
+        PDFs. O pico de RSS de cada arquivo fica em ``summary["memory"]``.
+
+        Args:
+            chunk_size (int): Tamanho máximo dos chunks.
+            chunk_overlap (int): Sobreposição entre os chunks.
+            max_workers (int): Processos usados no parsing (padrão: CPUs).
+            file_timeout (float): Tempo máximo de parsing por arquivo.
+            embed_batch_size (int): Chunks por chamada do modelo de embedding.
+            write_batch_size (int): Chunks por escrita no banco vetorial.
+            progress (callable): Recebe as estatísticas parciais a cada
+                relatório de progresso (ver ``IngestPipeline``).
+            delta (dict): Arquivos ``added``, ``changed`` e ``deleted``
+                conhecidos (ex.: resultado de ``load_from_owncloud.sync``);
+                só eles são examinados. Ignorado se as configurações de
+                chunking mudaram.
+            lazy_load (bool): Carrega os arquivos página a página.
+            memory_limit_mb (float): Teto de memória (RSS) da ingestão, em
+                MB, somando os processos de parsing no modo ``lazy_load``.
+                Acima dele, o parsing espera as etapas seguintes.
+            chunker (str): "legal" (chunks que respeitam artigos, incisos e
+                seções, com o caminho do artigo nos metadados) ou
+                "recursive" (ver ``_make_splitter``).
+
+        Retorna:
+            dict: Estatísticas da ingestão por etapa.
+        """
+        manifest = IngestManifest.load(self.manifest_path)
+        # Hashes dos arquivos já ingeridos, para limpar o cache de parsing
+        # dos conteúdos que mudaram ou sumiram
+        previous_digests = {
+            file_path: entry["hash"] for file_path, entry in manifest.files.items() if entry["hash"]}
+        settings = {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "chunker": chunker,
+            "embedding_model": self.embedding_model,
+            "strip_boilerplate": self.strip_boilerplate,
+            "dedup_threshold": self.dedup_threshold,
+            # Duplicatas só dentro do arquivo; índices de quando eram
+            # procuradas em todos os arquivos são refeitos
+            "dedup_scope": "file",
+        }
+        # Embeddings gravados só podem ser reaproveitados se vieram do mesmo
+        # modelo (o runtime pode mudar: PyTorch e ONNX geram o mesmo espaço).
+        reuse_embeddings = manifest.settings.get("embedding_model") == self.embedding_model
+        if delta is not None and manifest.settings == settings:
+            changed, unchanged, deleted = manifest.plan(
+                [path for path in delta["added"] + delta["changed"] if os.path.exists(path)],
+                settings,
+                deleted=delta["deleted"],
+            )
+        else:
+            changed, unchanged, deleted = manifest.plan(
+                list_data_files(self.data_path), settings)
+        logger.info(
+            f"Ingestão: {len(changed)} arquivo(s) novo(s)/alterado(s), "
+            f"{len(unchanged)} inalterado(s), {len(deleted)} removido(s).")
+
+        splitter = self._make_splitter(chunk_size, chunk_overlap, chunker)
+        # Estado por arquivo: hash, chunks antigos (hash do texto -> ID) para
+        # reaproveitar embeddings e os chunks novos (ID -> hash do texto).
+        files = {
+            file_path: {
+                "digest": digest,
+                "old": {
+                    text: old_id for old_id, text in manifest.chunks(file_path).items()
+                } if reuse_embeddings else {},
+                "chunks": {},
+                "duplicates": set(),
+                # Artigo/parágrafo em que a página anterior terminou
+                "legal_path": None,
             }
-            metadatas_to_ingest.append(metadata_entry)
+            for file_path, digest in changed
+        }
+        dedup = DedupIndex(self.dedup_index_path, self.dedup_threshold) if self.dedup_threshold else None
+        # Chunks gravados cuja lista de duplicatas mudou nesta ingestão
+        touched = set()
+        skipped = [0]
+
+        def split_page(file_path, page):
+            state = files[file_path]
+            records = []
+            if chunker == "legal":
+                chunks, state["legal_path"] = splitter.split_document(page, state["legal_path"])
+            else:
+                chunks = splitter.split_documents([page])
+            for chunk in chunks:
+                metadata = self._chunk_metadata(chunk)
+                new_id = chunk_id(state["digest"], metadata["page"], metadata["start_index"])
+                if new_id in state["chunks"] or new_id in state["duplicates"]:
+                    continue
+                if dedup is not None:
+                    fingerprint = dedup.fingerprint(chunk.page_content)
+                    canonical = dedup.find(fingerprint, file_path)
+                    if canonical is not None:
+                        dedup.add_duplicate(new_id, canonical, metadata, chunk.page_content)
+                        state["duplicates"].add(new_id)
+                        touched.add(canonical)
+                        skipped[0] += 1
+                        continue
+                    dedup.add(new_id, file_path, fingerprint)
+                digest_text = text_hash(chunk.page_content)
+                state["chunks"][new_id] = digest_text
+                records.append({
+                    "id": new_id,
+                    "text": chunk.page_content,
+                    "metadata": metadata,
+                    "reuse_id": state["old"].get(digest_text),
+                })
+            return records
+
+        def file_done(file_path):
+            state = files.pop(file_path)
+            stale_ids = [
+                old_id for old_id in manifest.chunks(file_path)
+                if old_id not in state["chunks"]
+            ]
+            if stale_ids:
+                self.vector_store.delete(stale_ids)
+                self.lexical_index.remove(stale_ids)
+            manifest.record(file_path, state["digest"], state["chunks"])
 
-        ids_to_ingest = [f"ID{i}" for i in range(len(chunks))]
+        def file_failed(file_path, error):
+            # As páginas que chegaram antes do erro já foram gravadas: apaga
+            # os chunks que não existiam antes. O arquivo continua em
+            # ``files`` e é invalidado no manifesto ao fim da ingestão.
+            old_ids = manifest.chunks(file_path)
+            partial = [new_id for new_id in files[file_path]["chunks"] if new_id not in old_ids]
+            if partial:
+                self.vector_store.delete(partial)
+                self.lexical_index.remove(partial)
+
+        memory_limit = int(memory_limit_mb * 1024 * 1024) if memory_limit_mb else None
+        pipeline = IngestPipeline(
+            split_page,
+            self._embed_records,
+            self._write_records,
+            file_done,
+            embed_batch_size=embed_batch_size,
+            write_batch_size=min(write_batch_size, self.vector_store.max_batch_size()),
+            on_progress=progress,
+            file_failed=file_failed,
+            memory_limit=memory_limit,
+        )
+
+        if not os.path.exists(self.lexical_index_path) and self.vector_store.count():
+            self.rebuild_lexical_index()
 
         try:
-            self.collection.add(
-                documents=documents_to_ingest,
-                metadatas=metadatas_to_ingest,
-                ids=ids_to_ingest
-            )
-            print(
-                f"{len(documents_to_ingest)} chunks adicionados na coleção '{self.collection_name}'.")
-        except Exception as e:
-            print(f"Erro ao salvar no ChromaDB: {e}")
+            for file_path in deleted:
+                old_ids = list(manifest.chunks(file_path))
+                if old_ids:
+                    self.vector_store.delete(old_ids)
+                    self.lexical_index.remove(old_ids)
+                manifest.remove(file_path)
+                logger.info(f"{len(old_ids)} chunks removidos de {file_path}.")
+
+            if self.parse_cache is not None:
+                current = {digest for _, digest in changed}
+                current.update(
+                    previous_digests[file_path] for file_path in unchanged if file_path in previous_digests)
+                stale = [
+                    previous_digests[file_path]
+                    for file_path in [path for path, _ in changed] + deleted
+                    if file_path in previous_digests and previous_digests[file_path] not in current
+                ]
+                if stale:
+                    self.parse_cache.discard(stale)
+
+            if dedup is not None:
+                orphans, affected = dedup.remove_sources([path for path, _ in changed] + deleted)
+                touched.update(affected)
+                touched.update(self._promote_duplicates(dedup, orphans, manifest))
+
+            if not files:
+                return pipeline.summary()
+
+            digests = {file_path: state["digest"] for file_path, state in files.items()}
+            if lazy_load:
+                loaded = self._iter_raw_pages(
+                    list(files), max_workers, file_timeout, digests, memory_limit=memory_limit)
+            else:
+                loaded = self._iter_raw_documents(list(files), max_workers, file_timeout, digests=digests)
+            summary = pipeline.run(loaded)
+            if dedup is not None:
+                summary["duplicates_skipped"] = skipped[0]
+                logger.info(f"{skipped[0]} chunk(s) duplicado(s) não gravado(s).")
+            return summary
+        finally:
+            if dedup is not None:
+                self._finish_dedup(dedup, touched, list(files), manifest)
+            self.vector_store.persist()
+            self.lexical_index.save(self.lexical_index_path)
+            # Arquivos planejados que não foram registrados (falharam ou a
+            # ingestão parou antes) são reprocessados na próxima, mesmo que
+            # as configurações gravadas abaixo já sejam as novas
+            for file_path, state in files.items():
+                manifest.invalidate(file_path, state["chunks"])
+            manifest.settings = settings
+            manifest.save()
+            self.retrieval_cache.clear()
+
+    def _promote_duplicates(self, dedup: DedupIndex, orphans: list, manifest: IngestManifest) -> set:
+        """
+        Grava no lugar de cada chunk removido (arquivo alterado ou apagado)
+        uma de suas duplicatas em outro arquivo, que deixou de ter um chunk
+        canônico.
+
+        Retorna:
+            set: IDs dos chunks promovidos.
+        """
+        promoted = dedup.promote(orphans)
+        if not promoted:
+            return set()
+        records = [
+            {"id": orphan["id"], "text": orphan["text"], "metadata": orphan["metadata"], "reuse_id": None}
+            for orphan in promoted
+        ]
+        for start in range(0, len(records), 256):
+            batch = records[start:start + 256]
+            self._embed_records(batch)
+            self._write_records(batch)
+        for orphan in promoted:
+            manifest.add_chunks(orphan["source"], {orphan["id"]: text_hash(orphan["text"])})
+        logger.info(f"{len(promoted)} duplicata(s) promovida(s) a chunk gravado.")
+        return {orphan["id"] for orphan in promoted}
+
+    def _finish_dedup(self, dedup: DedupIndex, touched: set, incomplete: list, manifest: IngestManifest):
+        """
+        Fecha o índice de duplicatas ao fim da ingestão: descarta o que veio
+        de arquivos que não terminaram e grava nos chunks a lista das suas
+        duplicatas.
+        """
+        if incomplete:
+            # Chunks desses arquivos não foram gravados; arquivos com
+            # duplicatas deles são reprocessados na próxima ingestão.
+            orphans, affected = dedup.remove_sources(incomplete)
+            touched.update(affected)
+            for source in {orphan["source"] for orphan in orphans}:
+                manifest.remove(source)
+        ids = list(touched)
+        for start in range(0, len(ids), 500):
+            found = self.vector_store.get(ids=ids[start:start + 500], include=("metadatas",))
+            duplicates = dedup.duplicates(found["ids"])
+            metadatas = [
+                {**metadata, **self._duplicate_metadata(duplicates.get(chunk_id, []))}
+                for chunk_id, metadata in zip(found["ids"], found["metadatas"])
+            ]
+            if metadatas:
+                self.vector_store.update_metadata(found["ids"], metadatas)
+        dedup.save()
+        dedup.close()
+
+    # Origens de duplicatas listadas nos metadados do chunk (a lista completa
+    # fica no índice de duplicatas)
+    DUPLICATE_SOURCES_LIMIT = 20
+
+    @classmethod
+    def _duplicate_metadata(cls, duplicates: list) -> dict:
+        """
+        Metadados de um chunk gravado sobre as suas duplicatas: quantidade e
+        origens (JSON com source e page, sem repetições).
+        """
+        sources = list(dict.fromkeys(
+            (duplicate["source"], duplicate["page"]) for duplicate in duplicates))
+        return {
+            "duplicates": len(duplicates),
+            "duplicate_sources": json.dumps(
+                [{"source": source, "page": page} for source, page in sources[:cls.DUPLICATE_SOURCES_LIMIT]],
+                ensure_ascii=False),
+        }
+
+    def rebuild_lexical_index(self, batch_size: int = 1000):
+        """
+        Reconstrói o índice BM25 a partir dos chunks já gravados na coleção
+        (ex.: coleção criada antes de existir o índice lexical).
+        """
+        index = BM25Index()
+        offset = 0
+        while True:
+            batch = self.vector_store.get(
+                include=("documents",), limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            index.add(batch["ids"], batch["documents"])
+            offset += len(batch["ids"])
+        index.save(self.lexical_index_path)
+        self.lexical_index = index
+        logger.info(f"Índice lexical reconstruído com {len(index)} chunks.")
+
+    def _embed_records(self, records: list):
+        """
+        Preenche o embedding dos registros de um lote. Chunks cujo texto já
+        existia na versão anterior do arquivo reutilizam o embedding gravado.
+        """
+        reuse_ids = list(dict.fromkeys(
+            record["reuse_id"] for record in records if record["reuse_id"]))
+        stored = {}
+        if reuse_ids:
+            found = self.vector_store.get(ids=reuse_ids, include=("embeddings",))
+            stored = dict(zip(found["ids"], found["embeddings"]))
+
+        to_embed = [record for record in records if record["reuse_id"] not in stored]
+        if to_embed:
+            embeddings = self.embedding_function([record["text"] for record in to_embed])
+            for record, embedding in zip(to_embed, embeddings):
+                record["embedding"] = embedding
+        for record in records:
+            if record["reuse_id"] in stored:
+                record["embedding"] = stored[record["reuse_id"]]
+
+    def _write_records(self, records: list):
+        """
+        Grava um lote de registros já embedados no banco vetorial.
+        """
+        self.vector_store.upsert(
+            ids=[record["id"] for record in records],
+            embeddings=[record["embedding"] for record in records],
+            documents=[record["text"] for record in records],
+            metadatas=[record["metadata"] for record in records],
+        )
+        self.lexical_index.add(
+            [record["id"] for record in records],
+            [record["text"] for record in records],
+        )
 
     def get_collection_count(self) -> int:
         """
@@ -163,95 +855,307 @@ class DocumentProcessor:
         Retorna:
             int: Contagem de itens.
         """
-        count = self.collection.count()
-        print(f"Total de itens na coleção '{self.collection_name}': {count}")
+        count = self.vector_store.count()
+        logger.info(f"Total de itens na coleção '{self.collection_name}': {count}")
         return count
 
-    def query(self,  n_results: int = 6):
-        
-        model = genai.GenerativeModel('gemini-1.5-flash') # ou 'gemini-1.5-pro-latest', 'gemini-pro'
-        while True:
-            user_query = input(
-                "\nQual é a sua pergunta? (ou digite 's' para encerrar)\n\n")
+    def retrieve(self, user_query: str, n_results: int = 6, where: dict = None) -> dict:
+        """
+        Busca os chunks mais relevantes para a pergunta.
 
-            if user_query.lower() == "s":
-                print("Encerrando o chat...")
-                break
-            """
-        Faz uma consulta na coleção.
+        Com a busca híbrida ativa, a busca vetorial e a BM25 rodam em
+        paralelo e os rankings são combinados com Reciprocal Rank Fusion, o
+        que recupera trechos com identificadores exatos ("Art. 75",
+        "Lei 14.133") que o embedding perde.
+
+        O embedding da pergunta e o resultado da busca ficam em cache; o
+        cache de resultados é descartado quando a coleção é reingerida.
 
         Args:
-            query_text (str): Texto da consulta.
+            user_query (str): Pergunta do usuário.
             n_results (int): Número de resultados a retornar.
+            where (dict): Filtro de metadados do ChromaDB.
+
+        Retorna:
+            dict: Resultado no formato do ChromaDB (documents, metadatas, ids,
+            distances). Na busca híbrida, chunks encontrados só pela BM25 têm
+            distância None.
+        """
+        with span("retrieve"):
+            return self._retrieve_batch([user_query], n_results, where)[0]
+
+    def search(self, user_query: str, n_results: int = 6, where: dict = None) -> list:
+        """
+        Busca sem geração: os chunks mais relevantes já no formato de
+        resposta da API (texto, fonte, página, distância e pontuação).
+
+        Args:
+            user_query (str): Pergunta ou termos de busca.
+            n_results (int): Número de chunks.
+            where (dict): Filtro de metadados (source, file_type, page).
+
+        Retorna:
+            list: Um dict por chunk, do mais ao menos relevante.
+        """
+        return self._hits(self.retrieve(user_query, n_results, where))
+
+    def search_batch(self, user_queries: list, n_results: int = 6, where: dict = None) -> list:
+        """
+        ``search`` para várias buscas, com uma única passada de embedding e
+        de busca vetorial (``retrieve_batch``).
+
+        Retorna:
+            list: Uma lista de chunks por busca, na mesma ordem.
+        """
+        return [self._hits(results) for results in self.retrieve_batch(user_queries, n_results, where)]
+
+    async def asearch(self, user_query: str, n_results: int = 6, where: dict = None) -> list:
+        """
+        ``search`` sem bloquear o event loop (roda no pool de busca).
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._retrieval_executor, run_in_context(self.search), user_query, n_results, where)
+
+    async def asearch_batch(self, user_queries: list, n_results: int = 6, where: dict = None) -> list:
+        """
+        ``search_batch`` sem bloquear o event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._retrieval_executor, run_in_context(self.search_batch), user_queries, n_results, where)
+
+    @staticmethod
+    def _hits(results: dict) -> list:
+        ids = results["ids"][0]
+        scores = (results.get("scores") or [[None] * len(ids)])[0]
+        hits = []
+        for chunk_id, document, metadata, distance, score in zip(
+                ids, results["documents"][0], results["metadatas"][0],
+                results["distances"][0], scores):
+            metadata = metadata or {}
+            hits.append({
+                "id": chunk_id,
+                "text": document,
+                "source": metadata.get("source"),
+                "file_type": metadata.get("file_type"),
+                "page": metadata.get("page"),
+                "start_index": metadata.get("start_index"),
+                "article_path": metadata.get("article_path"),
+                "duplicates": metadata.get("duplicates", 0),
+                "duplicate_sources": json.loads(metadata.get("duplicate_sources") or "[]"),
+                "distance": distance,
+                "score": score,
+            })
+        return hits
+
+    def retrieve_batch(self, user_queries: list, n_results: int = 6, where: dict = None) -> list:
+        """
+        Busca os chunks de várias perguntas de uma vez.
+
+        Todas as perguntas fora do cache são embedadas numa única chamada do
+        modelo e buscadas numa única consulta ao banco vetorial; perguntas
+        repetidas são buscadas uma vez só.
+
+        Args:
+            user_queries (list): Perguntas.
+            n_results (int): Número de resultados por pergunta.
+            where (dict): Filtro de metadados do ChromaDB, comum a todas.
 
         Retorna:
-            list: Lista de documentos e metadados encontrados.
+            list: Um resultado por pergunta, na mesma ordem, no formato de
+            ``retrieve``.
         """
-            results = self.collection.query(
-                query_texts=[user_query],
-                n_results=n_results
+        with span("retrieve_batch"):
+            return self._retrieve_batch(list(user_queries), n_results, where)
+
+    def _retrieve_batch(self, user_queries: list, n_results: int, where: dict) -> list:
+        self._check_cache_generation()
+
+        embeddings = self.embed_queries(user_queries)
+        where_key = json.dumps(where, sort_keys=True) if where else None
+        results = [None] * len(user_queries)
+        misses = {}  # chave do cache -> posições das perguntas
+        for position, embedding in enumerate(embeddings):
+            key = (
+                hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest(),
+                n_results,
+                where_key,
             )
-            # print("\nResultados da consulta:")
-            # for i, doc in enumerate(results['documents'][0]):
-            #     print(f"Resultado {i+1}: {doc}")
-            #     if results['metadatas'] and results['metadatas'][0] and len(results['metadatas'][0]) > i:
-            #         print(f"  Metadados: {results['metadatas'][0][i]}")
-            #     print("-" * 20)
-            system_prompt = f"""
-            Você é um assistente especializado em responder perguntas com base nos dados fornecidos.  
-            Sua missão é utilizar ao máximo as informações disponíveis, inferindo respostas sempre que possível, sem inventar ou recorrer a conhecimento externo.  
+            cached = self.retrieval_cache.get(key)
+            CACHE_LOOKUPS.labels("retrieval", "miss" if cached is None else "hit").inc()
+            if cached is None:
+                misses.setdefault(key, []).append(position)
+            else:
+                results[position] = cached
 
-            **Regras para suas respostas:**  
-            - Se houver informações suficientes, responda de forma **clara, direta e objetiva**.  
-            - Se as informações forem **parciais**, tente **inferir** a melhor resposta possível, explicando sua lógica.  
-            - Se não houver **dados suficientes**, seja honesto e responda apenas: `"Não sei com certeza, mas com base no contexto, posso inferir que..."` ou `"Não tenho informações suficientes para responder com precisão."`  
-            - **Nunca invente fatos** ou forneça respostas baseadas em suposições sem justificativa.  
+        if misses:
+            first = [positions[0] for positions in misses.values()]
+            batch_queries = [user_queries[position] for position in first]
+            batch_embeddings = [embeddings[position] for position in first]
+            if self.hybrid_search and len(self.lexical_index):
+                found = self._hybrid_search(batch_queries, batch_embeddings, n_results, where)
+            else:
+                found = self._split_results(
+                    self._vector_search(batch_embeddings, n_results, where))
+            for (key, positions), result in zip(misses.items(), found):
+                self.retrieval_cache.set(key, result)
+                for position in positions:
+                    results[position] = result
+        return results
 
-            🔍 **Contexto disponível:**  
-            {str(results['documents'])}
-            """
+    @staticmethod
+    def _split_results(results: dict) -> list:
+        """
+        Separa um resultado de busca com várias perguntas em um resultado
+        (no formato do ChromaDB) por pergunta.
+        """
+        return [
+            {key: [results[key][position]] for key in ("ids", "documents", "metadatas", "distances")}
+            for position in range(len(results["ids"]))
+        ]
 
-            prompt = f"{system_prompt}\n\nUsuário: {user_query}"
+    def _vector_search(self, embeddings: list, n_results: int, where: dict = None) -> dict:
+        with span("vector_search"):
+            return self.vector_store.search(embeddings, n_results=n_results, where=where)
 
-           # response = model.generate_content(prompt, stream=True)
+    def _hybrid_search(self, user_queries: list, embeddings: list, n_results: int,
+                       where: dict = None) -> list:
+        """
+        Busca vetorial + BM25 combinadas com Reciprocal Rank Fusion, para
+        uma ou mais perguntas.
+        """
+        # Cada lista traz mais candidatos que o pedido, para a fusão ter
+        # material dos dois lados.
+        depth = max(n_results * 3, 20)
+        vector_future = self._search_executor.submit(
+            run_in_context(self._vector_search), embeddings, depth, where)
+        with span("lexical_search"):
+            lexical = [
+                [chunk_id for chunk_id, _ in self.lexical_index.search(user_query, depth)]
+                for user_query in user_queries
+            ]
+        vector = vector_future.result()
 
-        #    print("\nResposta do Assistente:")
-            full_response_text = ""
-            try:
-                # Use stream=True para obter a resposta em partes
-                response_stream = model.generate_content(prompt, stream=True)
+        found = {}
+        for position in range(len(user_queries)):
+            for chunk_id, document, metadata, distance in zip(
+                    vector["ids"][position], vector["documents"][position],
+                    vector["metadatas"][position], vector["distances"][position]):
+                found[(position, chunk_id)] = (document, metadata, distance)
 
-                for chunk in response_stream:
-                    if chunk.text: # Verifica se o chunk tem texto
-                        print(chunk.text, end="", flush=True) # Imprime o texto do chunk sem nova linha e força a saída
-                        full_response_text += chunk.text
-            except Exception as e:
-                print(f"\nOcorreu um erro ao gerar a resposta: {e}")
-                # Você pode querer lidar com diferentes tipos de erros aqui,
-                # como google.generativeai.types.BlockedPromptException
+        missing = list(dict.fromkeys(
+            chunk_id
+            for position, lexical_ids in enumerate(lexical)
+            for chunk_id in lexical_ids if (position, chunk_id) not in found
+        ))
+        extra = {}
+        if missing:
+            # O filtro de metadados também vale para os resultados lexicais
+            fetched = self.vector_store.get(
+                ids=missing, where=where, include=("documents", "metadatas"))
+            extra = {
+                chunk_id: (document, metadata, None)
+                for chunk_id, document, metadata in zip(
+                    fetched["ids"], fetched["documents"], fetched["metadatas"])
+            }
 
-            print("\n\n---------------------\n")
-            # O return original era response.text. Com streaming, você constrói o texto completo.
-            # Se você ainda precisa retornar o texto completo, use full_response_text
-            # return full_response_text # Descomente se precisar retornar o texto completo
+        results = []
+        for position, lexical_ids in enumerate(lexical):
+            for chunk_id in lexical_ids:
+                if (position, chunk_id) not in found and chunk_id in extra:
+                    found[(position, chunk_id)] = extra[chunk_id]
+            lexical_ids = [chunk_id for chunk_id in lexical_ids if (position, chunk_id) in found]
+            fused = reciprocal_rank_fusion(
+                [vector["ids"][position], lexical_ids], k=self.rrf_k)[:n_results]
+            hits = [found[(position, chunk_id)] for chunk_id, _ in fused]
+            results.append({
+                "ids": [[chunk_id for chunk_id, _ in fused]],
+                "documents": [[hit[0] for hit in hits]],
+                "metadatas": [[hit[1] for hit in hits]],
+                "distances": [[hit[2] for hit in hits]],
+                "scores": [[score for _, score in fused]],
+            })
+        return results
+
+    def embed_query(self, user_query: str):
+        """
+        Embedding da pergunta, com cache pela pergunta normalizada.
+        """
+        return self.embed_queries([user_query])[0]
+
+    def embed_queries(self, user_queries: list) -> list:
+        """
+        Embeddings das perguntas, com cache pela pergunta normalizada. As que
+        não estão no cache são embedadas (com o texto original) numa única
+        chamada do modelo.
+        """
+        normalized = [normalize_query(user_query) for user_query in user_queries]
+        embeddings = {}
+        originals = {}
+        for text, user_query in zip(normalized, user_queries):
+            if text not in embeddings:
+                embeddings[text] = self.embedding_cache.get(text)
+                originals[text] = user_query
+                CACHE_LOOKUPS.labels(
+                    "embedding", "miss" if embeddings[text] is None else "hit").inc()
+        missing = [text for text, embedding in embeddings.items() if embedding is None]
+        if missing:
+            with span("embed_query"):
+                computed = self.embedding_function([originals[text] for text in missing])
+            for text, embedding in zip(missing, computed):
+                embeddings[text] = embedding
+                self.embedding_cache.set(text, embedding)
+        return [embeddings[text] for text in normalized]
 
+    def _collection_generation(self):
+        """
+        Identifica a versão da coleção pelo mtime do manifesto, que é
+        regravado a cada ingestão (inclusive por outro processo).
+        """
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
             return None
-    def query_async(self,user_query,  n_results: int = 6):
 
-            model = genai.GenerativeModel('gemini-1.5-flash') # ou 'gemini-1.5-pro-latest', 'gemini-pro'
-      
+    def _check_cache_generation(self):
+        """
+        Limpa o cache de resultados e recarrega o índice BM25 se a coleção
+        foi reingerida. O cache de embeddings continua válido, pois não
+        depende da coleção.
+        """
+        generation = self._collection_generation()
+        if generation != self._cache_generation:
+            self._cache_generation = generation
+            self.retrieval_cache.clear()
+            # Recarregado no próximo acesso
+            self._lexical_index = None
+
+    def cache_stats(self) -> dict:
+        """
+        Contadores de acerto/falha dos caches de consulta.
+        """
+        stats = {
+            "embedding": self.embedding_cache.stats(),
+            "retrieval": self.retrieval_cache.stats(),
+        }
+        if self.answer_cache is not None:
+            stats["answer"] = self.answer_cache.stats()
+        return stats
 
-            results = self.collection.query(
-                query_texts=[user_query],
-                n_results=n_results
-            )
-            # print("\nResultados da consulta:")
-            # for i, doc in enumerate(results['documents'][0]):
-            #     print(f"Resultado {i+1}: {doc}")
-            #     if results['metadatas'] and results['metadatas'][0] and len(results['metadatas'][0]) > i:
-            #         print(f"  Metadados: {results['metadatas'][0][i]}")
-            #     print("-" * 20)
-            system_prompt = f"""
+    def _build_prompt(self, user_query: str, results: dict, history: str = "") -> str:
+        """
+        Monta o prompt enviado ao Gemini a partir dos chunks recuperados.
+
+        Os chunks passam por ``pack_context``: vizinhos da mesma página são
+        unidos sem repetir a sobreposição e o total respeita
+        ``context_token_budget``. ``history`` é o histórico da conversa
+        (resumo e trocas recentes, já dentro do orçamento da sessão).
+        """
+        with span("prompt"):
+            context = format_context(pack_context(
+                results["documents"][0], results["metadatas"][0], self.context_token_budget))
+        system_prompt = f"""
             Você é um assistente especializado em responder perguntas com base nos dados fornecidos.  
             Sua missão é utilizar ao máximo as informações disponíveis, inferindo respostas sempre que possível, sem inventar ou recorrer a conhecimento externo.  
 
@@ -262,35 +1166,437 @@ class DocumentProcessor:
             - **Nunca invente fatos** ou forneça respostas baseadas em suposições sem justificativa.  
 
             🔍 **Contexto disponível:**  
-            {str(results['documents'])}
+            {context}
             """
 
-            prompt = f"{system_prompt}\n\nUsuário: {user_query}"
+        if history:
+            system_prompt += (
+                "\n💬 **Histórico da conversa** (use para entender a pergunta; os fatos vêm do contexto):\n"
+                f"{history}\n"
+            )
+        return f"{system_prompt}\n\nUsuário: {user_query}"
+
+    @staticmethod
+    def _retrieval_metadata(results: dict) -> dict:
+        """
+        Resumo dos chunks recuperados, enviado ao cliente antes dos tokens.
+        """
+        ids = (results.get("ids") or [[]])[0]
+        metadatas = (results.get("metadatas") or [[]])[0] or []
+        distances = (results.get("distances") or [[]])[0] or []
+        sources = []
+        for i, chunk_id in enumerate(ids):
+            metadata = metadatas[i] if i < len(metadatas) and metadatas[i] else {}
+            sources.append({
+                "id": chunk_id,
+                "source": metadata.get("source"),
+                "page": metadata.get("page"),
+                "article_path": metadata.get("article_path"),
+                "distance": distances[i] if i < len(distances) else None,
+            })
+        return {"sources": sources}
+
+    def _load_conversation(self, session_id: str):
+        """
+        Estado da sessão, ou None sem sessão ou sem memória de conversas.
+        """
+        if session_id is None or self.conversations is None:
+            return None
+        return self.conversations.load(session_id)
 
-           # response = model.generate_content(prompt, stream=True)
+    def _history(self, conversation) -> str:
+        return self.conversations.history(conversation) if conversation else ""
 
-        #    print("\nResposta do Assistente:")
-            full_response_text = ""
+    def _search_query(self, user_query: str, conversation) -> str:
+        """
+        Consulta de busca sem LLM: a pergunta ou, no modo "history", a
+        pergunta junto com a anterior.
+        """
+        if self.query_rewrite == "none" or not conversation or not conversation.turns:
+            return user_query
+        return expand_query(conversation, user_query)
+
+    def _rewrite_prompt(self, user_query: str, conversation) -> str:
+        return rewrite_prompt(conversation, user_query, self.conversations.turn_token_budget)
+
+    def rewrite_query(self, user_query: str, conversation) -> str:
+        """
+        Consulta de busca para uma pergunta dentro de uma conversa. No modo
+        "llm", o LLM reescreve a pergunta de forma independente; se ele
+        falhar, cai no modo "history".
+        """
+        if self.query_rewrite == "llm" and conversation and conversation.turns:
             try:
-                # Use stream=True para obter a resposta em partes
-                response_stream = model.generate_content(prompt, stream=True)
+                with span("rewrite"):
+                    rewritten = "".join(self.llm.stream(self._rewrite_prompt(user_query, conversation))).strip()
+                if rewritten:
+                    return rewritten
+            except Exception as e:
+                logger.warning(f"Falha ao reescrever a pergunta ({e}); usando a pergunta anterior.")
+        return self._search_query(user_query, conversation)
+
+    async def arewrite_query(self, user_query: str, conversation) -> str:
+        """
+        Versão async de ``rewrite_query`` (a reescrita ocupa uma vaga no
+        LLM; sem vaga, cai no modo "history").
+        """
+        if self.query_rewrite == "llm" and conversation and conversation.turns:
+            try:
+                with span("rewrite"):
+                    async with self.llm.limiter.slot():
+                        parts = [text async for text in self.llm.astream(
+                            self._rewrite_prompt(user_query, conversation))]
+                rewritten = "".join(parts).strip()
+                if rewritten:
+                    return rewritten
+            except Exception as e:
+                logger.warning(f"Falha ao reescrever a pergunta ({e}); usando a pergunta anterior.")
+        return self._search_query(user_query, conversation)
+
+    def _remember(self, session_id: str, user_query: str, answer: list) -> tuple:
+        """
+        Grava a troca na sessão.
+
+        Retorna:
+            tuple: (estado da sessão, trocas que devem ir para o resumo).
+        """
+        conversation = self.conversations.append(session_id, user_query, "".join(answer))
+        return conversation, self.conversations.overflow(conversation)
+
+    def _compact(self, session_id: str, conversation, folded: list, summary: str, started: float):
+        """
+        Grava o resumo novo no lugar das trocas ``folded``; sem resumo do
+        LLM, usa o extrativo.
+        """
+        if not summary.strip():
+            summary = fallback_summary(conversation.summary, folded, self.conversations.summary_token_budget)
+        self.conversations.compact(session_id, summary, folded)
+        record("summarize", time.perf_counter() - started)
+
+    def _summary_prompt(self, conversation, folded: list) -> str:
+        return summary_prompt(conversation.summary, folded, self.conversations.summary_token_budget)
+
+    def _update_conversation(self, session_id: str, user_query: str, answer: list):
+        """
+        Grava a troca e, se as trocas recentes passaram do orçamento,
+        incorpora as mais antigas ao resumo.
+        """
+        conversation, folded = self._remember(session_id, user_query, answer)
+        if not folded:
+            return
+        started = time.perf_counter()
+        try:
+            summary = "".join(self.llm.stream(self._summary_prompt(conversation, folded)))
+        except Exception as e:
+            logger.warning(f"Falha ao resumir a conversa ({e}); usando o resumo extrativo.")
+            summary = ""
+        self._compact(session_id, conversation, folded, summary, started)
+
+    async def _aupdate_conversation(self, session_id: str, user_query: str, answer: list):
+        """
+        Versão async de ``_update_conversation``. A troca é gravada antes de
+        retornar (a próxima pergunta da sessão já a vê); o resumo é feito em
+        segundo plano, fora do tempo de resposta.
+        """
+        loop = asyncio.get_running_loop()
+        conversation, folded = await loop.run_in_executor(
+            self._retrieval_executor, self._remember, session_id, user_query, answer)
+        if folded:
+            task = asyncio.ensure_future(self._asummarize(session_id, conversation, folded))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
 
-                for chunk in response_stream:
-                    if chunk.text: # Verifica se o chunk tem texto
-                        print(chunk.text, end="", flush=True) # Imprime o texto do chunk sem nova linha e força a saída
-                        full_response_text += chunk.text
+    async def _asummarize(self, session_id: str, conversation, folded: list):
+        started = time.perf_counter()
+        try:
+            async with self.llm.limiter.slot():
+                parts = [text async for text in self.llm.astream(self._summary_prompt(conversation, folded))]
+            summary = "".join(parts)
+        except Exception as e:
+            logger.warning(f"Falha ao resumir a conversa ({e}); usando o resumo extrativo.")
+            summary = ""
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._retrieval_executor, self._compact, session_id, conversation, folded, summary, started)
+        except Exception:
+            logger.exception(f"Falha ao gravar o resumo da sessão {session_id}")
+
+    def stream_answer(self, user_query: str, n_results: int = 6, session_id: str = None):
+        """
+        Gera a resposta em streaming.
+
+        Primeiro produz um evento ``("metadata", dict)`` com os chunks
+        recuperados e depois um ``("token", str)`` para cada parte gerada pelo
+        Gemini. Se o consumidor fechar o gerador (cliente desconectado), o
+        stream do Gemini é cancelado.
+
+        Com o cache semântico ativo, uma pergunta parecida com outra já
+        respondida, com os mesmos chunks recuperados, recebe a resposta
+        guardada sem chamar o Gemini.
+
+        Com ``session_id`` (e ``conversations`` configurado), o histórico
+        da sessão entra no prompt e na consulta de busca, e a troca é
+        gravada ao fim da resposta.
+
+        Args:
+            user_query (str): Pergunta do usuário.
+            n_results (int): Número de chunks usados como contexto.
+            session_id (str): Sessão da conversa.
+
+        Retorna:
+            generator: Tuplas ``(evento, dados)``.
+        """
+        conversation = self._load_conversation(session_id)
+        search_query = self.rewrite_query(user_query, conversation)
+        results = self.retrieve(search_query, n_results)
+        metadata = self._retrieval_metadata(results)
+        if search_query != user_query:
+            metadata["search_query"] = search_query
+
+        history = self._history(conversation)
+        cached_answer = None if history else self._cached_answer(user_query, results)
+        if cached_answer is not None:
+            yield "metadata", {**metadata, "cached": True}
+            yield "token", cached_answer
+            answer = [cached_answer]
+        else:
+            yield "metadata", metadata
+
+            answer = []
+            prompt = self._build_prompt(user_query, results, history)
+            started = time.perf_counter()
+            for text in self.llm.stream(prompt):
+                if not answer:
+                    record("first_token", time.perf_counter() - started)
+                answer.append(text)
+                yield "token", text
+            record("generation", time.perf_counter() - started)
+
+            if not history:
+                self._store_answer(user_query, results, answer)
+        if conversation is not None:
+            self._update_conversation(session_id, user_query, answer)
+
+    async def astream_answer(self, user_query: str, n_results: int = 6, session_id: str = None):
+        """
+        Versão async de ``stream_answer`` para o servidor ASGI.
+
+        A busca roda num pool de threads e a geração usa o stream async do
+        cliente do LLM, limitado pelo ``ConcurrencyLimiter``. A vaga no LLM é
+        ocupada antes do evento de metadados, então ``QueueFullError`` /
+        ``QueueTimeoutError`` surgem no primeiro ``__anext__``, antes de
+        qualquer dado ser enviado ao cliente.
+
+        Com ``coalesce``, pedidos sem histórico de conversa com a mesma
+        pergunta normalizada e o mesmo ``n_results`` que chegam enquanto
+        outro igual está em andamento não fazem busca nem geração próprias:
+        recebem os eventos do primeiro (os já gerados e os próximos), com
+        ``coalesced`` nos metadados.
+
+        Args:
+            user_query (str): Pergunta do usuário.
+            n_results (int): Número de chunks usados como contexto.
+            session_id (str): Sessão da conversa.
+
+        Retorna:
+            async generator: Tuplas ``(evento, dados)``.
+        """
+        conversation = None
+        if session_id is not None and self.conversations is not None:
+            # Leitura no SQLite (pode esperar um escritor): fora do event loop
+            conversation = await asyncio.get_running_loop().run_in_executor(
+                self._retrieval_executor, self.conversations.load, session_id)
+        leader = True
+        if self.coalesce and not self._history(conversation):
+            events, leader = self._flights.join(
+                (normalize_query(user_query), n_results),
+                lambda: self._astream(user_query, n_results))
+            CHAT_COALESCED.labels("leader" if leader else "follower").inc()
+        else:
+            events = self._astream(user_query, n_results, conversation)
+        answer = []
+        try:
+            async for event, payload in events:
+                if event == "token":
+                    answer.append(payload)
+                elif event == "metadata" and not leader:
+                    payload = {**payload, "coalesced": True}
+                yield event, payload
+        finally:
+            # Fecha já a geração (e o stream do LLM) se o consumidor desistir
+            await events.aclose()
+        # Só chega aqui com a resposta completa
+        if conversation is not None:
+            await self._aupdate_conversation(session_id, user_query, answer)
+
+    async def _astream(self, user_query: str, n_results: int, conversation=None):
+        """
+        Busca e geração de uma pergunta (async).
+        """
+        loop = asyncio.get_running_loop()
+        search_query = await self.arewrite_query(user_query, conversation)
+        results = await loop.run_in_executor(
+            self._retrieval_executor, run_in_context(self.retrieve), search_query, n_results)
+        events = self._agenerate(user_query, results, conversation, search_query)
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+
+    def coalesce_stats(self) -> dict:
+        """
+        Contadores da coalescência de pedidos iguais do /chat.
+        """
+        return self._flights.stats()
+
+    async def _agenerate(self, user_query: str, results: dict, conversation=None, search_query: str = None):
+        """
+        Gera a resposta (async) a partir de chunks já recuperados.
+
+        Com histórico de conversa, o cache semântico não é usado: a mesma
+        pergunta pode pedir outra resposta dependendo do histórico.
+        """
+        metadata = self._retrieval_metadata(results)
+        if search_query and search_query != user_query:
+            metadata["search_query"] = search_query
+
+        history = self._history(conversation)
+        cached_answer = None if history else self._cached_answer(user_query, results)
+        if cached_answer is not None:
+            yield "metadata", {**metadata, "cached": True}
+            yield "token", cached_answer
+            return
+
+        async with self.llm.limiter.slot():
+            yield "metadata", metadata
+
+            answer = []
+            prompt = self._build_prompt(user_query, results, history)
+            started = time.perf_counter()
+            async for text in self.llm.astream(prompt):
+                if not answer:
+                    record("first_token", time.perf_counter() - started)
+                answer.append(text)
+                yield "token", text
+            record("generation", time.perf_counter() - started)
+
+        if not history:
+            self._store_answer(user_query, results, answer)
+
+    async def answer_batch(self, user_queries: list, n_results: int = 6, max_concurrency: int = 4,
+                           where: dict = None):
+        """
+        Responde várias perguntas: uma única busca em lote
+        (``retrieve_batch``) e as gerações em paralelo, no máximo
+        ``max_concurrency`` ao mesmo tempo (e sempre dentro do limite global
+        do LLM).
+
+        Args:
+            user_queries (list): Perguntas.
+            n_results (int): Número de chunks usados como contexto.
+            max_concurrency (int): Gerações simultâneas deste lote.
+            where (dict): Filtro de metadados do ChromaDB.
+
+        Retorna:
+            async generator: Um dict por pergunta (index, question, answer,
+            sources, cached), na ordem em que as respostas ficam prontas.
+            Perguntas que falharam trazem ``error`` no lugar de ``answer``.
+        """
+        loop = asyncio.get_running_loop()
+        all_results = await loop.run_in_executor(
+            self._retrieval_executor, run_in_context(self.retrieve_batch),
+            user_queries, n_results, where)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def answer(index: int) -> dict:
+            item = {"index": index, "question": user_queries[index]}
+            async with semaphore:
+                try:
+                    parts = []
+                    async for event, payload in self._agenerate(user_queries[index], all_results[index]):
+                        if event == "metadata":
+                            item.update(payload)
+                        else:
+                            parts.append(payload)
+                    item["answer"] = "".join(parts)
+                except LLMBusyError as e:
+                    item["error"] = str(e)
+                    item["status"] = e.status_code
+                except Exception as e:
+                    logger.exception(f"Erro ao responder a pergunta {index} do lote")
+                    item["error"] = str(e)
+            return item
+
+        tasks = [asyncio.ensure_future(answer(index)) for index in range(len(user_queries))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Consumidor desistiu (cliente desconectado): cancela o resto
+            for task in tasks:
+                task.cancel()
+
+    def _cached_answer(self, user_query: str, results: dict):
+        """
+        Resposta do cache semântico para a pergunta, se houver.
+        """
+        if self.answer_cache is None:
+            return None
+        answer = self.answer_cache.lookup(
+            self.embed_query(user_query), chunk_keys(results["ids"][0], results["documents"][0]))
+        CACHE_LOOKUPS.labels("answer", "miss" if answer is None else "hit").inc()
+        return answer
+
+    def _store_answer(self, user_query: str, results: dict, answer: list):
+        """
+        Guarda uma resposta completa no cache semântico.
+        """
+        if self.answer_cache is not None and answer:
+            self.answer_cache.store(
+                normalize_query(user_query), self.embed_query(user_query),
+                chunk_keys(results["ids"][0], results["documents"][0]), "".join(answer))
+
+    def query(self,  n_results: int = 6):
+        """
+        Chat interativo no terminal.
+
+        Args:
+            n_results (int): Número de resultados a retornar.
+        """
+        while True:
+            user_query = input(
+                "\nQual é a sua pergunta? (ou digite 's' para encerrar)\n\n")
+
+            if user_query.lower() == "s":
+                print("Encerrando o chat...")
+                break
+
+            try:
+                for event, data in self.stream_answer(user_query, n_results):
+                    if event == "token":
+                        print(data, end="", flush=True)
             except Exception as e:
                 print(f"\nOcorreu um erro ao gerar a resposta: {e}")
-                # Você pode querer lidar com diferentes tipos de erros aqui,
-                # como google.generativeai.types.BlockedPromptException
 
             print("\n\n---------------------\n")
-            # O return original era response.text. Com streaming, você constrói o texto completo.
-            # Se você ainda precisa retornar o texto completo, use full_response_text
-            # return full_response_text # Descomente se precisar retornar o texto completo
 
-            return full_response_text
+    async def query_async(self, user_query, n_results: int = 6) -> str:
+        """
+        Responde uma pergunta e retorna o texto completo.
+
+        Args:
+            user_query (str): Pergunta do usuário.
+            n_results (int): Número de chunks usados como contexto.
 
+        Retorna:
+            str: Resposta completa do assistente.
+        """
+        full_response_text = ""
+        async for event, data in self.astream_answer(user_query, n_results):
+            if event == "token":
+                full_response_text += data
+        return full_response_text
 
 
         # --- Exemplo de uso ---
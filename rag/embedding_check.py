@@ -0,0 +1,106 @@
+"""
+Compara um backend de embedding com o PyTorch de referência antes de adotá-lo.
+
+Mede a vazão de embedding (textos/s) de cada backend sobre uma amostra dos
+chunks da coleção e a sobreposição do top-k recuperado pelas mesmas perguntas.
+
+Uso:
+    python embedding_check.py --candidate onnx-int8 --sample 1000 --threads 4
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from embeddings import BACKENDS, SentenceTransformerEmbedder
+from vector_database import BACKENDS as VECTOR_BACKENDS, make_vector_base
+
+DEFAULT_QUERIES = [
+    "Como fazer dispensa de licitação?",
+    "Quais são os limites de valor para dispensa pela Lei 14.133?",
+    "O que diz o Art. 75 da Lei 14.133?",
+    "Como abrir um processo de compra no SEI?",
+    "Quais documentos compõem o estudo técnico preliminar?",
+    "Como elaborar o termo de referência?",
+    "Quem deve assinar o documento de formalização da demanda?",
+    "Qual o prazo para pesquisa de preços?",
+    "Quando é possível a inexigibilidade de licitação?",
+    "Como incluir um item no plano de contratações anual?",
+]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def measure(embedder, texts: list) -> tuple:
+    """
+    Embeda os textos e retorna (matriz normalizada, textos por segundo).
+    """
+    embedder(texts[:8])  # aquecimento
+    started = time.perf_counter()
+    matrix = np.asarray(embedder(texts), dtype=np.float32)
+    elapsed = time.perf_counter() - started
+    return _normalize(matrix), len(texts) / elapsed
+
+
+def top_k(queries: np.ndarray, corpus: np.ndarray, k: int) -> list:
+    scores = queries @ corpus.T
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--baseline", default="torch", choices=BACKENDS)
+    parser.add_argument("--candidate", default="onnx-int8", choices=BACKENDS)
+    parser.add_argument("--model-file", default=None, help="Arquivo ONNX do candidato")
+    parser.add_argument("--chroma-path", default="chroma_db")
+    parser.add_argument("--collection", default="utfpr")
+    parser.add_argument("--vector-backend", default="chroma", choices=VECTOR_BACKENDS)
+    parser.add_argument("--sample", type=int, default=1000, help="Chunks usados como corpus")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--min-overlap", type=float, default=0.9,
+                        help="Sobreposição mínima do top-k para aprovar o candidato")
+    args = parser.parse_args()
+
+    store = make_vector_base(args.vector_backend, args.chroma_path, args.collection)
+    corpus = store.get(limit=args.sample, include=("documents",))["documents"]
+    if not corpus:
+        raise SystemExit(f"A coleção '{args.collection}' está vazia.")
+
+    report = {"model": args.model, "corpus_size": len(corpus), "k": args.k}
+    matrices = {}
+    for role, backend in (("baseline", args.baseline), ("candidate", args.candidate)):
+        embedder = SentenceTransformerEmbedder(
+            args.model, backend=backend, batch_size=args.batch_size,
+            num_threads=args.threads,
+            model_file=args.model_file if role == "candidate" else None)
+        corpus_matrix, texts_per_second = measure(embedder, corpus)
+        query_matrix, _ = measure(embedder, DEFAULT_QUERIES)
+        matrices[role] = (corpus_matrix, query_matrix)
+        report[role] = {"backend": backend, "texts_per_second": round(texts_per_second, 1)}
+
+    base_corpus, base_queries = matrices["baseline"]
+    cand_corpus, cand_queries = matrices["candidate"]
+    overlaps = [
+        len(base & cand) / args.k
+        for base, cand in zip(top_k(base_queries, base_corpus, args.k),
+                              top_k(cand_queries, cand_corpus, args.k))
+    ]
+    report["speedup"] = round(
+        report["candidate"]["texts_per_second"] / report["baseline"]["texts_per_second"], 2)
+    report["mean_cosine_to_baseline"] = round(
+        float(np.mean(np.sum(base_corpus * cand_corpus, axis=1))), 4)
+    report["top_k_overlap"] = round(float(np.mean(overlaps)), 4)
+    report["approved"] = report["top_k_overlap"] >= args.min_overlap
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Serviço local de embedding compartilhado pelos workers do servidor.
+
+Um único processo carrega o modelo e atende os workers por um socket Unix.
+Textos que chegam ao mesmo tempo (de qualquer worker) são agrupados em
+micro-lotes: o primeiro pedido espera no máximo ``max_wait_ms`` por outros,
+até ``max_batch_size`` textos, e o lote inteiro passa pelo modelo de uma vez.
+
+Uso:
+    python embedding_service.py --socket /tmp/rag-embedding.sock --backend onnx
+    EMBEDDING_SERVICE_SOCKET=/tmp/rag-embedding.sock hypercorn server:app
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Cabeçalho das mensagens: tamanho do JSON (4 bytes, big-endian)
+_HEADER = struct.Struct(">I")
+
+
+class Histogram:
+    """
+    Histograma de buckets fixos (limites superiores, como no Prometheus).
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            labels = [str(bucket) for bucket in self.buckets] + ["+Inf"]
+            return {
+                "count": self.count,
+                "mean": round(self.sum / self.count, 4) if self.count else 0.0,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+def _send(sock: socket.socket, header: dict, payload: bytes = b""):
+    data = json.dumps(header).encode()
+    sock.sendall(_HEADER.pack(len(data)) + data + payload)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Serviço de embedding fechou a conexão.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class EmbeddingServer:
+    """
+    Servidor de micro-lotes sobre um socket Unix.
+
+    Protocolo: cada mensagem é um cabeçalho JSON prefixado pelo tamanho.
+    Pedido ``{"texts": [...]}`` recebe ``{"count": n, "dimension": d}``
+    seguido de n*d float32; pedido ``{"stats": true}`` recebe as estatísticas.
+
+    Args:
+        socket_path (str): Caminho do socket Unix.
+        embedder (callable): Função de embedding (lista de textos -> vetores).
+        max_batch_size (int): Máximo de textos por passada do modelo.
+        max_wait_ms (float): Espera máxima do primeiro pedido de um lote.
+    """
+
+    def __init__(self, socket_path: str, embedder, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.socket_path = socket_path
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batch_sizes = Histogram((1, 2, 4, 8, 16, 32, 64, 128, 256))
+        self.queue_wait_ms = Histogram((0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000))
+        self.inference_ms = Histogram((1, 2, 5, 10, 25, 50, 100, 250, 1000, 5000))
+        self.requests = 0
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batch_size": self.batch_sizes.as_dict(),
+            "queue_wait_ms": self.queue_wait_ms.as_dict(),
+            "inference_ms": self.inference_ms.as_dict(),
+        }
+
+    async def _next_batch(self) -> list:
+        """
+        Espera o primeiro pedido e junta os que chegarem até a janela fechar
+        ou o lote encher. Um pedido nunca é dividido entre lotes.
+        """
+        batch = [await self._queue.get()]
+        size = len(batch[0][0])
+        deadline = batch[0][2] + self.max_wait
+        loop = asyncio.get_running_loop()
+        while size < self.max_batch_size:
+            # Pedidos que já estão na fila entram sem esperar pela janela
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            texts = [text for item in batch for text in item[0]]
+            started = loop.time()
+            for _, _, enqueued in batch:
+                self.queue_wait_ms.observe((started - enqueued) * 1000)
+            self.batch_sizes.observe(len(texts))
+            try:
+                # O modelo roda fora do event loop, que segue aceitando pedidos
+                embeddings = await loop.run_in_executor(None, self.embedder, texts)
+                matrix = np.asarray(embeddings, dtype=np.float32)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.inference_ms.observe((loop.time() - started) * 1000)
+            offset = 0
+            for item_texts, future, _ in batch:
+                if not future.done():
+                    future.set_result(matrix[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+                except asyncio.IncompleteReadError:
+                    break
+                message = json.loads(await reader.readexactly(size))
+                if message.get("stats"):
+                    response, payload = self.stats(), b""
+                else:
+                    texts = message["texts"]
+                    self.requests += 1
+                    future = loop.create_future()
+                    await self._queue.put((texts, future, loop.time()))
+                    try:
+                        matrix = await future
+                        response = {"count": int(matrix.shape[0]), "dimension": int(matrix.shape[1])}
+                        payload = matrix.tobytes()
+                    except Exception as e:
+                        response, payload = {"error": str(e)}, b""
+                data = json.dumps(response).encode()
+                writer.write(_HEADER.pack(len(data)) + data + payload)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self._queue = asyncio.Queue()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        batcher = asyncio.create_task(self._batcher())
+        logger.info(
+            f"Serviço de embedding em {self.socket_path} "
+            f"(lote até {self.max_batch_size}, espera até {self.max_wait * 1000:g} ms).")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+class EmbeddingServiceClient(EmbeddingFunction):
+    """
+    Função de embedding que delega ao ``EmbeddingServer``.
+
+    Pode substituir ``SentenceTransformerEmbedder`` em qualquer lugar
+    (inclusive como ``embedding_function`` do ChromaDB). Cada thread usa sua
+    própria conexão, então buscas concorrentes do mesmo worker também chegam
+    juntas ao servidor e entram no mesmo lote.
+
+    Args:
+        socket_path (str): Caminho do socket Unix do serviço.
+        timeout (float): Tempo máximo de espera por uma resposta, em segundos.
+    """
+
+    def __init__(self, socket_path: str, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "socket", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.socket = sock
+        return sock
+
+    def _request(self, message: dict) -> tuple:
+        # Uma nova tentativa se a conexão caiu (ex.: serviço reiniciado)
+        for attempt in range(2):
+            sock = self._connection()
+            try:
+                _send(sock, message)
+                (size,) = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+                header = json.loads(_recv_exactly(sock, size))
+                payload = b""
+                if "count" in header:
+                    payload = _recv_exactly(sock, header["count"] * header["dimension"] * 4)
+                return header, payload
+            except (ConnectionError, BrokenPipeError, socket.timeout):
+                sock.close()
+                self._local.socket = None
+                if attempt:
+                    raise
+
+    def __call__(self, input):
+        texts = list(input)
+        if not texts:
+            return []
+        header, payload = self._request({"texts": texts})
+        if "error" in header:
+            raise RuntimeError(f"Erro no serviço de embedding: {header['error']}")
+        matrix = np.frombuffer(payload, dtype=np.float32).reshape(header["count"], header["dimension"])
+        return list(matrix)
+
+    def stats(self) -> dict:
+        """
+        Estatísticas do serviço (tamanho dos lotes e espera na fila).
+        """
+        return self._request({"stats": True})[0]
+
+
+def main():
+    from embeddings import BACKENDS, SentenceTransformerEmbedder
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVICE_SOCKET", "/tmp/rag-embedding.sock"))
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    embedder = SentenceTransformerEmbedder(
+        model_name=args.model,
+        backend=args.backend,
+        batch_size=args.max_batch_size,
+        num_threads=args.threads,
+    )
+    logger.info(f"Modelo carregado em {time.perf_counter() - started:.1f}s.")
+    server = EmbeddingServer(args.socket, embedder, args.max_batch_size, args.max_wait_ms)
+    asyncio.run(server.serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+# Runtimes suportados. "onnx-int8" usa um modelo ONNX quantizado (int8)
+# publicado junto com o modelo no Hugging Face Hub.
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+DEFAULT_INT8_FILE = "onnx/model_qint8_avx2.onnx"
+
+
+class SentenceTransformerEmbedder(EmbeddingFunction):
+    """
+    Função de embedding com modelo e runtime configuráveis.
+
+    Compatível com a interface de ``embedding_function`` do ChromaDB. Não
+    declara ``name()``, então o ChromaDB a trata como função legada e não
+    exige que ela coincida com a configuração gravada na coleção: trocar de
+    runtime mantém a coleção utilizável, já que o modelo é o mesmo.
+
+    Args:
+        model_name (str): Modelo do sentence-transformers.
+        backend (str): "torch", "onnx" ou "onnx-int8".
+        batch_size (int): Textos por passada do modelo.
+        num_threads (int): Threads intra-op (None = padrão do runtime).
+        model_file (str): Arquivo ONNX dentro do repositório do modelo (só
+            para backends ONNX; padrão do "onnx-int8": ``DEFAULT_INT8_FILE``).
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", backend: str = "torch",
+                 batch_size: int = 32, num_threads: int = None, model_file: str = None):
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Backend de embedding desconhecido: {backend}. Use um de {BACKENDS}.")
+
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+
+        if backend == "torch":
+            if num_threads:
+                import torch
+                torch.set_num_threads(num_threads)
+            self.model = SentenceTransformer(model_name, device="cpu")
+        else:
+            import onnxruntime
+
+            session_options = onnxruntime.SessionOptions()
+            if num_threads:
+                session_options.intra_op_num_threads = num_threads
+            model_kwargs = {
+                "provider": "CPUExecutionProvider",
+                "session_options": session_options,
+            }
+            if backend == "onnx-int8":
+                model_file = model_file or DEFAULT_INT8_FILE
+            if model_file:
+                model_kwargs["file_name"] = model_file
+            self.model = SentenceTransformer(
+                model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    def __call__(self, input):
+        embeddings = self.model.encode(
+            list(input),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return [np.asarray(embedding, dtype=np.float32) for embedding in embeddings]
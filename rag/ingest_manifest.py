@@ -0,0 +1,159 @@
+import json
+import os
+
+from loaders import file_hash
+
+
+class IngestManifest:
+    """
+    Registro persistente do que já foi ingerido na coleção.
+
+    Para cada arquivo guarda o hash do conteúdo, tamanho, mtime e os chunks
+    gerados (ID -> hash do texto). Com isso a ingestão só reprocessa arquivos
+    novos ou alterados e remove os chunks de arquivos apagados.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self.settings = {}
+        self.files = {}
+
+    @classmethod
+    def load(cls, path: str) -> "IngestManifest":
+        """
+        Carrega o manifesto do disco (ou cria um vazio).
+        """
+        manifest = cls(path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == cls.VERSION:
+                manifest.settings = data.get("settings", {})
+                manifest.files = data.get("files", {})
+                if manifest.settings:
+                    # Manifestos anteriores à escolha do modelo usavam este
+                    manifest.settings.setdefault("embedding_model", "all-MiniLM-L6-v2")
+        return manifest
+
+    def save(self):
+        """
+        Grava o manifesto de forma atômica.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": self.VERSION, "settings": self.settings, "files": self.files},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.path)
+
+    def plan(self, file_paths: list, settings: dict, deleted: list = None) -> tuple:
+        """
+        Compara os arquivos atuais com o manifesto.
+
+        O hash só é recalculado quando tamanho ou mtime mudaram. Se as
+        configurações de chunking mudaram, todos os arquivos são reprocessados.
+
+        Args:
+            file_paths (list): Arquivos presentes no diretório de dados.
+            settings (dict): Configurações que afetam os chunks.
+            deleted (list): Se informado, ``file_paths`` são só os arquivos
+                novos/alterados conhecidos (ex.: delta da sincronização) e
+                ``deleted`` os apagados; os demais ficam como estão.
+
+        Retorna:
+            tuple: (alterados, inalterados, apagados). ``alterados`` é uma
+            lista de (caminho, hash).
+        """
+        settings_changed = settings != self.settings
+        changed, unchanged = [], []
+        if deleted is not None:
+            # Arquivos pendentes de uma ingestão anterior (``invalidate``)
+            # entram mesmo fora do delta
+            listed = set(file_paths)
+            file_paths = list(file_paths) + [
+                path for path, entry in self.files.items()
+                if entry["hash"] is None and path not in listed and os.path.exists(path)
+            ]
+
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            entry = self.files.get(file_path)
+            if (
+                entry
+                and not settings_changed
+                and entry["size"] == stat.st_size
+                and entry["mtime"] == stat.st_mtime_ns
+            ):
+                unchanged.append(file_path)
+                continue
+
+            digest = file_hash(file_path)
+            if entry and not settings_changed and entry["hash"] == digest:
+                # Só o mtime mudou (ex.: arquivo copiado de novo)
+                entry["size"] = stat.st_size
+                entry["mtime"] = stat.st_mtime_ns
+                unchanged.append(file_path)
+            else:
+                changed.append((file_path, digest))
+
+        if deleted is not None:
+            listed = set(file_paths)
+            deleted = [path for path in deleted if path in self.files and path not in listed]
+            skipped = listed.union(deleted)
+            unchanged.extend(path for path in self.files if path not in skipped)
+            return changed, unchanged, deleted
+
+        current = set(file_paths)
+        deleted = [path for path in self.files if path not in current]
+        return changed, unchanged, deleted
+
+    def chunks(self, file_path: str) -> dict:
+        """
+        Chunks registrados para o arquivo (ID -> hash do texto).
+        """
+        entry = self.files.get(file_path)
+        return dict(entry["chunks"]) if entry else {}
+
+    def record(self, file_path: str, digest: str, chunks: dict):
+        """
+        Registra um arquivo ingerido.
+        """
+        stat = os.stat(file_path)
+        self.files[file_path] = {
+            "hash": digest,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "chunks": chunks,
+        }
+
+    def invalidate(self, file_path: str, chunk_ids=()):
+        """
+        Marca um arquivo para ser reprocessado na próxima ingestão, mesmo
+        que ele e as configurações não mudem mais (ex.: o arquivo falhou ou
+        a ingestão parou antes de registrá-lo).
+
+        Os IDs dos chunks antigos e de ``chunk_ids`` (gravados nesta
+        ingestão) são mantidos, para serem removidos quando o arquivo for
+        reprocessado, mas sem o hash do texto: o conteúdo gravado sob cada ID
+        pode já ser outro, então seus embeddings não são reaproveitados.
+        """
+        entry = self.files.setdefault(file_path, {"chunks": {}})
+        entry.update(hash=None, size=None, mtime=None)
+        entry["chunks"] = dict.fromkeys([*entry["chunks"], *chunk_ids])
+
+    def add_chunks(self, file_path: str, chunks: dict):
+        """
+        Acrescenta chunks a um arquivo já registrado (ex.: duplicatas
+        promovidas a canônicas).
+        """
+        self.files[file_path]["chunks"].update(chunks)
+
+    def remove(self, file_path: str):
+        """
+        Remove um arquivo do manifesto.
+        """
+        self.files.pop(file_path, None)
@@ -0,0 +1,438 @@
+import gc
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from logger import get_logger
+from metrics import INGEST_FILE_PEAK_RSS, INGEST_FILES, observe_ingest_file, rss_bytes
+
+logger = get_logger(__name__)
+
+# Marca o fim do fluxo entre as etapas
+_END = object()
+
+
+class FileDone:
+    """
+    Marcador que segue os chunks de um arquivo pelo pipeline. Quando chega
+    ao fim da escrita, todos os chunks do arquivo já foram gravados.
+    """
+
+    __slots__ = ("file_path",)
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+
+class FileFailed:
+    """
+    Marcador que substitui o ``FileDone`` de um arquivo cujo carregamento
+    falhou depois de algumas páginas já terem entrado no pipeline.
+    """
+
+    __slots__ = ("file_path", "error")
+
+    def __init__(self, file_path: str, error: BaseException):
+        self.file_path = file_path
+        self.error = error
+
+
+def _megabytes(size: int) -> float:
+    return round(size / (1024 * 1024), 1) if size else None
+
+
+class StageStats:
+    """
+    Contadores de uma etapa do pipeline.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+
+    def throughput(self) -> float:
+        """
+        Itens processados por segundo de trabalho efetivo da etapa.
+        """
+        return self.items_in / self.busy_seconds if self.busy_seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": round(self.throughput(), 1),
+        }
+
+
+class IngestPipeline:
+    """
+    Pipeline de ingestão em etapas concorrentes: parse -> split -> embed ->
+    write.
+
+    Cada etapa roda numa thread e se comunica com a próxima por filas
+    limitadas. Quando uma etapa mais lenta (normalmente o embedding) fica para
+    trás, as filas enchem e as anteriores esperam, então a memória fica
+    limitada pelo tamanho das filas e dos lotes, e não pelo tamanho do corpus.
+    Com ``memory_limit``, a etapa de parsing também espera as filas
+    esvaziarem sempre que o RSS do processo passa do teto.
+
+    O pico de RSS enquanto cada arquivo está no pipeline (e o do processo de
+    parsing, quando informado) vai para o log, para a métrica
+    ``rag_ingest_file_peak_rss_bytes`` e para ``summary()["memory"]``.
+
+    Args:
+        split_page (callable): ``split_page(file_path, page) -> list`` de
+            registros (dicts com ``id``, ``text`` e ``metadata``).
+        embed_batch (callable): Recebe uma lista de registros e preenche
+            ``embedding`` em cada um.
+        write_batch (callable): Grava uma lista de registros já embedados.
+        file_done (callable): Chamado com o caminho de cada arquivo depois
+            que todos os seus chunks foram gravados.
+        file_failed (callable): ``file_failed(file_path, error)``, chamado
+            quando o carregamento de um arquivo falha no meio, depois de
+            gravados os chunks das páginas que chegaram.
+        embed_batch_size (int): Registros por chamada do modelo de embedding.
+        write_batch_size (int): Registros por escrita no banco.
+        queue_size (int): Capacidade das filas entre as etapas.
+        report_interval (float): Intervalo, em segundos, entre relatórios de
+            progresso.
+        on_progress (callable): Recebe ``summary()`` a cada relatório.
+        memory_limit (int): Teto de RSS deste processo, em bytes.
+    """
+
+    STAGES = ("parse", "split", "embed", "write")
+
+    def __init__(self, split_page, embed_batch, write_batch, file_done,
+                 embed_batch_size: int = 64, write_batch_size: int = 256,
+                 queue_size: int = 32, report_interval: float = 10.0, on_progress=None,
+                 file_failed=None, memory_limit: int = None):
+        self.split_page = split_page
+        self.embed_batch = embed_batch
+        self.write_batch = write_batch
+        self.file_done = file_done
+        self.file_failed = file_failed
+        self.memory_limit = memory_limit
+        self.embed_batch_size = embed_batch_size
+        self.write_batch_size = write_batch_size
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.on_progress = on_progress
+        self.stats = {name: StageStats(name) for name in self.STAGES}
+        self.files_done = 0
+        self.files_failed = 0
+        # Pico de RSS (bytes) de cada arquivo em andamento, do processo de
+        # parsing de cada arquivo e, por arquivo concluído, ambos em MB
+        self._file_rss = {}
+        self._parse_rss = {}
+        self.file_memory = {}
+        self.peak_rss = 0
+        self.memory_wait_seconds = 0.0
+        self._queues = ()
+        # Segundos gastos em cada etapa por arquivo (lotes de embedding e
+        # escrita são divididos entre os arquivos pelo número de chunks)
+        self._file_seconds = defaultdict(lambda: defaultdict(float))
+        self._error = None
+        self._lock = threading.Lock()
+        self._started = None
+        self._last_report = None
+
+    def run(self, loaded_files) -> dict:
+        """
+        Executa o pipeline até consumir todos os arquivos.
+
+        Args:
+            loaded_files (iterable): Pares (caminho, páginas), na ordem em
+                que os arquivos terminam de ser carregados.
+
+        Retorna:
+            dict: Estatísticas por etapa.
+        """
+        self._started = self._last_report = time.monotonic()
+        pages = queue.Queue(maxsize=self.queue_size)
+        records = queue.Queue(maxsize=self.queue_size * 4)
+        batches = queue.Queue(maxsize=max(2, self.queue_size // 8))
+        self._queues = (pages, records, batches)
+
+        threads = [
+            threading.Thread(target=self._run_stage, name="ingest-split",
+                             args=("split", self._split, None, pages, records)),
+            threading.Thread(target=self._run_stage, name="ingest-embed",
+                             args=("embed", self._embed, self._flush_embed, records, batches)),
+            threading.Thread(target=self._run_stage, name="ingest-write",
+                             args=("write", self._write, self._flush_write, batches, None)),
+        ]
+        self._embed_buffer, self._embed_done = [], []
+        self._write_buffer, self._write_done = [], []
+        for thread in threads:
+            thread.start()
+
+        try:
+            self._parse(loaded_files, pages)
+        finally:
+            pages.put(_END)
+            for thread in threads:
+                thread.join()
+
+        self.report(final=True)
+        if self._error is not None:
+            raise self._error
+        summary = self.summary()
+        summary["memory"]["files"] = self.file_memory
+        return summary
+
+    def summary(self) -> dict:
+        """
+        Estatísticas por etapa e totais.
+        """
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        written = self.stats["write"].items_in
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "files": self.files_done,
+            "chunks_written": written,
+            "chunks_per_second": round(written / elapsed, 1) if elapsed else 0.0,
+            "files_failed": self.files_failed,
+            "stages": {name: stats.as_dict() for name, stats in self.stats.items()},
+            "memory": {
+                "peak_rss_mb": _megabytes(self.peak_rss),
+                "limit_mb": _megabytes(self.memory_limit),
+                "wait_seconds": round(self.memory_wait_seconds, 3),
+            },
+        }
+
+    def report(self, final: bool = False):
+        """
+        Imprime o progresso se o intervalo de relatório já passou.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not final and now - self._last_report < self.report_interval:
+                return
+            self._last_report = now
+        stages = ", ".join(
+            f"{name}: {stats.items_in} ({stats.throughput():.1f}/s)"
+            for name, stats in self.stats.items()
+        )
+        prefix = "Ingestão concluída" if final else "Progresso"
+        logger.info(
+            f"{prefix}: {self.files_done} arquivo(s) em "
+            f"{now - self._started:.1f}s | {stages}")
+        if self.on_progress is not None:
+            self.on_progress(self.summary())
+
+    def _fail(self, error: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+
+    def _parse(self, loaded_files, pages: queue.Queue):
+        stats = self.stats["parse"]
+        iterator = iter(loaded_files)
+        try:
+            while self._error is None:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                except BaseException as e:
+                    self._fail(e)
+                    break
+                stats.busy_seconds += time.perf_counter() - started
+                if len(item) == 2:
+                    (file_path, documents), last, error, parse_rss = item, True, None, None
+                else:
+                    file_path, documents, last, error, parse_rss = item
+                with self._lock:
+                    self._file_rss.setdefault(file_path, 0)
+                for page in documents:
+                    self._limit_memory()
+                    pages.put((file_path, page))
+                    stats.items_out += 1
+                if not last:
+                    continue
+                stats.items_in += 1
+                if parse_rss is not None:
+                    self._parse_rss[file_path] = parse_rss
+                pages.put(FileDone(file_path) if error is None else FileFailed(file_path, error))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def _sample_rss(self) -> int:
+        """
+        Mede o RSS atual e atualiza o pico dos arquivos em andamento.
+        """
+        rss = rss_bytes()
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            for file_path, peak in self._file_rss.items():
+                if rss > peak:
+                    self._file_rss[file_path] = rss
+        return rss
+
+    def _limit_memory(self):
+        """
+        Acima do teto de memória, espera as etapas seguintes esvaziarem as
+        filas antes de mandar mais páginas.
+        """
+        if self._sample_rss() <= (self.memory_limit or float("inf")):
+            return
+        started = time.monotonic()
+        while self._error is None and not all(inbox.empty() for inbox in self._queues):
+            time.sleep(0.05)
+        gc.collect()
+        waited = time.monotonic() - started
+        self.memory_wait_seconds += waited
+        if waited > 1.0:
+            logger.warning(
+                f"RSS acima do teto de {_megabytes(self.memory_limit)} MB; "
+                f"parsing pausado por {waited:.1f}s.")
+
+    def _run_stage(self, name: str, handle, flush, inbox: queue.Queue, outbox: queue.Queue):
+        """
+        Laço de uma etapa: consome a fila de entrada até o fim. Se alguma
+        etapa falhar, as demais só drenam as filas para encerrar.
+        """
+        stats = self.stats[name]
+        blocked = [0.0]
+
+        def emit(item):
+            # O tempo esperando vaga na fila seguinte (backpressure) não
+            # conta como trabalho da etapa.
+            started = time.perf_counter()
+            outbox.put(item)
+            blocked[0] += time.perf_counter() - started
+
+        def timed(call, *args):
+            blocked[0] = 0.0
+            started = time.perf_counter()
+            try:
+                call(*args)
+            except BaseException as e:
+                self._fail(e)
+            stats.busy_seconds += time.perf_counter() - started - blocked[0]
+
+        while True:
+            item = inbox.get()
+            if item is _END:
+                break
+            if self._error is not None:
+                continue
+            timed(handle, item, emit)
+            self.report()
+
+        if flush is not None and self._error is None:
+            timed(flush, emit)
+        if outbox is not None:
+            outbox.put(_END)
+
+    def _split(self, item, emit):
+        if isinstance(item, (FileDone, FileFailed)):
+            emit(item)
+            return
+        stats = self.stats["split"]
+        stats.items_in += 1
+        file_path, page = item
+        started = time.perf_counter()
+        records = self.split_page(file_path, page)
+        self._charge("split", {file_path: 1}, time.perf_counter() - started)
+        for record in records:
+            record["file_path"] = file_path
+            emit(record)
+            stats.items_out += 1
+
+    def _embed(self, item, emit):
+        # Marcadores de arquivo ficam pendentes até o lote que contém os
+        # últimos chunks do arquivo ser enviado.
+        if isinstance(item, (FileDone, FileFailed)):
+            self._embed_done.append(item)
+            return
+        self._embed_buffer.append(item)
+        if len(self._embed_buffer) >= self.embed_batch_size:
+            self._flush_embed(emit)
+
+    def _flush_embed(self, emit):
+        batch, done = self._embed_buffer, self._embed_done
+        self._embed_buffer, self._embed_done = [], []
+        if batch:
+            started = time.perf_counter()
+            self.embed_batch(batch)
+            self._charge("embed", self._files_in(batch), time.perf_counter() - started)
+            self.stats["embed"].items_in += len(batch)
+            self.stats["embed"].items_out += len(batch)
+        if batch or done:
+            emit((batch, done))
+
+    def _write(self, item, emit):
+        batch, done = item
+        self._write_buffer.extend(batch)
+        self._write_done.extend(done)
+        if len(self._write_buffer) >= self.write_batch_size:
+            self._flush_write(emit)
+
+    def _flush_write(self, emit):
+        stats = self.stats["write"]
+        buffer, done = self._write_buffer, self._write_done
+        self._write_buffer, self._write_done = [], []
+        for start in range(0, len(buffer), self.write_batch_size):
+            batch = buffer[start:start + self.write_batch_size]
+            started = time.perf_counter()
+            self.write_batch(batch)
+            self._charge("write", self._files_in(batch), time.perf_counter() - started)
+            stats.items_in += len(batch)
+            stats.items_out += len(batch)
+        if done:
+            self._sample_rss()
+        for marker in done:
+            with self._lock:
+                seconds = self._file_seconds.pop(marker.file_path, {})
+            self._record_memory(marker.file_path)
+            if isinstance(marker, FileFailed):
+                logger.error(f"Erro ao carregar {marker.file_path}: {marker.error}")
+                if self.file_failed is not None:
+                    self.file_failed(marker.file_path, marker.error)
+                self.files_failed += 1
+                INGEST_FILES.labels("error").inc()
+                continue
+            self.file_done(marker.file_path)
+            self.files_done += 1
+            observe_ingest_file({stage: seconds.get(stage, 0.0) for stage in ("split", "embed", "write")})
+            INGEST_FILES.labels("ok").inc()
+
+    def _record_memory(self, file_path: str):
+        with self._lock:
+            pipeline_rss = self._file_rss.pop(file_path, 0)
+        parse_rss = self._parse_rss.pop(file_path, None)
+        INGEST_FILE_PEAK_RSS.labels("pipeline").observe(pipeline_rss)
+        if parse_rss is not None:
+            INGEST_FILE_PEAK_RSS.labels("parse").observe(parse_rss)
+        self.file_memory[file_path] = {
+            "pipeline_peak_rss_mb": _megabytes(pipeline_rss),
+            "parse_peak_rss_mb": _megabytes(parse_rss),
+        }
+        logger.info(
+            f"Pico de RSS de {file_path}: {_megabytes(pipeline_rss)} MB na ingestão, "
+            f"{_megabytes(parse_rss)} MB no parsing.")
+
+    @staticmethod
+    def _files_in(batch: list) -> dict:
+        counts = defaultdict(int)
+        for record in batch:
+            counts[record.get("file_path")] += 1
+        return counts
+
+    def _charge(self, stage: str, files: dict, seconds: float):
+        """
+        Divide o tempo de uma operação entre os arquivos envolvidos,
+        proporcionalmente ao número de itens de cada um.
+        """
+        total = sum(files.values())
+        with self._lock:
+            for file_path, count in files.items():
+                self._file_seconds[file_path][stage] += seconds * count / total
@@ -0,0 +1,202 @@
+"""
+Divisão de textos normativos (leis, decretos, instruções normativas) e de
+documentos do SEI (termos de referência, contratos) pela sua estrutura.
+
+Os limites das unidades são reconhecidos por expressões regulares no início
+das linhas: títulos/capítulos/seções, artigos, parágrafos (§), incisos,
+alíneas, cláusulas e itens numerados (1.1, 1.1.1). Cada chunk recebe nos
+metadados o caminho da unidade (ex.: "Art. 75, § 1º, inciso II").
+"""
+import re
+
+# Níveis do caminho de uma unidade
+SECTION, ARTICLE, PARAGRAPH, INCISO, ALINEA = range(5)
+_EMPTY_PATH = (None,) * 5
+
+_UPPER = "A-ZÁÉÍÓÚÂÊÔÃÕÇ"
+_BOUNDARIES = [
+    (SECTION, re.compile(
+        r"^(?P<label>(?:T[ÍI]TULO|CAP[ÍI]TULO|SE[ÇC][ÃA]O|Se[çc][ãa]o|SUBSE[ÇC][ÃA]O|Subse[çc][ãa]o"
+        r"|LIVRO|PARTE|ANEXO|ETAPA)\s+(?:[IVXLCDM]+|\d+|[ÚU]NIC[OA])\b)")),
+    # Títulos numerados do SEI, em maiúsculas: "1. DO OBJETO"
+    (SECTION, re.compile(rf"^(?P<label>\d{{1,2}}\.?\s+[{_UPPER}][{_UPPER}\s,/-]{{3,}})$")),
+    (ARTICLE, re.compile(
+        r"^Art\.\s*(?P<number>\d+(?:\.\d{3})*)\s*[º°o]?(?:\s*-\s*(?P<suffix>[A-Z]))?(?=[\s.,;:–-]|$)")),
+    (ARTICLE, re.compile(rf"^(?P<label>CL[ÁA]USULA\s+[{_UPPER}]+(?:\s+[{_UPPER}]+)?)(?=[\s.–-]|$)")),
+    # Itens numerados: "1.1.", "A.2.", e "1." / "2)" no início de uma frase
+    (ARTICLE, re.compile(r"^(?P<item>(?:\d{1,2}|[A-Z])(?:\.\d{1,3})+)\.?\s")),
+    (ARTICLE, re.compile(rf"^(?P<item>\d{{1,2}})[.)]\s+(?=[{_UPPER}])")),
+    (PARAGRAPH, re.compile(r"^(?:§\s*(?P<number>\d+)\s*[º°o]?|(?P<label>Par[áa]grafo [úu]nico))")),
+    (INCISO, re.compile(r"^(?P<number>[IVXLCDM]+)\s*[-–—]\s")),
+    (ALINEA, re.compile(r"^(?P<letter>[a-z])\)\s")),
+]
+# Fim de frase/enumeração: só depois dele uma linha pode abrir uma unidade
+# (evita tomar por artigo uma remissão quebrada no início da linha)
+_CLOSING = (".", ":", ";", "!", "?")
+
+
+def _label(level: int, match) -> str:
+    groups = match.groupdict()
+    if groups.get("label"):
+        return " ".join(groups["label"].split())
+    if groups.get("item"):
+        return f"item {groups['item']}"
+    if level == ARTICLE:
+        suffix = f"-{groups['suffix']}" if groups.get("suffix") else ""
+        return f"Art. {groups['number']}{suffix}"
+    if level == PARAGRAPH:
+        return f"§ {groups['number']}º"
+    if level == INCISO:
+        return f"inciso {groups['number']}"
+    return f"alínea {groups['letter']}"
+
+
+def _render(first: tuple, last: tuple) -> str:
+    """
+    Caminho comum às unidades de um chunk (sem a seção). Se o chunk junta
+    vários artigos, mostra o intervalo ("Art. 3 a Art. 5").
+    """
+    parts = []
+    for level in range(ARTICLE, ALINEA + 1):
+        if first[level] == last[level]:
+            if first[level] is None:
+                break
+            parts.append(first[level])
+            continue
+        if level == ARTICLE:
+            parts.append(" a ".join(label for label in (first[level], last[level]) if label))
+        break
+    return ", ".join(parts)
+
+
+class LegalTextSplitter:
+    """
+    Divide páginas respeitando os limites de artigos, parágrafos, incisos,
+    alíneas e seções.
+
+    Unidades inteiras e consecutivas da mesma seção são agrupadas enquanto
+    couberem em ``chunk_size``, então um chunk nunca começa nem termina no
+    meio de um artigo, parágrafo ou inciso, e não há sobreposição entre
+    chunks. Uma seção nova (capítulo, etapa) começa um chunk novo, a não ser
+    que o atual seja menor que ``min_chunk_size``. Só as unidades maiores
+    que ``chunk_size`` são divididas por caracteres
+    (``RecursiveCharacterTextSplitter``, com ``chunk_overlap``).
+    Metadados acrescentados a cada chunk: ``start_index``, ``section``,
+    ``article`` (o primeiro do chunk) e ``article_path``.
+
+    Args:
+        chunk_size (int): Tamanho máximo dos chunks, em caracteres.
+        chunk_overlap (int): Sobreposição na divisão por caracteres.
+        min_chunk_size (int): Chunks menores que isso recebem a unidade
+            seguinte mesmo se ela for de outra seção (padrão:
+            ``chunk_size // 4``).
+    """
+
+    def __init__(self, chunk_size: int = 400, chunk_overlap: int = 100, min_chunk_size: int = None):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        self.chunk_size = chunk_size
+        self.min_chunk_size = chunk_size // 4 if min_chunk_size is None else min_chunk_size
+        self._fallback = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+            add_start_index=True,
+        )
+
+    def units(self, text: str, path: tuple = None) -> tuple:
+        """
+        Divide o texto nas suas unidades estruturais.
+
+        Args:
+            text (str): Texto de uma página.
+            path (tuple): Caminho em vigor no início do texto (a unidade que
+                vem da página anterior).
+
+        Retorna:
+            tuple: (lista de (início, fim, caminho), caminho no fim do texto).
+        """
+        path = path or _EMPTY_PATH
+        starts = [(0, path)]
+        offset, previous = 0, ""
+        for line in text.splitlines(keepends=True):
+            stripped = line.strip()
+            # Títulos ("DAS DEFINIÇÕES", "LEI Nº 14.133") também fecham a linha anterior
+            if stripped and (not previous or previous.endswith(_CLOSING) or previous.upper() == previous):
+                for level, pattern in _BOUNDARIES:
+                    match = pattern.match(stripped)
+                    if match:
+                        path = path[:level] + (_label(level, match),) + (None,) * (ALINEA - level)
+                        starts.append((offset + len(line) - len(line.lstrip()), path))
+                        break
+            if stripped:
+                previous = stripped
+            offset += len(line)
+
+        units = []
+        for (start, unit_path), (end, _) in zip(starts, starts[1:] + [(len(text), None)]):
+            if text[start:end].strip():
+                units.append((start, end, unit_path))
+        return units, path
+
+    def split_document(self, document, path: tuple = None) -> tuple:
+        """
+        Divide uma página.
+
+        Retorna:
+            tuple: (chunks, caminho no fim da página), para continuar a
+            divisão na página seguinte do mesmo arquivo.
+        """
+        text = document.page_content
+        units, path = self.units(text, path)
+        chunks = []
+        current = None  # [início, fim, caminho da primeira unidade, da última]
+        for start, end, unit_path in units:
+            if end - start > self.chunk_size:
+                if current:
+                    chunks.append(self._chunk(document, *current))
+                    current = None
+                for piece in self._fallback.create_documents([text[start:end]]):
+                    piece_start = start + piece.metadata["start_index"]
+                    chunks.append(self._chunk(
+                        document, piece_start, piece_start + len(piece.page_content), unit_path, unit_path))
+                continue
+            if current and end - current[0] <= self.chunk_size and (
+                    current[3][SECTION] == unit_path[SECTION]
+                    or current[1] - current[0] < self.min_chunk_size):
+                current[1], current[3] = end, unit_path
+                continue
+            if current:
+                chunks.append(self._chunk(document, *current))
+            current = [start, end, unit_path, unit_path]
+        if current:
+            chunks.append(self._chunk(document, *current))
+        return chunks, path
+
+    def split_documents(self, documents: list) -> list:
+        """
+        Divide páginas em chunks. O caminho continua de uma página para a
+        seguinte quando são do mesmo arquivo.
+        """
+        chunks, path, source = [], None, object()
+        for document in documents:
+            if document.metadata.get("source") != source:
+                path, source = None, document.metadata.get("source")
+            page_chunks, path = self.split_document(document, path)
+            chunks.extend(page_chunks)
+        return chunks
+
+    @staticmethod
+    def _chunk(document, start: int, end: int, first: tuple, last: tuple):
+        text = document.page_content[start:end]
+        start += len(text) - len(text.lstrip())
+        metadata = {**document.metadata, "start_index": start}
+        article_path = _render(first, last)
+        if article_path:
+            metadata["article_path"] = article_path
+        article = first[ARTICLE] or last[ARTICLE]
+        if article:
+            metadata["article"] = article
+        if last[SECTION]:
+            metadata["section"] = last[SECTION]
+        return type(document)(page_content=text.strip(), metadata=metadata)
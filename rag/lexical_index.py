@@ -0,0 +1,197 @@
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from array import array
+
+# Números com pontuação ("14.133", "8.666/93") ficam num token só
+TOKEN_PATTERN = re.compile(r"§|\d+(?:[./-]\d+)*|\w+")
+
+STOPWORDS = frozenset(
+    "a ao aos as com da das de do dos e em na nas no nos o os ou para pela "
+    "pelas pelo pelos por que se sem sua suas seu seus um uma umas uns".split()
+)
+
+
+def tokenize(text: str) -> list:
+    """
+    Divide o texto em termos para o índice lexical.
+
+    Remove acentos e caixa ("Licitação" -> "licitacao"), preserva números com
+    pontuação ("14.133") e o símbolo "§", e descarta stopwords.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [
+        token for token in TOKEN_PATTERN.findall(text)
+        if token not in STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 sobre os mesmos chunks da coleção vetorial.
+
+    Complementa a busca por embeddings em identificadores exatos ("Art. 75",
+    "Lei 14.133", "§ 2º", números de processo), que o MiniLM costuma perder.
+    O índice é atualizado incrementalmente (``add``/``remove``) e salvo em
+    disco como listas de postings compactas (arrays de inteiros).
+
+    Args:
+        k1 (float): Saturação da frequência do termo.
+        b (float): Normalização pelo tamanho do documento.
+    """
+
+    VERSION = 1
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids = []  # número interno -> ID do chunk (None se removido)
+        self.doc_lengths = []
+        self.postings = {}  # termo -> {número do documento: frequência}
+        self._numbers = {}  # ID do chunk -> número interno
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def add(self, ids: list, texts: list):
+        """
+        Indexa (ou reindexa) chunks.
+        """
+        with self._lock:
+            self.remove(ids)
+            for chunk_id, text in zip(ids, texts):
+                terms = tokenize(text)
+                number = len(self.doc_ids)
+                self.doc_ids.append(chunk_id)
+                self.doc_lengths.append(len(terms))
+                self._numbers[chunk_id] = number
+                self._total_length += len(terms)
+                frequencies = {}
+                for term in terms:
+                    frequencies[term] = frequencies.get(term, 0) + 1
+                for term, frequency in frequencies.items():
+                    self.postings.setdefault(term, {})[number] = frequency
+
+    def remove(self, ids: list):
+        """
+        Remove chunks do índice. O espaço é recuperado no ``save``.
+        """
+        with self._lock:
+            removed = set()
+            for chunk_id in ids:
+                number = self._numbers.pop(chunk_id, None)
+                if number is not None:
+                    self.doc_ids[number] = None
+                    self._total_length -= self.doc_lengths[number]
+                    removed.add(number)
+            if not removed:
+                return
+            for term in list(self.postings):
+                docs = self.postings[term]
+                for number in removed.intersection(docs):
+                    del docs[number]
+                if not docs:
+                    del self.postings[term]
+
+    def search(self, query: str, k: int = 10) -> list:
+        """
+        Busca os chunks com maior pontuação BM25.
+
+        Retorna:
+            list: Pares (ID do chunk, pontuação), do mais relevante ao menos.
+        """
+        with self._lock:
+            n_docs = len(self._numbers)
+            if not n_docs:
+                return []
+            average_length = self._total_length / n_docs
+            scores = {}
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for number, frequency in docs.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[number] / average_length)
+                    scores[number] = scores.get(number, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self.doc_ids[number], score) for number, score in best]
+
+    def save(self, path: str):
+        """
+        Grava o índice compactado (sem os chunks removidos) de forma atômica.
+        """
+        with self._lock:
+            renumber = {}
+            doc_ids, doc_lengths = [], array("I")
+            for number, chunk_id in enumerate(self.doc_ids):
+                if chunk_id is not None:
+                    renumber[number] = len(doc_ids)
+                    doc_ids.append(chunk_id)
+                    doc_lengths.append(self.doc_lengths[number])
+            postings = {}
+            for term, docs in self.postings.items():
+                numbers, frequencies = array("I"), array("I")
+                for number in sorted(docs):
+                    numbers.append(renumber[number])
+                    frequencies.append(docs[number])
+                postings[term] = (numbers, frequencies)
+            data = {
+                "version": self.VERSION,
+                "k1": self.k1,
+                "b": self.b,
+                "doc_ids": doc_ids,
+                "doc_lengths": doc_lengths,
+                "postings": postings,
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        Carrega o índice do disco (ou cria um vazio).
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data.get("version") != cls.VERSION:
+            return cls()
+        index = cls(k1=data["k1"], b=data["b"])
+        index.doc_ids = list(data["doc_ids"])
+        index.doc_lengths = list(data["doc_lengths"])
+        index._numbers = {chunk_id: number for number, chunk_id in enumerate(index.doc_ids)}
+        index._total_length = sum(index.doc_lengths)
+        index.postings = {
+            term: dict(zip(numbers, frequencies))
+            for term, (numbers, frequencies) in data["postings"].items()
+        }
+        return index
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    Combina listas ranqueadas de IDs com Reciprocal Rank Fusion.
+
+    Args:
+        rankings (list): Listas de IDs, cada uma do mais ao menos relevante.
+        k (int): Constante de suavização do RRF.
+
+    Retorna:
+        list: Pares (ID, pontuação RRF), do mais relevante ao menos.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
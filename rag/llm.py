@@ -0,0 +1,162 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import google.generativeai as genai
+from dotenv import load_dotenv
+
+
+class LLMBusyError(Exception):
+    """
+    O LLM está saturado e a requisição não pode ser atendida agora.
+    """
+
+    status_code = 503
+
+
+class QueueFullError(LLMBusyError):
+    """
+    A fila de espera por uma vaga no LLM está cheia.
+    """
+
+    status_code = 429
+
+
+class QueueTimeoutError(LLMBusyError):
+    """
+    A requisição esperou demais na fila por uma vaga no LLM.
+    """
+
+    status_code = 503
+
+
+class ConcurrencyLimiter:
+    """
+    Limita as chamadas simultâneas ao LLM, com uma fila de espera limitada.
+
+    Até ``max_concurrency`` chamadas rodam ao mesmo tempo; as demais esperam
+    na fila. Se já houver ``max_queue`` requisições esperando, a nova é
+    recusada na hora (429); se a espera passar de ``queue_timeout`` segundos,
+    é recusada com 503.
+    """
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 64, queue_timeout: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Ocupa uma vaga durante o bloco ``async with``.
+        """
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(
+                "Muitas requisições aguardando o modelo. Tente novamente em instantes.")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise QueueTimeoutError(
+                "Tempo de espera pelo modelo esgotado. Tente novamente em instantes.")
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+        }
+
+
+class GeminiClient:
+    """
+    Cliente de longa duração do Gemini, compartilhado por todas as
+    requisições.
+
+    Args:
+        model_name (str): Modelo do Gemini.
+        max_concurrency (int): Máximo de gerações simultâneas (modo async).
+        max_queue (int): Máximo de requisições esperando vaga.
+        queue_timeout (float): Espera máxima por uma vaga, em segundos.
+    """
+
+    def __init__(self, model_name: str = "gemini-1.5-flash", max_concurrency: int = 16,
+                 max_queue: int = 64, queue_timeout: float = 30.0):
+        load_dotenv()
+
+        api_key = os.getenv("GEMINI_API_KEY")
+
+        if not api_key:
+            raise ValueError(
+                "A chave da API 'GEMINI_API_KEY' não foi encontrada. Verifique o arquivo .env.")
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+        self.limiter = ConcurrencyLimiter(max_concurrency, max_queue, queue_timeout)
+
+    def stream(self, prompt: str):
+        """
+        Gera a resposta em streaming (síncrono). Fechar o gerador cancela a
+        geração.
+
+        Retorna:
+            generator: Partes de texto da resposta.
+        """
+        response_stream = self.model.generate_content(prompt, stream=True)
+        try:
+            for chunk in response_stream:
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            _cancel_stream(response_stream)
+
+    async def astream(self, prompt: str):
+        """
+        Gera a resposta em streaming sem bloquear o event loop. Deve ser
+        chamado dentro de ``limiter.slot()``.
+
+        Retorna:
+            async generator: Partes de texto da resposta.
+        """
+        response_stream = await self.model.generate_content_async(prompt, stream=True)
+        try:
+            async for chunk in response_stream:
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            _cancel_stream(response_stream)
+
+
+def _cancel_stream(response_stream):
+    """
+    Cancela o stream do Gemini se ele ainda estiver aberto.
+
+    O SDK não expõe um ``cancel()`` público; o iterador gRPC interno expõe,
+    então o usamos quando disponível para parar a geração no servidor.
+    """
+    iterator = getattr(response_stream, "_iterator", None)
+    cancel = getattr(iterator, "cancel", None)
+    if callable(cancel):
+        try:
+            cancel()
+        except Exception:
+            pass
@@ -1,25 +1,358 @@
+"""
+Sincronização incremental da pasta do ownCloud com o diretório de dados.
+
+Lista a pasta remota por WebDAV (PROPFIND), compara ETag, tamanho e data de
+modificação com o manifesto local e baixa só os arquivos novos ou alterados,
+em paralelo. Cada download vai para um arquivo parcial que é retomado (Range)
+se a conexão cair e só substitui o arquivo final quando completo. Arquivos
+que sumiram do servidor são apagados localmente. O resultado (adicionados,
+alterados, apagados) pode ser passado à ingestão, que processa só esse delta.
+
+Com ``--ingest``, o delta entra numa reindexação incremental (ver
+``reindex.py``): uma cópia da versão ativa, com o mesmo backend do servidor
+(VECTOR_BACKEND, EMBEDDING_BACKEND e EMBEDDING_SERVICE_SOCKET), recebe o
+delta, é validada e só então vira a versão ativa.
+
+Uso:
+    OWNCLOUD_USER=... OWNCLOUD_PASSWORD=... python load_from_owncloud.py --ingest
+
+Para testar, ``--webdav-url`` aceita qualquer servidor WebDAV local (ex.:
+``wsgidav --root /tmp/nuvem --auth anonymous --port 8080``).
+"""
+import argparse
+import glob
+import hashlib
+import json
 import os
-from owncloud import Client
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, unquote, urlsplit
+
+import requests
+from dotenv import load_dotenv
+
+from loaders import SUPPORTED_EXTENSIONS
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+_PROPFIND_BODY = """<?xml version="1.0" encoding="utf-8"?>
+<d:propfind xmlns:d="DAV:">
+  <d:prop><d:resourcetype/><d:getetag/><d:getcontentlength/><d:getlastmodified/></d:prop>
+</d:propfind>"""
+_DAV = "{DAV:}"
+
+
+class RemoteFile:
+    """
+    Arquivo listado na pasta remota.
+    """
+
+    __slots__ = ("name", "etag", "size", "mtime")
+
+    def __init__(self, name: str, etag: str, size: int, mtime: float):
+        self.name = name
+        self.etag = etag
+        self.size = size
+        self.mtime = mtime
+
+    def as_dict(self) -> dict:
+        return {"etag": self.etag, "size": self.size, "mtime": self.mtime}
+
+
+class WebDAVClient:
+    """
+    Cliente WebDAV mínimo (listagem e download) sobre ``requests``.
+
+    Cada thread usa sua própria sessão HTTP, com conexões reaproveitadas.
+
+    Args:
+        url (str): URL WebDAV da pasta (ex.:
+            ``https://nuvem.utfpr.edu.br/remote.php/webdav/Estagiários/IA-compras``).
+        username (str): Usuário (None para servidores sem autenticação).
+        password (str): Senha.
+        timeout (float): Tempo máximo de conexão/leitura, em segundos.
+    """
+
+    def __init__(self, url: str, username: str = None, password: str = None, timeout: float = 60.0):
+        self.url = url.rstrip("/") + "/"
+        self.auth = (username, password) if username else None
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.auth = self.auth
+        return session
+
+    def file_url(self, name: str) -> str:
+        return self.url + quote(name)
+
+    def list(self) -> list:
+        """
+        Arquivos (não pastas) da pasta remota.
+        """
+        response = self.session.request(
+            "PROPFIND", self.url, data=_PROPFIND_BODY.encode("utf-8"),
+            headers={"Depth": "1", "Content-Type": "application/xml; charset=utf-8"},
+            timeout=self.timeout)
+        response.raise_for_status()
+        base_path = unquote(urlsplit(self.url).path).rstrip("/")
+        files = []
+        for item in ET.fromstring(response.content).iter(f"{_DAV}response"):
+            path = unquote(urlsplit(item.findtext(f"{_DAV}href", "")).path).rstrip("/")
+            prop = item.find(f"{_DAV}propstat/{_DAV}prop")
+            if path == base_path or prop is None:
+                continue
+            if prop.find(f"{_DAV}resourcetype/{_DAV}collection") is not None:
+                continue
+            modified = prop.findtext(f"{_DAV}getlastmodified")
+            files.append(RemoteFile(
+                name=path.rsplit("/", 1)[-1],
+                etag=prop.findtext(f"{_DAV}getetag") or "",
+                size=int(prop.findtext(f"{_DAV}getcontentlength") or -1),
+                mtime=parsedate_to_datetime(modified).timestamp() if modified else 0.0,
+            ))
+        return files
+
+    def download(self, remote: RemoteFile, local_path: str, retries: int = 3):
+        """
+        Baixa o arquivo de forma atômica e retomável.
+
+        O conteúdo vai para ``.<nome>.<etag>.part`` no mesmo diretório; se
+        esse parcial já existir (download interrompido da mesma versão), só o
+        restante é pedido. O arquivo final só é substituído quando o tamanho
+        confere. Um parcial maior que o arquivo remoto, ou que o servidor
+        não aceita retomar (416), é descartado e o download recomeça do
+        zero.
+        """
+        directory, name = os.path.split(local_path)
+        tag = hashlib.sha1(remote.etag.encode("utf-8")).hexdigest()[:12]
+        part_path = os.path.join(directory, f".{name}.{tag}.part")
+        # Parciais de outras versões do arquivo não servem mais
+        for stale in glob.glob(os.path.join(directory, glob.escape(f".{name}.") + "*.part")):
+            if stale != part_path:
+                os.remove(stale)
+
+        for attempt in range(retries):
+            try:
+                self._fetch(remote, part_path)
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == retries - 1:
+                    raise
+                logger.warning(f"Download de {remote.name} interrompido ({e}); retomando.")
+                time.sleep(2 ** attempt)
+
+        size = os.path.getsize(part_path)
+        if remote.size >= 0 and size != remote.size:
+            raise IOError(f"{remote.name}: {size} bytes baixados, esperados {remote.size}.")
+        os.replace(part_path, local_path)
+        if remote.mtime:
+            os.utime(local_path, (remote.mtime, remote.mtime))
+
+    def _fetch(self, remote: RemoteFile, part_path: str):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if remote.size >= 0 and offset > remote.size:
+            os.remove(part_path)
+            offset = 0
+        if offset and offset == remote.size:
+            return
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if remote.etag:
+                # Se o arquivo mudou no meio do caminho, o servidor manda tudo
+                headers["If-Range"] = remote.etag
+        with self.session.get(self.file_url(remote.name), headers=headers, stream=True,
+                              timeout=self.timeout) as response:
+            if offset and response.status_code == 416:
+                # Range fora do arquivo: o parcial não serve para retomar
+                os.remove(part_path)
+                return self._fetch(remote, part_path)
+            response.raise_for_status()
+            mode = "ab" if response.status_code == 206 else "wb"
+            with open(part_path, mode) as f:
+                for block in response.iter_content(64 * 1024):
+                    f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class SyncManifest:
+    """
+    Versão remota (ETag, tamanho, mtime) de cada arquivo já baixado.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def is_current(self, remote: RemoteFile, local_path: str) -> bool:
+        entry = self.files.get(remote.name)
+        return (
+            entry is not None
+            and entry == remote.as_dict()
+            and os.path.exists(local_path)
+            and (remote.size < 0 or os.path.getsize(local_path) == remote.size)
+        )
+
+    def record(self, remote: RemoteFile):
+        with self._lock:
+            self.files[remote.name] = remote.as_dict()
+
+    def remove(self, name: str):
+        with self._lock:
+            self.files.pop(name, None)
+
+    def save(self):
+        with self._lock:
+            data = json.dumps({"files": self.files}, ensure_ascii=False, indent=1)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+def sync(client: WebDAVClient, local_dir: str, max_workers: int = 4, delete: bool = True,
+         extensions: tuple = SUPPORTED_EXTENSIONS) -> dict:
+    """
+    Sincroniza a pasta remota com ``local_dir``.
+
+    Args:
+        client (WebDAVClient): Cliente da pasta remota.
+        local_dir (str): Diretório de dados local.
+        max_workers (int): Downloads simultâneos.
+        delete (bool): Apaga os arquivos locais que sumiram do servidor
+            (só os que foram baixados por esta sincronização).
+        extensions (tuple): Extensões baixadas (as que a ingestão carrega).
+
+    Retorna:
+        dict: Caminhos locais em ``added``, ``changed``, ``deleted``,
+        ``unchanged`` e ``failed``, no formato aceito por
+        ``DocumentProcessor.process_and_ingest_documents(delta=...)``.
+    """
+    os.makedirs(local_dir, exist_ok=True)
+    manifest = SyncManifest(os.path.join(local_dir, ".owncloud_sync.json"))
+    remote_files = [
+        remote for remote in client.list()
+        if remote.name.lower().endswith(tuple(extensions))
+    ]
+    result = {"added": [], "changed": [], "deleted": [], "unchanged": [], "failed": []}
+
+    pending = []
+    for remote in remote_files:
+        local_path = os.path.join(local_dir, remote.name)
+        if manifest.is_current(remote, local_path):
+            result["unchanged"].append(local_path)
+        else:
+            pending.append((remote, local_path))
+
+    logger.info(
+        f"ownCloud: {len(remote_files)} arquivo(s) remoto(s), {len(pending)} a baixar.")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="owncloud") as executor:
+        futures = {
+            executor.submit(client.download, remote, local_path): (remote, local_path)
+            for remote, local_path in pending
+        }
+        for future in as_completed(futures):
+            remote, local_path = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Falha ao baixar {remote.name}: {e}")
+                result["failed"].append(local_path)
+                continue
+            result["changed" if remote.name in manifest.files else "added"].append(local_path)
+            manifest.record(remote)
+            manifest.save()
+            logger.info(f"Baixado: {remote.name} ({remote.size} bytes)")
+
+    if delete:
+        current = {remote.name for remote in remote_files}
+        for name in [name for name in manifest.files if name not in current]:
+            local_path = os.path.join(local_dir, name)
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            manifest.remove(name)
+            result["deleted"].append(local_path)
+            logger.info(f"Removido (apagado no servidor): {name}")
+
+    manifest.save()
+    logger.info(
+        f"Sincronização em {time.monotonic() - started:.1f}s: "
+        + ", ".join(f"{len(paths)} {key}" for key, paths in result.items()))
+    return result
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--server", default=os.getenv("OWNCLOUD_URL", "https://nuvem.utfpr.edu.br"))
+    parser.add_argument("--folder", default=os.getenv("OWNCLOUD_FOLDER", "/Estagiários/IA-compras"))
+    parser.add_argument("--webdav-url", default=None,
+                        help="URL WebDAV completa da pasta (padrão: <server>/remote.php/webdav<folder>)")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--workers", type=int, default=4, help="Downloads simultâneos")
+    parser.add_argument("--keep-deleted", action="store_true",
+                        help="Não apaga arquivos locais removidos do servidor")
+    parser.add_argument("--delta-output", default=None, help="Grava o delta em JSON neste arquivo")
+    parser.add_argument("--ingest", action="store_true",
+                        help="Ingere o delta numa nova versão da coleção (reindexação incremental)")
+    parser.add_argument("--chroma", default="chroma_db")
+    parser.add_argument("--collection", default="utfpr")
+    parser.add_argument("--vector-backend", default=os.getenv("VECTOR_BACKEND", "chroma"))
+    parser.add_argument("--embedding-backend", default=os.getenv("EMBEDDING_BACKEND", "torch"))
+    parser.add_argument("--embedding-service", default=os.getenv("EMBEDDING_SERVICE_SOCKET") or None,
+                        help="Socket do serviço de embedding")
+    parser.add_argument("--chunker", default="legal", choices=("legal", "recursive"))
+    args = parser.parse_args()
 
-oc = Client('https://nuvem.utfpr.edu.br')
-oc.login('user', 'senha')
+    url = args.webdav_url or args.server.rstrip("/") + "/remote.php/webdav" + quote(args.folder)
+    client = WebDAVClient(url, os.getenv("OWNCLOUD_USER"), os.getenv("OWNCLOUD_PASSWORD"))
+    delta = sync(client, args.data, max_workers=args.workers, delete=not args.keep_deleted)
 
-folder_path = '/Estagiários/IA-compras'
+    if args.delta_output:
+        with open(args.delta_output, "w", encoding="utf-8") as f:
+            json.dump(delta, f, ensure_ascii=False, indent=2)
 
-local_download_folder = r'C:\Users\lucas\Documents\Python\rag-compras\data'
-os.makedirs(local_download_folder, exist_ok=True)
+    if args.ingest:
+        from reindex import CollectionAlias, ReindexJob, is_running
 
-files = oc.list(folder_path)
+        if not (delta["added"] or delta["changed"] or delta["deleted"]):
+            logger.info("Nada mudou no ownCloud; a coleção fica como está.")
+            return
+        alias = CollectionAlias(args.chroma, args.collection)
+        if is_running(alias.status()):
+            sys.exit("Já existe uma reindexação em andamento.")
+        job = ReindexJob(
+            alias,
+            args.data,
+            incremental=True,
+            processor_options={
+                "vector_backend": args.vector_backend,
+                "embedding_backend": args.embedding_backend,
+                "embedding_service": args.embedding_service,
+            },
+            ingest_options={"delta": delta, "chunker": args.chunker},
+        )
+        state = job.run()
+        if state["state"] != "done":
+            sys.exit(f"Ingestão do delta falhou: {state.get('error')}")
+        logger.info(f"Ingestão do delta: versão {state['version']} ativada.")
 
-for f in files:
-    if not f.is_dir():
-        print(f.name)
-        local_file = os.path.join(local_download_folder, f.name)
-        
 
-        if os.path.exists(local_file):
-            print(f"⚠ Já existe: {f.name}, pulando...")
-            continue
-    
-        oc.get_file(folder_path + '/' + f.name, local_file)
-        print(f"✔ Baixado: {f.name}")
+if __name__ == "__main__":
+    main()
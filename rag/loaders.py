@@ -0,0 +1,446 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
+from multiprocessing.connection import wait as wait_connections
+from typing import NamedTuple
+
+from metrics import INGEST_STAGE_SECONDS, rss_bytes
+
+# Extensões que sabemos carregar
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".docx")
+
+# Incrementar quando ``load_file`` passar a extrair o texto de outro jeito;
+# invalida o cache de parsing (ver ``cache.ParseCache``)
+LOADER_VERSION = 1
+# Bibliotecas cujo parsing depende da versão instalada, por extensão
+_LOADER_PACKAGES = {
+    ".pdf": ("langchain-community", "pypdf"),
+    ".txt": ("langchain-community",),
+    ".docx": ("langchain-community", "unstructured"),
+}
+
+
+def list_data_files(data_path: str) -> list:
+    """
+    Lista os arquivos suportados do diretório de dados.
+
+    Args:
+        data_path (str): Diretório com os documentos.
+
+    Retorna:
+        list: Caminhos dos arquivos, em ordem alfabética.
+    """
+    files = []
+    for file_name in sorted(os.listdir(data_path)):
+        file_path = os.path.join(data_path, file_name)
+        if os.path.isfile(file_path) and file_name.lower().endswith(SUPPORTED_EXTENSIONS):
+            files.append(file_path)
+    return files
+
+
+def loader_for(file_path: str):
+    """
+    Retorna o loader do LangChain adequado para o arquivo, ou None.
+    """
+    # Import tardio: os loaders do langchain_community são lentos para
+    # importar e só são necessários na ingestão.
+    from langchain_community.document_loaders import (
+        PyPDFLoader,
+        TextLoader,
+        UnstructuredWordDocumentLoader,
+    )
+
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".pdf":
+        return PyPDFLoader(file_path)
+    if extension == ".txt":
+        return TextLoader(file_path, encoding="utf-8")
+    if extension == ".docx":
+        return UnstructuredWordDocumentLoader(file_path)
+    return None
+
+
+@lru_cache(maxsize=None)
+def _loader_version(extension: str) -> str:
+    parts = [f"v{LOADER_VERSION}"]
+    for package in _LOADER_PACKAGES.get(extension, ()):
+        try:
+            parts.append(f"{package}={version(package)}")
+        except PackageNotFoundError:
+            parts.append(f"{package}=none")
+    return f"{extension}:" + ",".join(parts)
+
+
+def loader_version(file_path: str) -> str:
+    """
+    Identifica o loader usado para o arquivo e as versões das bibliotecas
+    envolvidas (ex.: ``.pdf:v1,langchain-community=0.4.2,pypdf=6.20.1``).
+    """
+    return _loader_version(os.path.splitext(file_path)[1].lower())
+
+
+def load_file(file_path: str) -> list:
+    """
+    Carrega um único arquivo. Executado nos processos do pool.
+    """
+    loader = loader_for(file_path)
+    if loader is None:
+        return []
+    return loader.load()
+
+
+def iter_file_pages(file_path: str):
+    """
+    Carrega um arquivo página a página (``lazy_load`` do loader), sem montar
+    a lista de todas as páginas.
+    """
+    loader = loader_for(file_path)
+    if loader is None:
+        return iter(())
+    return loader.lazy_load()
+
+
+def iter_load_files(file_paths: list, max_workers: int = None, timeout: float = None):
+    """
+    Carrega arquivos em paralelo num pool de processos.
+
+    O parsing de PDF é limitado por CPU, então cada arquivo vai para um
+    processo. Os resultados são produzidos na ordem em que ficam prontos,
+    permitindo que o chunking comece antes do PDF mais lento terminar. Erros
+    de um arquivo não afetam os demais.
+
+    Args:
+        file_paths (list): Arquivos a carregar.
+        max_workers (int): Número de processos (padrão: número de CPUs).
+            Com 1, carrega no próprio processo.
+        timeout (float): Tempo máximo por arquivo, em segundos, sem contar
+            o tempo em que o consumidor fica com o gerador parado.
+
+    Retorna:
+        generator: Tuplas (caminho, documentos, erro). ``erro`` é None em
+        caso de sucesso.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1:
+        for file_path in file_paths:
+            started = time.monotonic()
+            try:
+                documents = load_file(file_path)
+            except Exception as e:
+                yield file_path, [], e
+                continue
+            INGEST_STAGE_SECONDS.labels("parse").observe(time.monotonic() - started)
+            yield file_path, documents, None
+        return
+
+    pending = list(reversed(file_paths))
+    # Arquivos que estavam em andamento quando um processo morreu. São
+    # reexecutados sozinhos para identificar qual deles derrubou o pool.
+    suspects = []
+    running = {}  # future -> (caminho, início, isolado)
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or suspects or running:
+            # Janela deslizante: no máximo um arquivo por processo, assim o
+            # tempo desde o envio é o tempo de execução do arquivo.
+            if suspects:
+                if not running:
+                    file_path = suspects.pop()
+                    future = executor.submit(load_file, file_path)
+                    running[future] = (file_path, time.monotonic(), True)
+            else:
+                while pending and len(running) < max_workers:
+                    file_path = pending.pop()
+                    future = executor.submit(load_file, file_path)
+                    running[future] = (file_path, time.monotonic(), False)
+
+            wait_timeout = None
+            if timeout is not None:
+                oldest = min(started for _, started, _ in running.values())
+                wait_timeout = max(0.0, oldest + timeout - time.monotonic())
+            done, _ = wait(running, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+
+            results = []
+            restart = False
+            for future in done:
+                file_path, started, isolated = running.pop(future)
+                try:
+                    documents = future.result()
+                    INGEST_STAGE_SECONDS.labels("parse").observe(time.monotonic() - started)
+                    results.append((file_path, documents, None))
+                except BrokenProcessPool as e:
+                    restart = True
+                    if isolated:
+                        results.append((file_path, [], e))
+                    else:
+                        suspects.append(file_path)
+                except Exception as e:
+                    results.append((file_path, [], e))
+
+            if timeout is not None:
+                now = time.monotonic()
+                for future, (file_path, started, _) in list(running.items()):
+                    # Terminou depois do wait: entra na próxima volta
+                    if future.done():
+                        continue
+                    if now - started >= timeout:
+                        del running[future]
+                        restart = True
+                        results.append((file_path, [], TimeoutError(
+                            f"Tempo limite de {timeout}s excedido ao carregar {file_path}.")))
+
+            if restart:
+                # Um processo travou ou morreu: encerra o pool e recoloca na
+                # fila os arquivos que ainda estavam em andamento.
+                for file_path, _, isolated in running.values():
+                    (suspects if isolated else pending).append(file_path)
+                running.clear()
+                _terminate_executor(executor)
+                executor = ProcessPoolExecutor(max_workers=max_workers)
+
+            suspended = time.monotonic()
+            yield from results
+            # O tempo em que o consumidor segurou o gerador (contrapressão do
+            # pipeline) não conta para o tempo limite dos arquivos em
+            # andamento
+            held = time.monotonic() - suspended
+            for future, (file_path, started, isolated) in running.items():
+                running[future] = (file_path, started + held, isolated)
+    finally:
+        _terminate_executor(executor)
+
+
+class LoadedPages(NamedTuple):
+    """
+    Lote de páginas de um arquivo carregado aos poucos (``stream_load_files``).
+
+    ``last`` indica o último lote do arquivo; nele, ``error`` é a exceção que
+    interrompeu o carregamento (os lotes anteriores já foram entregues) e
+    ``peak_rss`` é o pico de memória, em bytes, do processo que fez o
+    parsing.
+    """
+
+    file_path: str
+    pages: list
+    last: bool = False
+    error: Exception = None
+    peak_rss: int = None
+
+
+def _stream_worker(connection, batch_size: int):
+    """
+    Laço de um processo de parsing: recebe caminhos e devolve as páginas em
+    lotes. ``send`` bloqueia quando o pipe está cheio, então o processo só
+    adianta o parsing até alguns lotes à frente do consumidor.
+    """
+    while True:
+        try:
+            file_path = connection.recv()
+        except EOFError:
+            return
+        if file_path is None:
+            return
+        batch, peak = [], rss_bytes()
+        try:
+            for page in iter_file_pages(file_path):
+                batch.append(page)
+                if len(batch) >= batch_size:
+                    peak = max(peak, rss_bytes())
+                    connection.send(("pages", batch))
+                    batch = []
+        except Exception as e:
+            # A exceção pode não ser serializável; vai só a mensagem
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+            continue
+        connection.send(("done", batch, max(peak, rss_bytes())))
+
+
+class _StreamWorker:
+    """
+    Processo de parsing de ``stream_load_files`` e o arquivo em andamento
+    nele.
+    """
+
+    def __init__(self, batch_size: int):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_stream_worker, args=(child, batch_size), daemon=True)
+        self.process.start()
+        child.close()
+        self.file_path = None
+        self.started = None
+        self.last_message = None
+
+    def start(self, file_path: str):
+        self.file_path = file_path
+        self.started = self.last_message = time.monotonic()
+        self.connection.send(file_path)
+
+    def finish(self):
+        INGEST_STAGE_SECONDS.labels("parse").observe(time.monotonic() - self.started)
+        self.file_path = None
+
+    def rss(self) -> int:
+        return rss_bytes(self.process.pid)
+
+    def died(self) -> RuntimeError:
+        return RuntimeError(
+            f"O processo de parsing terminou inesperadamente ao carregar "
+            f"{self.file_path} (código {self.process.exitcode}).")
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+def stream_load_files(file_paths: list, max_workers: int = None, timeout: float = None,
+                      batch_size: int = 8, memory_limit: int = None):
+    """
+    Carrega arquivos em paralelo entregando as páginas em lotes, à medida
+    que são extraídas, em vez do arquivo inteiro de uma vez.
+
+    Cada processo carrega um arquivo por vez com ``lazy_load`` e fica no
+    máximo alguns lotes à frente do consumidor, então a memória não cresce
+    com o número de páginas do arquivo. Lotes de arquivos diferentes chegam
+    intercalados, para que um PDF enorme não segure os demais.
+
+    Args:
+        file_paths (list): Arquivos a carregar.
+        max_workers (int): Número de processos (padrão: número de CPUs).
+        timeout (float): Tempo máximo, em segundos, de um processo sem
+            entregar páginas enquanto o consumidor espera (parser travado).
+        batch_size (int): Páginas por lote.
+        memory_limit (int): Teto de RSS, em bytes, somando este processo e
+            os de parsing. Acima dele, nenhum arquivo novo começa até os em
+            andamento terminarem, e processos que passaram da sua parte do
+            teto são reiniciados entre um arquivo e outro.
+
+    Retorna:
+        generator: ``LoadedPages``. Erros de um arquivo não afetam os demais.
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, len(file_paths))
+    if not max_workers:
+        return
+    # Importa os loaders antes de criar os processos, que herdam os módulos
+    # já carregados (no fork) em vez de importar um por um
+    loader_for("")
+    pending = deque(file_paths)
+    workers = []
+    try:
+        while True:
+            for index in range(max_workers):
+                if not pending:
+                    break
+                if index == len(workers):
+                    workers.append(_StreamWorker(batch_size))
+                worker = workers[index]
+                if worker.file_path is not None:
+                    continue
+                busy = any(other.file_path is not None for other in workers)
+                if busy and memory_limit and _total_rss(workers) >= memory_limit:
+                    break
+                worker.start(pending.popleft())
+
+            busy = {worker.connection: worker for worker in workers if worker.file_path is not None}
+            if not busy:
+                break
+            ready = wait_connections(list(busy), timeout=1.0 if timeout is None else min(1.0, timeout))
+            if not ready:
+                # Nenhum pipe tem dados, então nenhum processo está parado
+                # esperando o consumidor: quem está em silêncio há mais que
+                # o tempo limite travou (ou morreu).
+                now = time.monotonic()
+                for index, worker in enumerate(workers):
+                    if worker.file_path is None:
+                        continue
+                    if not worker.process.is_alive():
+                        error = worker.died()
+                    elif timeout is not None and now - worker.last_message >= timeout:
+                        error = TimeoutError(
+                            f"Tempo limite de {timeout}s excedido ao carregar {worker.file_path}.")
+                    else:
+                        continue
+                    file_path = worker.file_path
+                    worker.stop()
+                    workers[index] = _StreamWorker(batch_size)
+                    yield LoadedPages(file_path, [], True, error)
+                continue
+
+            for connection in ready:
+                worker = busy[connection]
+                file_path = worker.file_path
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    worker.stop()
+                    workers[workers.index(worker)] = _StreamWorker(batch_size)
+                    yield LoadedPages(file_path, [], True, worker.died())
+                    continue
+                worker.last_message = time.monotonic()
+                if message[0] == "pages":
+                    yield LoadedPages(file_path, message[1])
+                    continue
+                worker.finish()
+                if message[0] == "error":
+                    yield LoadedPages(file_path, [], True, RuntimeError(message[1]))
+                    continue
+                _, pages, peak_rss = message
+                if memory_limit and worker.rss() > memory_limit / (max_workers + 1):
+                    # O alocador raramente devolve a memória de um PDF grande
+                    # ao sistema; um processo novo volta ao tamanho inicial.
+                    worker.stop()
+                    workers[workers.index(worker)] = _StreamWorker(batch_size)
+                yield LoadedPages(file_path, pages, True, None, peak_rss)
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+def _total_rss(workers: list) -> int:
+    return rss_bytes() + sum(worker.rss() for worker in workers)
+
+
+def _terminate_executor(executor: ProcessPoolExecutor):
+    """
+    Encerra o pool sem esperar por processos travados.
+    """
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Calcula o SHA-256 do conteúdo do arquivo.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    """
+    Hash curto do texto de um chunk, usado para reaproveitar embeddings.
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_id(file_digest: str, page: int, start_index: int) -> str:
+    """
+    ID estável de um chunk: derivado do hash do arquivo e da posição do chunk.
+    """
+    return f"{file_digest[:20]}:{page}:{start_index}"
@@ -0,0 +1,25 @@
+import logging
+import os
+
+_configured = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger do projeto, com nível vindo de ``LOG_LEVEL`` (padrão INFO).
+
+    Mensagens por consulta usam DEBUG, então em produção (INFO ou acima) os
+    caminhos quentes não escrevem no stdout.
+    """
+    global _configured
+    if not _configured:
+        _configured = True
+        root = logging.getLogger("rag")
+        if not root.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(
+                "%(asctime)s %(levelname)s %(name)s: %(message)s"))
+            root.addHandler(handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        root.propagate = False
+    return logging.getLogger(f"rag.{name}")
@@ -0,0 +1,186 @@
+"""
+Métricas Prometheus e spans de tempo das etapas da consulta e da ingestão.
+
+Cada etapa medida com ``span`` vai para um histograma (exportado em
+/metrics) e, se houver uma requisição em andamento (``start_request``), para
+o dicionário de tempos dela, usado no cabeçalho ``Server-Timing``.
+
+Com vários workers (gunicorn), defina ``PROMETHEUS_MULTIPROC_DIR`` para que o
+/metrics some os valores de todos os processos.
+"""
+import contextvars
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+
+# Etapas da consulta: embed_query, vector_search, lexical_search, retrieve,
+# prompt, first_token, generation e total
+QUERY_STAGE_SECONDS = Histogram(
+    "rag_query_stage_seconds",
+    "Duração de cada etapa de uma consulta.",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+# Etapas da ingestão, por arquivo: parse, split, embed e write
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds",
+    "Tempo gasto em cada etapa da ingestão de um arquivo.",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+INGEST_FILES = Counter(
+    "rag_ingest_files_total",
+    "Arquivos processados na ingestão, por resultado.",
+    ["status"],
+)
+
+REQUESTS = Counter(
+    "rag_requests_total",
+    "Requisições HTTP por rota e status.",
+    ["endpoint", "status"],
+)
+
+CACHE_LOOKUPS = Counter(
+    "rag_cache_lookups_total",
+    "Consultas aos caches, por cache e resultado (hit/miss).",
+    ["cache", "result"],
+)
+
+# Pedidos do /chat por papel na coalescência: leader (gerou a resposta) ou
+# follower (recebeu o stream de um pedido igual em andamento). Razão de
+# coalescência: follower / (leader + follower)
+CHAT_COALESCED = Counter(
+    "rag_chat_coalesced_total",
+    "Pedidos do /chat por papel na coalescência de pedidos iguais.",
+    ["role"],
+)
+
+# Pico de memória residente por arquivo ingerido: do processo da ingestão
+# (pipeline) e do processo que fez o parsing (parse)
+INGEST_FILE_PEAK_RSS = Histogram(
+    "rag_ingest_file_peak_rss_bytes",
+    "Pico de RSS enquanto cada arquivo era ingerido, por processo.",
+    ["process"],
+    buckets=tuple(megabytes * 1024 * 1024 for megabytes in (64, 128, 256, 512, 1024, 2048, 4096, 8192)),
+)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Tempos (ms) das etapas da requisição atual; None fora de uma requisição
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request() -> dict:
+    """
+    Começa a coletar os tempos das etapas da requisição atual.
+
+    O dicionário retornado é compartilhado com as threads que recebem uma
+    cópia do contexto (``run_in_context``), então os tempos medidos nelas
+    também aparecem aqui.
+    """
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record(stage: str, seconds: float):
+    """
+    Registra a duração de uma etapa da consulta.
+    """
+    QUERY_STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Mede o bloco ``with`` como uma etapa da consulta.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def run_in_context(function):
+    """
+    Envolve ``function`` para rodar numa thread com o contexto atual (os
+    executores não propagam ``contextvars`` sozinhos).
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+
+def server_timing(timings: dict) -> str:
+    """
+    Formata os tempos de uma requisição para o cabeçalho ``Server-Timing``.
+    """
+    return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())
+
+
+def observe_ingest_file(stage_seconds: dict):
+    """
+    Registra os tempos de cada etapa da ingestão de um arquivo.
+    """
+    for stage, seconds in stage_seconds.items():
+        INGEST_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def rss_bytes(pid: int = None) -> int:
+    """
+    Memória residente (RSS) atual de um processo, em bytes.
+
+    Lê ``/proc/<pid>/statm`` (Linux). Em outros sistemas, e só para o
+    próprio processo, usa o pico de ``resource.getrusage``.
+
+    Args:
+        pid (int): Processo a medir (padrão: o atual).
+
+    Retorna:
+        int: RSS em bytes, ou 0 se não for possível medir.
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    if pid is not None:
+        return 0
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KiB no Linux e em bytes no macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def export() -> tuple:
+    """
+    Métricas no formato texto do Prometheus.
+
+    Retorna:
+        tuple: (corpo, content type).
+    """
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
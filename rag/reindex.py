@@ -0,0 +1,383 @@
+"""
+Reindexação sem downtime (blue/green).
+
+Cada reindexação constrói uma versão nova e completa da coleção num
+diretório próprio (``<chroma_path>/versions/<alias>_<data>``), ao lado da
+versão em uso, valida a versão nova (contagem e busca de teste) e só então
+troca o alias, gravado de forma atômica em ``<chroma_path>/<alias>_alias.json``.
+O servidor percebe a troca e passa a usar a versão nova; a anterior é mantida
+para rollback.
+
+Uma reindexação incremental (``--delta``, ex.: o delta gravado por
+``load_from_owncloud.py --delta-output``) parte de uma cópia da versão ativa
+e processa só os arquivos alterados, com a mesma validação e troca de alias.
+
+Uso (normalmente disparado pelo servidor em POST /admin/reindex):
+    python reindex.py --data data --chroma chroma_db --alias utfpr
+    python reindex.py --data data --chroma chroma_db --alias utfpr --delta delta.json
+    python reindex.py --chroma chroma_db --alias utfpr --rollback
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import traceback
+
+from loaders import list_data_files
+from logger import get_logger
+from vector_database import make_vector_base
+
+logger = get_logger(__name__)
+
+# Nome da "versão" que aponta para o próprio chroma_path (coleção criada
+# antes dos aliases existirem)
+LEGACY_VERSION = "."
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+class CollectionAlias:
+    """
+    Alias que aponta para a versão ativa de uma coleção.
+
+    Sem arquivo de alias, a versão ativa é o próprio ``chroma_path``
+    (``LEGACY_VERSION``), então instalações antigas continuam funcionando.
+
+    Args:
+        chroma_path (str): Diretório base dos bancos.
+        alias (str): Nome lógico da coleção (ex.: "utfpr").
+    """
+
+    def __init__(self, chroma_path: str, alias: str):
+        self.chroma_path = chroma_path
+        self.alias = alias
+        self.path = os.path.join(chroma_path, f"{alias}_alias.json")
+        self.versions_path = os.path.join(chroma_path, "versions")
+        self.status_path = os.path.join(chroma_path, f"{alias}_reindex.json")
+
+    def read(self) -> dict:
+        data = _read_json(self.path)
+        data.setdefault("active", LEGACY_VERSION)
+        data.setdefault("previous", None)
+        return data
+
+    def active(self) -> str:
+        return self.read()["active"]
+
+    def version_path(self, version: str) -> str:
+        """
+        Diretório do banco de uma versão.
+        """
+        if version == LEGACY_VERSION:
+            return self.chroma_path
+        return os.path.join(self.versions_path, version)
+
+    def resolve(self) -> str:
+        """
+        Diretório do banco da versão ativa.
+        """
+        return self.version_path(self.active())
+
+    def new_version(self) -> str:
+        """
+        Nome livre para uma versão nova (data e hora, com sufixo se já
+        existir uma versão criada no mesmo segundo).
+        """
+        version = f"{self.alias}_{time.strftime('%Y%m%dT%H%M%S')}"
+        candidate, suffix = version, 1
+        while os.path.exists(self.version_path(candidate)):
+            suffix += 1
+            candidate = f"{version}_{suffix}"
+        return candidate
+
+    def swap(self, version: str) -> dict:
+        """
+        Aponta o alias para ``version``; a versão ativa vira a anterior.
+        """
+        data = self.read()
+        if version == data["active"]:
+            return data
+        data = {
+            "active": version,
+            "previous": data["active"],
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        _write_json(self.path, data)
+        return data
+
+    def rollback(self) -> dict:
+        """
+        Volta para a versão anterior (e a atual passa a ser a anterior).
+        """
+        data = self.read()
+        previous = data["previous"]
+        if not previous or not os.path.isdir(self.version_path(previous)):
+            raise ValueError("Não há versão anterior disponível para rollback.")
+        return self.swap(previous)
+
+    def prune(self):
+        """
+        Apaga as versões que não são a ativa nem a anterior.
+        """
+        data = self.read()
+        keep = {data["active"], data["previous"]}
+        if not os.path.isdir(self.versions_path):
+            return
+        for version in os.listdir(self.versions_path):
+            if version.startswith(f"{self.alias}_") and version not in keep:
+                shutil.rmtree(os.path.join(self.versions_path, version), ignore_errors=True)
+                logger.info(f"Versão antiga removida: {version}")
+
+    def status(self) -> dict:
+        """
+        Estado do último job de reindexação (ou {} se nunca houve um).
+        """
+        return _read_json(self.status_path)
+
+
+class ReindexJob:
+    """
+    Constrói, valida e ativa uma nova versão da coleção.
+
+    O progresso vai para o arquivo de status do alias, lido pelo servidor.
+
+    Args:
+        alias (CollectionAlias): Alias a atualizar.
+        data_path (str): Diretório dos documentos.
+        min_count_ratio (float): A versão nova precisa ter pelo menos essa
+            fração dos chunks da ativa.
+        smoke_query (str): Busca de teste; precisa retornar algum chunk.
+        processor_options (dict): Opções extras do ``DocumentProcessor``.
+        ingest_options (dict): Opções de ``process_and_ingest_documents``.
+        incremental (bool): A versão nova começa como cópia da ativa, e
+            ``ingest_options["delta"]`` (se houver) limita a ingestão aos
+            arquivos alterados. Sem versão ativa copiável (ex.: a versão
+            legada no próprio ``chroma_path``), a versão é construída do zero.
+    """
+
+    def __init__(self, alias: CollectionAlias, data_path: str, min_count_ratio: float = 0.5,
+                 smoke_query: str = "licitação", processor_options: dict = None,
+                 ingest_options: dict = None, incremental: bool = False):
+        self.alias = alias
+        self.data_path = data_path
+        self.min_count_ratio = min_count_ratio
+        self.smoke_query = smoke_query
+        self.processor_options = processor_options or {}
+        self.ingest_options = ingest_options or {}
+        self.incremental = incremental
+        self.version = alias.new_version()
+        self.state = {
+            "state": "starting",
+            "version": self.version,
+            "pid": os.getpid(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+
+    def _update(self, **fields):
+        self.state.update(fields)
+        _write_json(self.alias.status_path, self.state)
+
+    def _processor(self, chroma_path: str):
+        from document_processor import DocumentProcessor
+
+        # O cache de parsing fica fora das versões, compartilhado entre elas
+        options = {
+            "parse_cache_path": os.path.join(self.alias.chroma_path, "parse_cache.sqlite"),
+            **self.processor_options,
+        }
+        return DocumentProcessor(
+            data_path=self.data_path,
+            chroma_path=chroma_path,
+            collection_name=self.alias.alias,
+            **options,
+        )
+
+    def _incremental_base(self):
+        """
+        Diretório da versão ativa a copiar, ou None para construir do zero.
+        """
+        if not self.incremental:
+            return None
+        active = self.alias.active()
+        path = self.alias.version_path(active)
+        if active == LEGACY_VERSION or not os.path.isdir(path):
+            logger.info("Sem versão ativa para copiar; a versão nova é construída do zero.")
+            return None
+        return path
+
+    def validate(self, processor) -> dict:
+        """
+        Confere a versão nova antes da troca. Levanta RuntimeError se ela
+        estiver vazia, muito menor que a ativa ou sem resultado na busca de
+        teste.
+        """
+        count = processor.vector_store.count()
+        active_count = None
+        active_path = self.alias.resolve()
+        if os.path.isdir(active_path):
+            # Só o banco vetorial da versão ativa (com a função de embedding
+            # já carregada), fechado logo depois da contagem
+            active = None
+            try:
+                active = make_vector_base(
+                    processor.vector_backend, active_path, self.alias.alias,
+                    embedding_function=processor.embedding_function if processor.vector_backend == "chroma" else None,
+                    **processor.vector_options)
+                active_count = active.count()
+            except Exception:
+                logger.exception("Não foi possível contar a versão ativa")
+            finally:
+                if active is not None:
+                    active.close()
+        if not count:
+            raise RuntimeError("A versão nova está vazia.")
+        if active_count and count < active_count * self.min_count_ratio:
+            raise RuntimeError(
+                f"A versão nova tem {count} chunks, menos de {self.min_count_ratio:.0%} "
+                f"dos {active_count} da versão ativa.")
+        hits = processor.search(self.smoke_query, n_results=3)
+        validation = {"count": count, "active_count": active_count, "smoke_hits": len(hits)}
+        if not hits:
+            raise RuntimeError(f"A busca de teste {self.smoke_query!r} não retornou resultados.")
+        return validation
+
+    def run(self) -> dict:
+        """
+        Executa o job completo. Em caso de falha, a versão ativa não muda e a
+        versão nova é apagada.
+        """
+        path = self.alias.version_path(self.version)
+        os.makedirs(path, exist_ok=True)
+        self._update(state="building", path=path)
+        processor = None
+        try:
+            ingest_options = dict(self.ingest_options)
+            base = self._incremental_base()
+            delta = ingest_options.get("delta")
+            if base is not None:
+                # A ativa continua servindo intocada; só a cópia recebe o delta
+                shutil.copytree(base, path, dirs_exist_ok=True)
+                self._update(base=base)
+            else:
+                ingest_options.pop("delta", None)
+                delta = None
+            processor = self._processor(path)
+            total_files = (
+                len(delta["added"]) + len(delta["changed"]) if delta is not None
+                else len(list_data_files(self.data_path)))
+            summary = processor.process_and_ingest_documents(
+                progress=lambda stats: self._update(progress={**stats, "total_files": total_files}),
+                **ingest_options,
+            )
+            self._update(state="validating", progress={**summary, "total_files": total_files})
+            validation = self.validate(processor)
+            previous = self.alias.active()
+            self.alias.swap(self.version)
+            self.alias.prune()
+            self._update(
+                state="done", validation=validation, previous=previous,
+                finished_at=time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+            logger.info(f"Versão {self.version} ativada ({validation['count']} chunks).")
+        except Exception as e:
+            logger.exception("Reindexação falhou")
+            shutil.rmtree(path, ignore_errors=True)
+            self._update(
+                state="failed", error=str(e), traceback=traceback.format_exc(),
+                finished_at=time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+        finally:
+            if processor is not None:
+                processor.close()
+        return self.state
+
+
+def is_running(status: dict) -> bool:
+    """
+    Se o job descrito pelo status ainda está rodando.
+    """
+    if status.get("state") not in ("starting", "building", "validating"):
+        return False
+    try:
+        os.kill(status["pid"], 0)
+    except (KeyError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--chroma", default="chroma_db")
+    parser.add_argument("--alias", default="utfpr")
+    parser.add_argument("--rollback", action="store_true")
+    parser.add_argument("--delta", default=None,
+                        help="JSON com os arquivos added/changed/deleted: reindexação incremental")
+    parser.add_argument("--vector-backend", default="chroma")
+    parser.add_argument("--embedding-backend", default="torch")
+    parser.add_argument("--embedding-service", default=None, help="Socket do serviço de embedding")
+    parser.add_argument("--workers", type=int, default=None, help="Processos de parsing")
+    parser.add_argument("--chunker", default="legal", choices=("legal", "recursive"))
+    parser.add_argument("--lazy-load", action="store_true",
+                        help="Carrega os arquivos página a página (PDFs enormes)")
+    parser.add_argument("--memory-limit", type=float, default=None, help="Teto de RSS da ingestão, em MB")
+    parser.add_argument("--min-count-ratio", type=float, default=0.5)
+    parser.add_argument("--smoke-query", default="licitação")
+    parser.add_argument("--nice", type=int, default=10,
+                        help="Prioridade mais baixa para não disputar CPU com as consultas")
+    args = parser.parse_args()
+
+    alias = CollectionAlias(args.chroma, args.alias)
+    if args.rollback:
+        print(json.dumps(alias.rollback(), ensure_ascii=False))
+        return
+
+    if is_running(alias.status()):
+        sys.exit("Já existe uma reindexação em andamento.")
+    if args.nice and hasattr(os, "nice"):
+        os.nice(args.nice)
+
+    ingest_options = {
+        "max_workers": args.workers,
+        "chunker": args.chunker,
+        "lazy_load": args.lazy_load,
+        "memory_limit_mb": args.memory_limit,
+    }
+    if args.delta:
+        with open(args.delta, "r", encoding="utf-8") as f:
+            ingest_options["delta"] = json.load(f)
+
+    job = ReindexJob(
+        alias,
+        args.data,
+        min_count_ratio=args.min_count_ratio,
+        smoke_query=args.smoke_query,
+        incremental=bool(args.delta),
+        processor_options={
+            "vector_backend": args.vector_backend,
+            "embedding_backend": args.embedding_backend,
+            "embedding_service": args.embedding_service,
+        },
+        ingest_options=ingest_options,
+    )
+    state = job.run()
+    sys.exit(0 if state["state"] == "done" else 1)
+
+
+if __name__ == "__main__":
+    main()
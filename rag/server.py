@@ -1,40 +1,556 @@
-from dotenv import load_dotenv
-from flask import Flask, request, Response, jsonify  # Adicionado Response
-from flask_cors import CORS
-import google.generativeai as genai
+"""
+Servidor ASGI do chat.
+
+Desenvolvimento:  python server.py
+Produção:         hypercorn server:app --bind 0.0.0.0:5000
+
+Vários workers compartilhando as páginas do modelo de embedding (carregado
+antes do fork):
+    RAG_PRELOAD=1 gunicorn -k uvicorn.workers.UvicornWorker --preload -w 4 server:app
+
+Ou um único modelo num processo à parte, com os pedidos dos workers
+agrupados em micro-lotes:
+    python embedding_service.py --socket /tmp/rag-embedding.sock &
+    EMBEDDING_SERVICE_SOCKET=/tmp/rag-embedding.sock gunicorn -k uvicorn.workers.UvicornWorker -w 4 server:app
+"""
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import hmac
+import json
 import os
+import subprocess
+import sys
+import threading
+
+from dotenv import load_dotenv
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+
+from conversation import ConversationStore
+from document_processor import DocumentProcessor
+from llm import GeminiClient, LLMBusyError
+from logger import get_logger
+from metrics import REQUESTS, export, record, server_timing, start_request
+from reindex import CollectionAlias, is_running
+from vector_database import validate_where
+
+logger = get_logger("server")
 
 
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
-# Em app.py
-import traceback 
-from document_processor import DocumentProcessor
+app = cors(Quart(__name__), allow_origin="*")
+
 DATA_DIR = "data"
 CHROMA_DIR = "chroma_db"
 COLLECTION_NAME = "utfpr"
-processor = DocumentProcessor(
+
+# Limites do LLM: gerações simultâneas, fila de espera e tempo máximo na fila
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+
+# Limites do /chat/batch: perguntas por requisição e gerações simultâneas
+# de um mesmo lote
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "100"))
+
+# Runtime do modelo de embedding: torch, onnx ou onnx-int8
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) or None
+# Socket do serviço de embedding compartilhado (embedding_service.py); se
+# definido, os workers não carregam o modelo
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET") or None
+
+# Banco vetorial: chroma, mmap (float16 compartilhado entre workers),
+# faiss-flat, faiss-ivf ou faiss-hnsw
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+
+# Cabeçalho Server-Timing em todas as respostas do /chat; sem isso, só quando
+# o cliente pede com "X-Timing: 1"
+SERVER_TIMING = os.getenv("SERVER_TIMING") == "1"
+
+# Reindexação: token exigido nas rotas /admin (sem ele, as rotas ficam
+# desativadas), intervalo entre verificações do alias e tempo até fechar o
+# processador da versão antiga
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+ALIAS_CHECK_INTERVAL = float(os.getenv("ALIAS_CHECK_INTERVAL", "1"))
+VERSION_GRACE_SECONDS = float(os.getenv("VERSION_GRACE_SECONDS", "60"))
+
+# Memória das conversas do /chat (SQLite compartilhado entre os workers):
+# sessões guardadas, tempo sem uso até expirar, tokens das trocas recentes e
+# do resumo no prompt, e reescrita da pergunta para a busca (none, history
+# ou llm)
+CONVERSATION_DB = os.getenv("CONVERSATION_DB", os.path.join(CHROMA_DIR, "conversations.sqlite"))
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "86400"))
+CONVERSATION_TURN_TOKENS = int(os.getenv("CONVERSATION_TURN_TOKENS", "600"))
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "250"))
+CHAT_QUERY_REWRITE = os.getenv("CHAT_QUERY_REWRITE", "history")
+SESSION_ID_MAX_LENGTH = 128
+
+# Pedidos iguais e simultâneos do /chat (mesma pergunta, sem histórico)
+# compartilham uma única busca e geração
+CHAT_COALESCE = os.getenv("CHAT_COALESCE", "1") == "1"
+
+llm = GeminiClient(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    max_queue=LLM_MAX_QUEUE,
+    queue_timeout=LLM_QUEUE_TIMEOUT,
+)
+alias = CollectionAlias(CHROMA_DIR, COLLECTION_NAME)
+conversations = ConversationStore(
+    CONVERSATION_DB,
+    max_sessions=CONVERSATION_MAX_SESSIONS,
+    ttl=CONVERSATION_TTL,
+    turn_token_budget=CONVERSATION_TURN_TOKENS,
+    summary_token_budget=CONVERSATION_SUMMARY_TOKENS,
+)
+
+
+def make_processor(chroma_path: str, embedding_function=None) -> DocumentProcessor:
+    return DocumentProcessor(
         data_path=DATA_DIR,
-        chroma_path=CHROMA_DIR,
-        collection_name=COLLECTION_NAME
+        chroma_path=chroma_path,
+        collection_name=COLLECTION_NAME,
+        llm=llm,
+        retrieval_workers=RETRIEVAL_WORKERS,
+        embedding_backend=EMBEDDING_BACKEND,
+        embedding_threads=EMBEDDING_THREADS,
+        vector_backend=VECTOR_BACKEND,
+        embedding_service=EMBEDDING_SERVICE_SOCKET,
+        embedding_function=embedding_function,
+        conversations=conversations,
+        query_rewrite=CHAT_QUERY_REWRITE,
+        coalesce=CHAT_COALESCE,
     )
+
+
+VERSION = {"active": alias.active(), "switching": None, "checked_at": 0.0}
+processor = make_processor(alias.resolve())
+# Job de reindexação iniciado por este worker (para recolher o processo)
+REINDEX = {"process": None}
+
+# Com RAG_PRELOAD=1 o modelo de embedding é carregado já na importação, para
+# que os workers criados por fork compartilhem as páginas (copy-on-write).
+# O ChromaDB e o embedding de teste ficam para cada worker, depois do fork.
+if os.getenv("RAG_PRELOAD") == "1":
+    processor.embedding_function
+
+STARTUP = {
+    "status": "cold",
+    "import_seconds": round(time.perf_counter() - IMPORT_STARTED, 3),
+    "warm_up_seconds": None,
+    "error": None,
+}
+
+
+def warm_up():
+    """
+    Aquece o processador em segundo plano enquanto o /health responde
+    "warming".
+    """
+    STARTUP["status"] = "warming"
+    started = time.perf_counter()
+    try:
+        processor.warm_up()
+        STARTUP["status"] = "ready"
+    except Exception as e:
+        logger.exception("Falha no aquecimento")
+        STARTUP["status"] = "error"
+        STARTUP["error"] = str(e)
+    STARTUP["warm_up_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Aquecimento: {STARTUP['status']} em {STARTUP['warm_up_seconds']}s {processor.timings}")
+
+
+def switch_version(version: str):
+    """
+    Carrega e aquece o processador da nova versão da coleção e só então o
+    coloca no lugar do atual. As consultas em andamento terminam no
+    processador antigo, que é fechado depois de ``VERSION_GRACE_SECONDS``.
+    """
+    global processor
+    started = time.perf_counter()
+    try:
+        new_processor = make_processor(alias.version_path(version), processor.embedding_function)
+        new_processor.warm_up()
+    except Exception:
+        # Fica em "switching" para não tentar de novo a cada consulta
+        logger.exception(f"Falha ao carregar a versão {version} da coleção")
+        return
+    old_processor, processor = processor, new_processor
+    VERSION["active"] = version
+    VERSION["switching"] = None
+    closer = threading.Timer(VERSION_GRACE_SECONDS, old_processor.close)
+    closer.daemon = True
+    closer.start()
+    logger.info(f"Coleção trocada para a versão {version} em {time.perf_counter() - started:.1f}s.")
+
+
+def current_processor() -> DocumentProcessor:
+    """
+    Processador da versão ativa. Confere o alias no máximo a cada
+    ``ALIAS_CHECK_INTERVAL`` segundos; se ele mudou (reindexação ou rollback,
+    possivelmente feitos por outro worker), a troca é preparada em segundo
+    plano e a consulta segue na versão atual.
+    """
+    now = time.monotonic()
+    if now - VERSION["checked_at"] >= ALIAS_CHECK_INTERVAL:
+        VERSION["checked_at"] = now
+        version = alias.active()
+        if version != VERSION["active"] and version != VERSION["switching"]:
+            VERSION["switching"] = version
+            threading.Thread(target=switch_version, args=(version,), name="switch-version", daemon=True).start()
+    return processor
+
+
+@app.before_serving
+async def start_warm_up():
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def sse_event(event: str, data) -> str:
+    """
+    Formata um evento Server-Sent Events.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def busy_response(error: LLMBusyError):
+    """
+    Resposta 429/503 quando o LLM está saturado.
+    """
+    response = jsonify({"error": str(error)})
+    response.status_code = error.status_code
+    response.headers["Retry-After"] = "5"
+    return response
+
+
+@app.after_request
+async def count_request(response):
+    rule = request.url_rule.rule if request.url_rule else "desconhecida"
+    REQUESTS.labels(rule, str(response.status_code)).inc()
+    return response
+
+
 @app.route('/chat', methods=['POST'])
-def chat_stream():
-    data = request.get_json()
-    user_message = data.get('message')
+async def chat_stream():
+    started = time.perf_counter()
+    timings = start_request()
+    data = await request.get_json()
+    user_message = (data or {}).get('message')
 
     if not user_message:
         return jsonify({"error": "Nenhuma mensagem recebida."}), 400
 
-    print(f"Mensagem recebida para streaming: {user_message}")
-    # Retorna uma Resposta de streaming. text/plain é simples, mas você pode usar text/event-stream para SSE.
-    # Para text/plain, o cliente precisa saber como lidar com os chunks.
-    
-   
-    return  processor.query_async(user_message)
+    # Memória da conversa só quando o cliente manda um session_id (gerado
+    # por ele); sem isso a pergunta é respondida isoladamente
+    session_id = (data or {}).get('session_id') or None
+    if session_id is not None and (not isinstance(session_id, str) or len(session_id) > SESSION_ID_MAX_LENGTH):
+        return jsonify({"error": f"'session_id' deve ser um texto de até {SESSION_ID_MAX_LENGTH} caracteres."}), 400
+
+    logger.debug(f"Mensagem recebida para streaming (sessão {session_id}): {user_message}")
+
+    # O primeiro evento (metadados) só sai depois da busca e de conseguir
+    # vaga no LLM; assim a recusa por sobrecarga ainda vira um 429/503.
+    events = current_processor().astream_answer(user_message, session_id=session_id)
+    try:
+        event, payload = await events.__anext__()
+    except LLMBusyError as e:
+        await events.aclose()
+        return busy_response(e)
+    first_event = (
+        (event, {**payload, "session_id": session_id}) if event == "metadata" and session_id else (event, payload))
+
+    async def generate():
+        # Quando o cliente desconecta, o Quart cancela este gerador
+        # (CancelledError), o que fecha astream_answer e cancela o Gemini.
+        try:
+            yield sse_event(*first_event)
+            async for event, payload in events:
+                if event == "token":
+                    payload = {"text": payload}
+                yield sse_event(event, payload)
+            record("total", time.perf_counter() - started)
+            # Os tempos completos só existem no fim; o cabeçalho leva os
+            # anteriores ao primeiro evento
+            yield sse_event("done", {"timings": {
+                stage: round(duration, 1) for stage, duration in timings.items()}})
+        except asyncio.CancelledError:
+            logger.info("Cliente desconectado; geração cancelada.")
+            raise
+        except Exception as e:
+            logger.exception("Erro na geração da resposta")
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            await events.aclose()
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Evita que proxies (nginx) acumulem a resposta antes de enviar.
+            "X-Accel-Buffering": "no",
+        },
+    )
+    if SERVER_TIMING or request.headers.get("X-Timing") == "1":
+        response.headers["Server-Timing"] = server_timing(timings)
+    # Gerações longas não devem ser cortadas pelo timeout padrão do Quart
+    response.timeout = None
+    return response
+
+
+@app.route('/chat/session/<session_id>', methods=['DELETE'])
+async def forget_session(session_id):
+    """
+    Apaga a memória de uma conversa.
+    """
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, conversations.delete, session_id):
+        return jsonify({"error": "Sessão não encontrada."}), 404
+    return jsonify({"deleted": session_id})
+
+
+@app.route('/chat/batch', methods=['POST'])
+async def chat_batch():
+    """
+    Responde várias perguntas numa requisição. A resposta é NDJSON: uma
+    linha por pergunta, na ordem em que ficam prontas (use ``index`` para
+    reordenar).
+    """
+    data = await request.get_json() or {}
+    questions = data.get("questions")
+    if not isinstance(questions, list) or not questions or not all(
+            isinstance(question, str) and question.strip() for question in questions):
+        return jsonify({"error": "Envie 'questions' como uma lista de perguntas."}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"No máximo {BATCH_MAX_QUESTIONS} perguntas por lote."}), 413
+
+    try:
+        n_results, where = search_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        max_concurrency = int(data.get("max_concurrency", BATCH_MAX_CONCURRENCY))
+    except (TypeError, ValueError):
+        max_concurrency = 0
+    if max_concurrency < 1:
+        return jsonify({"error": "'max_concurrency' deve ser um número inteiro maior que zero."}), 400
+    max_concurrency = min(max_concurrency, BATCH_MAX_CONCURRENCY)
+    logger.debug(f"Lote recebido: {len(questions)} perguntas")
+
+    async def generate():
+        answers = current_processor().answer_batch(questions, n_results, max_concurrency, where)
+        try:
+            async for item in answers:
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        except asyncio.CancelledError:
+            logger.info("Cliente desconectado; lote cancelado.")
+            raise
+        except Exception as e:
+            logger.exception("Erro no lote")
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            await answers.aclose()
+
+    response = Response(
+        generate(),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.timeout = None
+    return response
+
+
+def search_params(data: dict) -> tuple:
+    """
+    Lê ``n_results`` e ``where`` de uma requisição de busca. Levanta
+    ValueError se forem inválidos.
+    """
+    try:
+        n_results = int(data.get("n_results", 6))
+    except (TypeError, ValueError):
+        raise ValueError("'n_results' deve ser um número inteiro.")
+    if not 1 <= n_results <= SEARCH_MAX_RESULTS:
+        raise ValueError(f"'n_results' deve estar entre 1 e {SEARCH_MAX_RESULTS}.")
+    where = data.get("where") or None
+    if where is not None:
+        validate_where(where)
+    return n_results, where
+
+
+@app.route('/search', methods=['POST'])
+async def search():
+    """
+    Busca sem geração: devolve os chunks mais relevantes com fonte, página,
+    distância (vetorial) e pontuação (fusão híbrida).
+    """
+    started = time.perf_counter()
+    data = await request.get_json() or {}
+    query = data.get("query")
+    if not isinstance(query, str) or not query.strip():
+        return jsonify({"error": "Envie 'query' com o texto da busca."}), 400
+    try:
+        n_results, where = search_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    hits = await current_processor().asearch(query, n_results, where)
+    took = time.perf_counter() - started
+    record("search", took)
+    return jsonify({"results": hits, "took_ms": round(took * 1000, 2)})
+
+
+@app.route('/search/batch', methods=['POST'])
+async def search_batch():
+    """
+    Várias buscas numa requisição (uma única passada de embedding e de
+    busca vetorial).
+    """
+    started = time.perf_counter()
+    data = await request.get_json() or {}
+    queries = data.get("queries")
+    if not isinstance(queries, list) or not queries or not all(
+            isinstance(query, str) and query.strip() for query in queries):
+        return jsonify({"error": "Envie 'queries' como uma lista de buscas."}), 400
+    if len(queries) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"No máximo {BATCH_MAX_QUESTIONS} buscas por lote."}), 413
+    try:
+        n_results, where = search_params(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results = await current_processor().asearch_batch(queries, n_results, where)
+    took = time.perf_counter() - started
+    return jsonify({
+        "results": results,
+        "took_ms": round(took * 1000, 2),
+    })
+
+
+@app.route('/health', methods=['GET'])
+async def health():
+    body = {**STARTUP, "components": current_processor().timings, "collection_version": VERSION["active"]}
+    return jsonify(body), 200 if STARTUP["status"] == "ready" else 503
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    body, content_type = export()
+    return Response(body, content_type=content_type)
+
+
+@app.route('/cache/stats', methods=['GET'])
+async def cache_stats():
+    return jsonify(current_processor().cache_stats())
+
+
+@app.route('/chat/stats', methods=['GET'])
+async def chat_stats():
+    return jsonify(current_processor().coalesce_stats())
+
+
+@app.route('/conversations/stats', methods=['GET'])
+async def conversation_stats():
+    loop = asyncio.get_running_loop()
+    return jsonify(await loop.run_in_executor(None, conversations.stats))
+
+
+@app.route('/embedding/stats', methods=['GET'])
+async def embedding_stats():
+    if not EMBEDDING_SERVICE_SOCKET:
+        return jsonify({"error": "Serviço de embedding não configurado."}), 404
+    loop = asyncio.get_running_loop()
+    return jsonify(await loop.run_in_executor(None, processor.embedding_function.stats))
+
+
+@app.route('/llm/stats', methods=['GET'])
+async def llm_stats():
+    return jsonify(llm.limiter.stats())
+
+
+def admin_denied():
+    """
+    Resposta de erro para as rotas /admin, ou None se o pedido traz o token.
+
+    Sem ``ADMIN_TOKEN`` configurado as rotas ficam recusadas (403): o
+    servidor escuta em 0.0.0.0 com CORS liberado, então qualquer cliente,
+    inclusive uma página aberta no navegador, poderia disparar reindexações
+    ou trocar a versão ativa.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Rotas de administração desativadas: defina ADMIN_TOKEN."}), 403
+    authorization = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        return jsonify({"error": "Não autorizado."}), 401
+    return None
+
+
+def reindex_running() -> bool:
+    process = REINDEX["process"]
+    if process is not None:
+        if process.poll() is None:
+            return True
+        REINDEX["process"] = None
+    return is_running(alias.status())
+
+
+@app.route('/admin/reindex', methods=['POST'])
+async def start_reindex():
+    """
+    Dispara a reindexação num processo à parte, com prioridade mais baixa,
+    que constrói e valida uma nova versão da coleção e troca o alias. O
+    progresso fica em GET /admin/reindex.
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    if reindex_running():
+        return jsonify({"error": "Já existe uma reindexação em andamento.", **alias.status()}), 409
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "reindex.py"),
+        "--data", DATA_DIR,
+        "--chroma", CHROMA_DIR,
+        "--alias", COLLECTION_NAME,
+        "--vector-backend", VECTOR_BACKEND,
+        "--embedding-backend", EMBEDDING_BACKEND,
+    ]
+    if EMBEDDING_SERVICE_SOCKET:
+        command += ["--embedding-service", EMBEDDING_SERVICE_SOCKET]
+    REINDEX["process"] = subprocess.Popen(command, start_new_session=True)
+    return jsonify({"status": "started", "pid": REINDEX["process"].pid}), 202
+
+
+@app.route('/admin/reindex', methods=['GET'])
+async def reindex_status():
+    denied = admin_denied()
+    if denied:
+        return denied
+    return jsonify({
+        "running": reindex_running(),
+        "job": alias.status(),
+        "alias": alias.read(),
+        "serving": VERSION["active"],
+    })
+
+
+@app.route('/admin/rollback', methods=['POST'])
+async def rollback():
+    denied = admin_denied()
+    if denied:
+        return denied
+    try:
+        data = alias.rollback()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify(data)
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,145 @@
+"""
+Coalescência (single-flight) de pedidos iguais em andamento.
+
+O primeiro pedido com uma chave (o líder) inicia a produção dos eventos
+numa task própria; os pedidos iguais que chegam enquanto ela roda assinam o
+mesmo ``Broadcast`` e recebem os eventos já produzidos (replay) seguidos dos
+próximos. A produção continua se o líder desconectar e é cancelada quando o
+último assinante sai.
+"""
+import asyncio
+
+
+class Broadcast:
+    """
+    Eventos de um produtor repassados a vários assinantes. Todos os eventos
+    ficam guardados até o fim, então quem assina tarde recebe tudo desde o
+    começo.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_idle = None
+
+    def publish(self, event):
+        self.events.append(event)
+        self._wake()
+
+    def finish(self, error: BaseException = None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def subscribe(self):
+        """
+        Novo assinante (contado já aqui, antes do primeiro evento).
+
+        Retorna:
+            async generator: Os eventos, do primeiro ao último; se o
+            produtor falhou, levanta o mesmo erro depois dos eventos que ele
+            chegou a produzir.
+        """
+        self.subscribers += 1
+        return self._events()
+
+    async def _events(self):
+        index = 0
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and not self.done and self._on_idle is not None:
+                self._on_idle()
+
+
+class SingleFlight:
+    """
+    Agrupa pedidos iguais em andamento, por chave.
+
+    Contadores: ``leaders`` (pedidos que produziram os eventos) e
+    ``followers`` (pedidos que receberam os eventos de outro).
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._flights = {}
+
+    def join(self, key, produce) -> tuple:
+        """
+        Assina o pedido em andamento com a chave ou inicia um novo.
+
+        Args:
+            key: Chave do pedido (hashable).
+            produce: Função sem argumentos que retorna o async generator
+                de eventos; só é chamada pelo líder.
+
+        Retorna:
+            tuple: (async generator com os eventos, se este pedido é o líder).
+        """
+        broadcast = self._flights.get(key)
+        leader = broadcast is None
+        if leader:
+            broadcast = Broadcast()
+            self._flights[key] = broadcast
+            task = asyncio.ensure_future(self._run(key, broadcast, produce))
+
+            def cancel():
+                # Ninguém mais espera: libera a chave já (um pedido novo não
+                # pode assinar uma produção sendo cancelada) e para o LLM
+                if self._flights.get(key) is broadcast:
+                    del self._flights[key]
+                task.cancel()
+
+            broadcast._on_idle = cancel
+            self.leaders += 1
+        else:
+            self.followers += 1
+        return broadcast.subscribe(), leader
+
+    async def _run(self, key, broadcast: Broadcast, produce):
+        events = produce()
+        try:
+            async for event in events:
+                broadcast.publish(event)
+            broadcast.finish()
+        except asyncio.CancelledError:
+            broadcast.finish(asyncio.CancelledError())
+            raise
+        except Exception as e:
+            broadcast.finish(e)
+        finally:
+            await events.aclose()
+            if self._flights.get(key) is broadcast:
+                del self._flights[key]
+
+    def stats(self) -> dict:
+        """
+        Pedidos líderes e seguidores e a razão de coalescência (fração dos
+        pedidos que não geraram a própria resposta).
+        """
+        total = self.leaders + self.followers
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalescing_ratio": round(self.followers / total, 4) if total else 0.0,
+            "in_flight": len(self._flights),
+            "subscribers": sum(broadcast.subscribers for broadcast in self._flights.values()),
+        }
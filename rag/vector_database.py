@@ -0,0 +1,844 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from cache import LRUCache
+
+
+class VectorBase:
+    """
+    Interface dos bancos vetoriais usados pelo ``DocumentProcessor``.
+
+    Todas as implementações guardam, para cada chunk, o embedding, o texto e
+    os metadados, e devolvem resultados no mesmo formato do ChromaDB (listas
+    de listas com ``ids``, ``documents``, ``metadatas`` e ``distances``,
+    distância L2 ao quadrado). Filtros ``where`` seguem a sintaxe do ChromaDB.
+
+    ``TRADEOFF`` descreve o compromisso recall/latência de cada backend.
+    """
+
+    name = "base"
+    TRADEOFF = {}
+
+    def create_db(self):
+        """
+        Cria ou abre o armazenamento do backend.
+        """
+        raise NotImplementedError
+
+    def upsert(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        """
+        Insere ou substitui chunks.
+        """
+        raise NotImplementedError
+
+    def delete(self, ids: list):
+        """
+        Remove chunks pelo ID.
+        """
+        raise NotImplementedError
+
+    def update_metadata(self, ids: list, metadatas: list):
+        """
+        Substitui os metadados de chunks existentes, sem tocar nos embeddings.
+        """
+        raise NotImplementedError
+
+    def get(self, ids: list = None, where: dict = None, include: tuple = ("documents", "metadatas"),
+            limit: int = None, offset: int = 0) -> dict:
+        """
+        Lê chunks por ID e/ou filtro. ``include`` pode conter "documents",
+        "metadatas" e "embeddings".
+        """
+        raise NotImplementedError
+
+    def search(self, query_embeddings: list, n_results: int = 6, where: dict = None) -> dict:
+        """
+        Busca os ``n_results`` chunks mais próximos de cada embedding.
+        """
+        raise NotImplementedError
+
+    def count(self) -> int:
+        """
+        Número de chunks armazenados.
+        """
+        raise NotImplementedError
+
+    def persist(self):
+        """
+        Grava em disco o que estiver só em memória (ex.: índice FAISS).
+        """
+
+    def close(self):
+        """
+        Libera conexões e mapeamentos; o objeto não deve mais ser usado.
+        """
+
+    def max_batch_size(self) -> int:
+        """
+        Maior lote aceito por ``upsert``.
+        """
+        return 5000
+
+    @classmethod
+    def describe(cls) -> dict:
+        return {"backend": cls.name, **cls.TRADEOFF}
+
+
+class ChromaVectorBase(VectorBase):
+    """
+    Adaptador para uma coleção do ChromaDB (backend padrão, compatível com as
+    coleções já existentes).
+    """
+
+    name = "chroma"
+    TRADEOFF = {
+        "recall": "aproximado (HNSW), normalmente > 0.95",
+        "latency": "baixa; índice em memória de cada processo",
+        "memory": "índice HNSW carregado por processo, sem compartilhamento",
+    }
+
+    def __init__(self, path: str, collection_name: str, embedding_function=None):
+        self.path = path
+        self.collection_name = collection_name
+        self.embedding_function = embedding_function
+        self.client = None
+        self.collection = None
+
+    def create_db(self):
+        import chromadb
+
+        self.client = chromadb.PersistentClient(path=self.path)
+        self.collection = self.client.get_or_create_collection(
+            name=self.collection_name,
+            embedding_function=self.embedding_function
+        )
+        return self
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(
+            ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids):
+        self.collection.delete(ids=ids)
+
+    def update_metadata(self, ids, metadatas):
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=0):
+        result = self.collection.get(
+            ids=ids, where=where, include=list(include), limit=limit, offset=offset or None)
+        keys = ("ids", *include)
+        if ids is None:
+            return {key: result.get(key) for key in keys}
+        # O ChromaDB não garante a ordem dos IDs pedidos; os outros backends sim
+        position = {chunk_id: index for index, chunk_id in enumerate(result["ids"])}
+        order = [position[chunk_id] for chunk_id in dict.fromkeys(ids) if chunk_id in position]
+        return {key: [result[key][index] for index in order] for key in keys}
+
+    def search(self, query_embeddings, n_results=6, where=None):
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+        )
+
+    def count(self):
+        return self.collection.count()
+
+    def max_batch_size(self):
+        return self.client.get_max_batch_size()
+
+    def close(self):
+        # Clientes do mesmo caminho compartilham o sistema do ChromaDB no
+        # processo (client.close() derrubaria os outros); abrir de novo não
+        # cria conexões novas, então basta soltar as referências
+        self.collection = None
+        self.client = None
+
+
+# Chaves de metadados aceitas em filtros (vão para dentro do SQL)
+_KEY_PATTERN = re.compile(r"^\w+$")
+_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+# Metadados com índice no SQLite; filtros por eles não varrem a tabela
+INDEXED_FIELDS = ("source", "file_type", "page", "article")
+
+
+def validate_where(where: dict, fields: tuple = INDEXED_FIELDS):
+    """
+    Confere se um filtro ``where`` (sintaxe do ChromaDB) só usa os campos e
+    operadores suportados. Levanta ValueError com a explicação.
+    """
+    if not isinstance(where, dict) or not where:
+        raise ValueError("O filtro deve ser um objeto não vazio.")
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or len(condition) < 2:
+                raise ValueError(f"'{key}' espera uma lista com pelo menos dois filtros.")
+            for part in condition:
+                validate_where(part, fields)
+            continue
+        if key not in fields:
+            raise ValueError(f"Campo de filtro não suportado: {key!r}. Use um de {fields}.")
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator in ("$in", "$nin"):
+                if not isinstance(value, list) or not value:
+                    raise ValueError(f"'{operator}' espera uma lista não vazia.")
+            elif operator not in _OPERATORS:
+                raise ValueError(f"Operador de filtro não suportado: {operator}")
+            elif isinstance(value, (dict, list)):
+                raise ValueError(f"Valor inválido para {key!r}: {value!r}")
+
+
+def where_to_sql(where: dict) -> tuple:
+    """
+    Traduz um filtro ``where`` do ChromaDB para SQL sobre a coluna JSON de
+    metadados.
+
+    Retorna:
+        tuple: (cláusula SQL, parâmetros).
+    """
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(part) for part in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            for _, part_params in parts:
+                params.extend(part_params)
+            continue
+        if not _KEY_PATTERN.match(key):
+            raise ValueError(f"Chave de metadado inválida no filtro: {key!r}")
+        column = f"json_extract(metadata, '$.{key}')"
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, value in condition.items():
+            if operator in ("$in", "$nin"):
+                placeholders = ", ".join("?" for _ in value)
+                negation = "NOT " if operator == "$nin" else ""
+                clauses.append(f"{column} {negation}IN ({placeholders})")
+                params.extend(value)
+            elif operator in _OPERATORS:
+                clauses.append(f"{column} {_OPERATORS[operator]} ?")
+                params.append(value)
+            else:
+                raise ValueError(f"Operador de filtro não suportado: {operator}")
+    return " AND ".join(clauses) or "1", params
+
+
+class MetadataStore:
+    """
+    Textos e metadados dos chunks em SQLite, com o número da linha de cada
+    chunk na matriz de vetores. Compartilhado pelos backends locais.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Índices de expressão: o SQLite os usa quando o filtro gerado por
+        # where_to_sql tem exatamente a mesma expressão
+        for field in INDEXED_FIELDS:
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS chunks_{field} "
+                f"ON chunks (json_extract(metadata, '$.{field}'))")
+        self._lock = threading.RLock()
+
+    def meta(self, key: str, default=None):
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key: str, value):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def generation(self) -> int:
+        """
+        Contador incrementado a cada escrita; leitores o usam para saber se
+        precisam recarregar estruturas em memória.
+        """
+        return self.meta("generation", 0)
+
+    def upsert(self, ids: list, documents: list, metadatas: list, before_commit=None) -> list:
+        """
+        Grava os chunks e retorna a linha de cada um. IDs existentes mantêm a
+        linha; novos recebem linhas no fim da matriz.
+
+        ``before_commit(rows)`` roda dentro da transação: os vetores são
+        gravados antes de os leitores enxergarem as novas linhas.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                existing = dict(self._rows_by_id(ids))
+                next_row = self.meta("next_row", 0)
+                rows = []
+                for chunk_id in ids:
+                    if chunk_id not in existing:
+                        existing[chunk_id] = next_row
+                        next_row += 1
+                    rows.append(existing[chunk_id])
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO chunks (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                    [
+                        (row, chunk_id, document, json.dumps(metadata or {}, ensure_ascii=False))
+                        for row, chunk_id, document, metadata in zip(rows, ids, documents, metadatas)
+                    ],
+                )
+                if before_commit is not None:
+                    before_commit(rows)
+                self.set_meta("next_row", next_row)
+                self.set_meta("generation", self.generation() + 1)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return rows
+
+    def delete(self, ids: list):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+                self.set_meta("generation", self.generation() + 1)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def update_metadata(self, ids: list, metadatas: list):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "UPDATE chunks SET metadata = ? WHERE id = ?",
+                    [(json.dumps(metadata or {}, ensure_ascii=False), chunk_id)
+                     for chunk_id, metadata in zip(ids, metadatas)])
+                self.set_meta("generation", self.generation() + 1)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _rows_by_id(self, ids: list) -> list:
+        found = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            found.extend(self._connection.execute(
+                f"SELECT id, row FROM chunks WHERE id IN ({placeholders})", batch).fetchall())
+        return found
+
+    def select(self, ids: list = None, where: dict = None, rows=None, limit: int = None,
+               offset: int = 0) -> list:
+        """
+        Retorna tuplas (row, id, document, metadata) na ordem pedida (ids ou
+        rows) ou na ordem de inserção.
+        """
+        clauses, params = [], []
+        if where:
+            sql, where_params = where_to_sql(where)
+            clauses.append(sql)
+            params.extend(where_params)
+        query = "SELECT row, id, document, metadata FROM chunks"
+        keys = ids if ids is not None else rows
+        if keys is not None:
+            if not len(keys):
+                return []
+            column = "id" if ids is not None else "row"
+            results = {}
+            keys = [key if isinstance(key, str) else int(key) for key in keys]
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                batch_clauses = clauses + [f"{column} IN ({placeholders})"]
+                with self._lock:
+                    records = self._connection.execute(
+                        f"{query} WHERE {' AND '.join(batch_clauses)}", params + batch).fetchall()
+                for record in records:
+                    results[record[1] if ids is not None else record[0]] = record
+            return [results[key] for key in keys if key in results]
+        if clauses:
+            query += f" WHERE {' AND '.join(clauses)}"
+        query += " ORDER BY row"
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def rows(self, where: dict = None) -> np.ndarray:
+        """
+        Linhas dos chunks existentes (opcionalmente filtrados), em ordem
+        crescente.
+        """
+        query, params = "SELECT row FROM chunks", []
+        if where:
+            sql, params = where_to_sql(where)
+            query += f" WHERE {sql}"
+        # Sem ORDER BY, o SQLite pode responder pelos índices de expressão
+        # (ordem dos valores, não das linhas), e _distances conta com linhas
+        # crescentes para fatiar a matriz
+        query += " ORDER BY row"
+        with self._lock:
+            found = self._connection.execute(query, params).fetchall()
+        return np.fromiter((row for (row,) in found), dtype=np.int64, count=len(found))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class MmapVectorBase(VectorBase):
+    """
+    Matriz float16 num arquivo mapeado em memória, com busca exata (força
+    bruta em blocos).
+
+    Vários processos do servidor abrem o mesmo arquivo somente leitura e
+    compartilham as páginas do cache do sistema operacional, sem cópia. Linhas
+    removidas ficam órfãs no arquivo até ``compact()``.
+    """
+
+    name = "mmap"
+    TRADEOFF = {
+        "recall": "exato (1.0), a menos da precisão float16",
+        "latency": "linear no número de chunks; ~ms por 100 mil chunks de 384 dimensões",
+        "memory": "2 bytes por dimensão, compartilhada entre processos via mmap",
+    }
+
+    BLOCK_ROWS = 65536
+
+    def __init__(self, path: str, collection_name: str):
+        self.directory = os.path.join(path, f"{collection_name}.{self.name}")
+        self.vectors_path = os.path.join(self.directory, "vectors.f16")
+        self.store = None
+        self._matrix = None
+        self._live_rows = None
+        self._generation = None
+        self._filter_cache = LRUCache(maxsize=256)
+        self._lock = threading.RLock()
+
+    def create_db(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.store = MetadataStore(os.path.join(self.directory, "metadata.sqlite"))
+        return self
+
+    @property
+    def dimension(self):
+        return self.store.meta("dimension")
+
+    def _capacity(self) -> int:
+        if not os.path.exists(self.vectors_path) or not self.dimension:
+            return 0
+        return os.path.getsize(self.vectors_path) // (2 * self.dimension)
+
+    def _write_vectors(self, rows: list, embeddings: list):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if self.dimension is None:
+            self.store.set_meta("dimension", int(vectors.shape[1]))
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(
+                f"Dimensão do embedding ({vectors.shape[1]}) difere da do banco ({self.dimension}).")
+
+        needed = max(rows) + 1
+        capacity = self._capacity()
+        if needed > capacity:
+            # Cresce em blocos para não redimensionar o arquivo a cada lote
+            new_capacity = max(needed, capacity * 2, 1024)
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(new_capacity * 2 * self.dimension)
+        matrix = np.memmap(self.vectors_path, dtype=np.float16, mode="r+",
+                           shape=(self._capacity(), self.dimension))
+        matrix[np.asarray(rows)] = vectors.astype(np.float16)
+        matrix.flush()
+        del matrix
+
+    def _refresh(self):
+        """
+        Remapeia o arquivo e recarrega as linhas válidas quando outro
+        processo (ou esta instância) escreveu no banco.
+        """
+        generation = self.store.generation()
+        if generation == self._generation and self._matrix is not None:
+            return
+        with self._lock:
+            capacity = self._capacity()
+            self._matrix = (
+                np.memmap(self.vectors_path, dtype=np.float16, mode="r",
+                          shape=(capacity, self.dimension))
+                if capacity else None
+            )
+            self._live_rows = self.store.rows()
+            self._generation = generation
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        return self.store.upsert(
+            ids, documents, metadatas,
+            before_commit=lambda rows: self._write_vectors(rows, embeddings))
+
+    def delete(self, ids):
+        self.store.delete(ids)
+
+    def update_metadata(self, ids, metadatas):
+        self.store.update_metadata(ids, metadatas)
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), limit=None, offset=0):
+        records = self.store.select(ids=ids, where=where, limit=limit, offset=offset)
+        result = {"ids": [record[1] for record in records]}
+        if "documents" in include:
+            result["documents"] = [record[2] for record in records]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(record[3]) for record in records]
+        if "embeddings" in include:
+            self._refresh()
+            rows = np.asarray([record[0] for record in records], dtype=np.int64)
+            result["embeddings"] = (
+                self._matrix[rows].astype(np.float32) if len(rows)
+                else np.empty((0, self.dimension or 0), dtype=np.float32))
+        return result
+
+    def _distances(self, queries: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """
+        Distância L2 ao quadrado entre cada pergunta e as linhas dadas,
+        calculada em blocos para limitar a memória temporária.
+        """
+        query_norms = np.sum(queries * queries, axis=1)[:, None]
+        distances = np.empty((len(queries), len(rows)), dtype=np.float32)
+        contiguous = len(rows) and rows[-1] - rows[0] + 1 == len(rows)
+        for start in range(0, len(rows), self.BLOCK_ROWS):
+            block_rows = rows[start:start + self.BLOCK_ROWS]
+            if contiguous:
+                block = self._matrix[block_rows[0]:block_rows[-1] + 1]
+            else:
+                block = self._matrix[block_rows]
+            block = np.asarray(block, dtype=np.float32)
+            distances[:, start:start + len(block_rows)] = (
+                query_norms - 2 * queries @ block.T + np.sum(block * block, axis=1)[None, :])
+        return distances
+
+    def _candidate_rows(self, where: dict = None) -> np.ndarray:
+        """
+        Linhas que a busca precisa olhar: todas, ou só as que passam no
+        filtro (consultadas no índice do SQLite e guardadas em cache até a
+        próxima escrita).
+        """
+        if not where:
+            return self._live_rows
+        key = (self._generation, json.dumps(where, sort_keys=True))
+        rows = self._filter_cache.get(key)
+        if rows is None:
+            rows = np.sort(self.store.rows(where))
+            self._filter_cache.set(key, rows)
+        return rows
+
+    def search(self, query_embeddings, n_results=6, where=None):
+        self._refresh()
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        rows = self._candidate_rows(where)
+        if self._matrix is None or not len(rows):
+            empty = [[] for _ in queries]
+            return {"ids": empty, "documents": [[] for _ in queries],
+                    "metadatas": [[] for _ in queries], "distances": [[] for _ in queries]}
+
+        distances = self._distances(queries, rows)
+        k = min(n_results, len(rows))
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        hits = []
+        for query_index, candidates in enumerate(top):
+            order = candidates[np.argsort(distances[query_index, candidates])]
+            hits.append((rows[order], distances[query_index, order]))
+        return self._results(hits)
+
+    def _results(self, hits: list) -> dict:
+        """
+        Monta o resultado no formato do ChromaDB a partir de (linhas,
+        distâncias) por pergunta. Linhas removidas no meio do caminho somem.
+        """
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for rows, distances in hits:
+            records = {record[0]: record for record in self.store.select(rows=list(rows))}
+            kept = [(records[row], float(distance))
+                    for row, distance in zip(rows, distances) if row in records]
+            result["ids"].append([record[1] for record, _ in kept])
+            result["documents"].append([record[2] for record, _ in kept])
+            result["metadatas"].append([json.loads(record[3]) for record, _ in kept])
+            result["distances"].append([distance for _, distance in kept])
+        return result
+
+    def count(self):
+        return self.store.count()
+
+    def close(self):
+        with self._lock:
+            self._matrix = None
+            self._live_rows = None
+            if self.store is not None:
+                self.store.close()
+
+    def compact(self):
+        """
+        Regrava a matriz sem as linhas removidas.
+        """
+        self._refresh()
+        rows = self.store.rows()
+        if not len(rows) or len(rows) == self.store.meta("next_row", 0):
+            return
+        tmp_path = f"{self.vectors_path}.tmp"
+        compacted = np.memmap(tmp_path, dtype=np.float16, mode="w+",
+                              shape=(len(rows), self.dimension))
+        compacted[:] = self._matrix[rows]
+        compacted.flush()
+        del compacted
+        with self.store._lock:
+            connection = self.store._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Duas passadas para não violar a chave primária no meio
+                connection.executemany(
+                    "UPDATE chunks SET row = ? WHERE row = ?",
+                    [(-(new + 1), int(old)) for new, old in enumerate(rows)])
+                connection.execute("UPDATE chunks SET row = -row - 1")
+                self.store.set_meta("next_row", len(rows))
+                self.store.set_meta("generation", self.store.generation() + 1)
+                os.replace(tmp_path, self.vectors_path)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        self._generation = None
+
+
+class FaissVectorBase(MmapVectorBase):
+    """
+    Índice FAISS (flat, IVF ou HNSW) sobre a mesma matriz float16 do
+    ``MmapVectorBase``, que continua sendo a fonte dos vetores.
+
+    Novos vetores entram no índice na hora; o índice é regravado em
+    ``persist()`` e reconstruído quando há muitas linhas removidas (o HNSW não
+    suporta remoção) ou quando o IVF ainda não foi treinado.
+
+    No HNSW, um chunk regravado (upsert) continua no grafo também com o
+    vetor antigo, sob a mesma linha, e um chunk removido continua no grafo.
+    A busca pede mais resultados (um a mais por vetor obsoleto, até
+    ``MAX_OVERFETCH`` vezes ``n_results``), junta as linhas repetidas e
+    recalcula as distâncias com a matriz, que tem só o vetor atual; assim um
+    vetor antigo nunca aparece com a distância dele nem ocupa uma vaga no
+    top-k. No flat e no IVF os vetores antigos saem do índice na hora.
+    """
+
+    name = "faiss"
+    TRADEOFFS = {
+        "flat": {
+            "recall": "exato (1.0)",
+            "latency": "linear no número de chunks, com SIMD do FAISS",
+            "memory": "4 bytes por dimensão por processo",
+        },
+        "ivf": {
+            "recall": "aproximado; depende de nprobe/nlist (~0.9-0.99)",
+            "latency": "sublinear; visita nprobe de nlist listas",
+            "memory": "4 bytes por dimensão por processo",
+        },
+        "hnsw": {
+            "recall": "aproximado; depende de efSearch (~0.95-0.99)",
+            "latency": "a menor; logarítmica no número de chunks",
+            "memory": "4 bytes por dimensão + grafo (M vizinhos) por processo",
+        },
+    }
+
+    REBUILD_DEAD_FRACTION = 0.2
+    # Teto da busca a mais no HNSW, em múltiplos de n_results (com muitos
+    # vetores obsoletos, o persist() reconstrói o índice)
+    MAX_OVERFETCH = 4
+    # Filtros com até tantas linhas usam busca exata no subconjunto
+    EXACT_FILTER_ROWS = 20000
+
+    def __init__(self, path: str, collection_name: str, index_type: str = "hnsw",
+                 nlist: int = 256, nprobe: int = 16, hnsw_m: int = 32, ef_search: int = 64):
+        if index_type not in self.TRADEOFFS:
+            raise ValueError(f"Tipo de índice FAISS desconhecido: {index_type}")
+        super().__init__(path, collection_name)
+        self.directory = os.path.join(path, f"{collection_name}.faiss-{index_type}")
+        self.vectors_path = os.path.join(self.directory, "vectors.f16")
+        self.index_path = os.path.join(self.directory, "index.faiss")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.TRADEOFF = self.TRADEOFFS[index_type]
+        self._index = None
+        self._index_mtime = None
+
+    def describe(self) -> dict:
+        return {"backend": f"{self.name}-{self.index_type}", **self.TRADEOFF}
+
+    def _new_index(self):
+        import faiss
+
+        if self.index_type == "flat":
+            return faiss.IndexIDMap(faiss.IndexFlatL2(self.dimension))
+        if self.index_type == "hnsw":
+            return faiss.IndexIDMap(faiss.IndexHNSWFlat(self.dimension, self.hnsw_m))
+        quantizer = faiss.IndexFlatL2(self.dimension)
+        return faiss.IndexIVFFlat(quantizer, self.dimension, self.nlist)
+
+    def _load_index(self):
+        import faiss
+
+        if not os.path.exists(self.index_path):
+            return
+        mtime = os.stat(self.index_path).st_mtime_ns
+        if mtime != self._index_mtime:
+            self._index = faiss.read_index(self.index_path)
+            self._index_mtime = mtime
+
+    def _stale_vectors(self, live: int) -> int:
+        """
+        Vetores no índice que não são o vetor atual de um chunk vivo: só no
+        HNSW, que não remove (o flat e o IVF tiram os vetores antigos no
+        upsert e no delete).
+        """
+        if self._index is None or self.index_type != "hnsw":
+            return 0
+        return max(0, self._index.ntotal - live)
+
+    def build_index(self):
+        """
+        (Re)constrói o índice com todas as linhas válidas.
+        """
+        self._refresh()
+        if self.dimension is None:
+            # Banco vazio: a dimensão só é conhecida no primeiro upsert
+            self._index = None
+            return
+        rows = self._live_rows
+        index = self._new_index()
+        if len(rows):
+            vectors = np.asarray(self._matrix[rows], dtype=np.float32)
+            if self.index_type == "ivf":
+                if len(rows) < self.nlist * 39:
+                    # Poucos dados para treinar o IVF; busca exata até lá
+                    self._index = None
+                    return
+                index.train(vectors)
+            index.add_with_ids(vectors, rows)
+        self._index = index
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self._load_index()
+        rows = super().upsert(ids, embeddings, documents, metadatas)
+        if self._index is not None:
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            row_ids = np.asarray(rows, dtype=np.int64)
+            if self.index_type != "hnsw":
+                self._index.remove_ids(row_ids)
+            self._index.add_with_ids(vectors, row_ids)
+        return rows
+
+    def delete(self, ids):
+        self._load_index()
+        if self._index is not None and self.index_type != "hnsw":
+            rows = [record[0] for record in self.store.select(ids=ids)]
+            self._index.remove_ids(np.asarray(rows, dtype=np.int64))
+        super().delete(ids)
+
+    def persist(self):
+        import faiss
+
+        if self._index is None or (
+                self._index.ntotal and
+                self._stale_vectors(self.store.count()) / self._index.ntotal > self.REBUILD_DEAD_FRACTION):
+            self.build_index()
+        if self._index is not None:
+            tmp_path = f"{self.index_path}.tmp"
+            faiss.write_index(self._index, tmp_path)
+            os.replace(tmp_path, self.index_path)
+            self._index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    def _search_params(self, selector=None):
+        import faiss
+
+        if self.index_type == "ivf":
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if self.index_type == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=max(self.ef_search, 1))
+        return faiss.SearchParameters(sel=selector)
+
+    def search(self, query_embeddings, n_results=6, where=None):
+        import faiss
+
+        self._refresh()
+        self._load_index()
+        if self._index is None:
+            return super().search(query_embeddings, n_results, where)
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        selector = None
+        if where:
+            rows = self._candidate_rows(where)
+            if len(rows) <= self.EXACT_FILTER_ROWS:
+                # Subconjunto pequeno: força bruta só nas linhas filtradas é
+                # mais rápida (e exata) que o índice com seletor
+                return super().search(query_embeddings, n_results, where)
+            selector = faiss.IDSelectorBatch(rows)
+        # Busca a mais para compensar vetores obsoletos ainda no índice (HNSW)
+        stale = self._stale_vectors(len(self._live_rows))
+        k = min(n_results + stale, n_results * self.MAX_OVERFETCH) if stale else n_results
+        distances, rows = self._index.search(
+            queries, min(k, max(self._index.ntotal, 1)), params=self._search_params(selector))
+
+        hits = []
+        for query, row_list, distance_list in zip(queries, rows, distances):
+            valid = row_list >= 0
+            if self.index_type == "hnsw":
+                # A mesma linha pode vir pelo vetor antigo e pelo novo:
+                # distâncias refeitas com o vetor atual (linhas em ordem)
+                candidates = np.unique(row_list[valid])
+                exact = self._distances(query[None, :], candidates)[0]
+                order = np.argsort(exact)
+                hits.append((candidates[order], exact[order]))
+            else:
+                hits.append((row_list[valid], distance_list[valid]))
+        results = self._results(hits)
+        for key in ("ids", "documents", "metadatas", "distances"):
+            results[key] = [values[:n_results] for values in results[key]]
+        return results
+
+
+def make_vector_base(backend: str, path: str, collection_name: str, embedding_function=None,
+                     **options) -> VectorBase:
+    """
+    Cria e abre o backend vetorial pelo nome: "chroma", "mmap", "faiss-flat",
+    "faiss-ivf" ou "faiss-hnsw".
+    """
+    if backend == "chroma":
+        base = ChromaVectorBase(path, collection_name, embedding_function)
+    elif backend == "mmap":
+        base = MmapVectorBase(path, collection_name)
+    elif backend.startswith("faiss-"):
+        base = FaissVectorBase(path, collection_name, index_type=backend[len("faiss-"):], **options)
+    else:
+        raise ValueError(f"Backend vetorial desconhecido: {backend}")
+    return base.create_db()
+
+
+BACKENDS = ("chroma", "mmap", "faiss-flat", "faiss-ivf", "faiss-hnsw")
+
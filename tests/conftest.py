@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Os módulos do projeto importam uns aos outros pelo nome (``from cache
+# import ...``), como quando rodam de dentro de rag/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rag"))
@@ -0,0 +1,19 @@
+import numpy as np
+
+from cache import SemanticAnswerCache, chunk_keys
+
+
+def test_answer_cache_misses_when_chunk_text_changes(tmp_path):
+    path = str(tmp_path / "respostas.json")
+    embedding = np.ones(8, dtype=np.float32)
+    ids = ["abc:0:0", "abc:1:0"]
+    cache = SemanticAnswerCache(threshold=0.9, path=path)
+    cache.store("qual o prazo?", embedding, chunk_keys(ids, ["prazo de 10 dias", "art. 2"]), "10 dias")
+    cache.save()
+
+    # Mesmos IDs e mesmo texto: reaproveita, inclusive depois de reiniciar
+    reloaded = SemanticAnswerCache(threshold=0.9, path=path)
+    assert reloaded.lookup(embedding, chunk_keys(ids[::-1], ["art. 2", "prazo de 10 dias"])) == "10 dias"
+
+    # Reingestão com outro chunking: os IDs se mantêm, o texto não
+    assert reloaded.lookup(embedding, chunk_keys(ids, ["prazo de 15 dias", "art. 2"])) is None
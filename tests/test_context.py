@@ -0,0 +1,33 @@
+from context import format_context, pack_context
+
+
+def test_contiguous_chunks_join_without_gap_marker():
+    page = "Art. 5º O prazo é de 10 dias.\n\nArt. 6º A multa é de 2%.\n\nArt. 7º Revogam-se as disposições."
+    first, second, third = page.split("\n\n")
+    metadatas = [
+        {"source": "lei.pdf", "page": 0, "start_index": page.index(second), "article_path": "Art. 6"},
+        {"source": "lei.pdf", "page": 0, "start_index": 0, "article_path": "Art. 5"},
+    ]
+    [passage] = pack_context([second, first], metadatas)
+    assert passage["text"] == f"{first}\n{second}"
+    assert passage["article_path"] == "Art. 5; Art. 6"
+    assert "Art. 5; Art. 6" in format_context([passage])
+
+    # Com o artigo do meio fora da busca, o buraco é marcado
+    metadatas = [
+        {"source": "lei.pdf", "page": 0, "start_index": 0, "article_path": "Art. 5"},
+        {"source": "lei.pdf", "page": 0, "start_index": page.index(third), "article_path": "Art. 7"},
+    ]
+    [passage] = pack_context([first, third], metadatas)
+    assert passage["text"] == f"{first}\n[...]\n{third}"
+
+
+def test_overlapping_chunks_are_not_repeated():
+    text = "um dois três quatro cinco seis sete oito"
+    metadatas = [
+        {"source": "a.txt", "page": 0, "start_index": 0},
+        {"source": "a.txt", "page": 0, "start_index": 8},
+    ]
+    [passage] = pack_context([text[:18], text[8:]], metadatas)
+    assert passage["text"] == text
+    assert passage["article_path"] is None
@@ -0,0 +1,145 @@
+"""
+``sync`` contra um servidor WebDAV local mínimo (PROPFIND e GET com Range).
+"""
+import email.utils
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+import pytest
+
+from load_from_owncloud import WebDAVClient, sync
+
+
+def _etag(path: str) -> str:
+    with open(path, "rb") as f:
+        return '"%s"' % hashlib.md5(f.read()).hexdigest()
+
+
+class WebDAVStandIn(BaseHTTPRequestHandler):
+    """
+    Serve os arquivos de ``server.root`` como uma pasta WebDAV (qualquer
+    caminho da URL).
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _local_path(self) -> str:
+        return os.path.join(self.server.root, os.path.basename(unquote(self.path)))
+
+    def do_PROPFIND(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        href = unquote(self.path).rstrip("/")
+        items = [f"<d:response><d:href>{quote(href)}/</d:href><d:propstat><d:prop>"
+                 "<d:resourcetype><d:collection/></d:resourcetype></d:prop></d:propstat></d:response>"]
+        for name in sorted(os.listdir(self.server.root)):
+            path = os.path.join(self.server.root, name)
+            stat = os.stat(path)
+            items.append(
+                f"<d:response><d:href>{quote(f'{href}/{name}')}</d:href><d:propstat><d:prop>"
+                f"<d:resourcetype/><d:getetag>{_etag(path)}</d:getetag>"
+                f"<d:getcontentlength>{stat.st_size}</d:getcontentlength>"
+                f"<d:getlastmodified>{email.utils.formatdate(stat.st_mtime, usegmt=True)}</d:getlastmodified>"
+                "</d:prop></d:propstat></d:response>")
+        body = ('<?xml version="1.0"?><d:multistatus xmlns:d="DAV:">'
+                + "".join(items) + "</d:multistatus>").encode("utf-8")
+        self.send_response(207)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self._local_path()
+        with open(path, "rb") as f:
+            data = f.read()
+        self.server.requests.append(self.headers.get("Range"))
+        start = 0
+        status = 200
+        requested = self.headers.get("Range")
+        if requested and self.headers.get("If-Range") in (None, _etag(path)):
+            start = int(requested.split("=")[1].rstrip("-"))
+            if start >= len(data) or self.server.refuse_range:
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        body = data[start:]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", _etag(path))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def webdav(tmp_path):
+    root = tmp_path / "remoto"
+    root.mkdir()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), WebDAVStandIn)
+    server.root = str(root)
+    server.requests = []
+    server.refuse_range = False
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, root, WebDAVClient(f"http://127.0.0.1:{server.server_port}/dav/pasta")
+    server.shutdown()
+    server.server_close()
+
+
+def names(paths: list) -> list:
+    return sorted(os.path.basename(path) for path in paths)
+
+
+def test_sync_reports_added_changed_and_deleted(webdav, tmp_path):
+    _, root, client = webdav
+    local = tmp_path / "data"
+    (root / "edital.txt").write_text("edital " * 100)
+    (root / "ata ç.txt").write_text("ata " * 100)
+    (root / "planilha.xlsx").write_text("ignorada")
+
+    first = sync(client, str(local))
+    assert names(first["added"]) == ["ata ç.txt", "edital.txt"]
+    assert first["changed"] == first["deleted"] == first["failed"] == []
+    assert (local / "ata ç.txt").read_text() == "ata " * 100
+
+    again = sync(client, str(local))
+    assert again["added"] == again["changed"] == again["deleted"] == []
+    assert names(again["unchanged"]) == ["ata ç.txt", "edital.txt"]
+
+    (root / "edital.txt").write_text("edital retificado " * 100)
+    (root / "ata ç.txt").unlink()
+    (root / "portaria.txt").write_text("portaria " * 10)
+    delta = sync(client, str(local))
+    assert names(delta["added"]) == ["portaria.txt"]
+    assert names(delta["changed"]) == ["edital.txt"]
+    assert names(delta["deleted"]) == ["ata ç.txt"]
+    assert not (local / "ata ç.txt").exists()
+    assert (local / "edital.txt").read_text() == "edital retificado " * 100
+
+
+@pytest.mark.parametrize("partial_size, refuse_range", [(600, False), (100, True)])
+def test_download_restarts_when_partial_cannot_be_resumed(webdav, tmp_path, partial_size, refuse_range):
+    server, root, client = webdav
+    content = b"conteudo " * 50
+    (root / "edital.txt").write_bytes(content)
+    [remote] = client.list()
+    server.refuse_range = refuse_range
+
+    # Parcial da mesma versão maior que o arquivo remoto, ou que o servidor
+    # não aceita retomar (416)
+    local = tmp_path / "data"
+    local.mkdir()
+    tag = hashlib.sha1(remote.etag.encode("utf-8")).hexdigest()[:12]
+    part = local / f".edital.txt.{tag}.part"
+    part.write_bytes(b"x" * partial_size)
+
+    client.download(remote, str(local / "edital.txt"))
+    assert (local / "edital.txt").read_bytes() == content
+    assert not part.exists()
+    assert server.requests[-1] is None
@@ -0,0 +1,48 @@
+import os
+import time
+
+import loaders
+
+
+def fake_load_file(file_path):
+    name = os.path.basename(file_path)
+    if name.startswith("trava"):
+        time.sleep(30)
+    elif name.startswith("lento"):
+        time.sleep(0.3)
+    return [name]
+
+
+def test_consumer_time_does_not_count_toward_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(loaders, "load_file", fake_load_file)
+    paths = []
+    for name in ("rapido.txt", "lento.txt"):
+        path = tmp_path / name
+        path.write_text("texto")
+        paths.append(str(path))
+
+    results = {}
+    for file_path, documents, error in loaders.iter_load_files(paths, max_workers=2, timeout=1.0):
+        results[os.path.basename(file_path)] = (documents, error)
+        # Contrapressão do pipeline: o consumidor segura o gerador por mais
+        # que o tempo limite enquanto o outro arquivo termina
+        time.sleep(1.5)
+
+    assert results == {"rapido.txt": (["rapido.txt"], None), "lento.txt": (["lento.txt"], None)}
+
+
+def test_stuck_file_times_out(tmp_path, monkeypatch):
+    monkeypatch.setattr(loaders, "load_file", fake_load_file)
+    paths = []
+    for name in ("trava.txt", "rapido.txt"):
+        path = tmp_path / name
+        path.write_text("texto")
+        paths.append(str(path))
+
+    started = time.monotonic()
+    results = {os.path.basename(file_path): error
+               for file_path, _, error in loaders.iter_load_files(paths, max_workers=2, timeout=1.0)}
+
+    assert results["rapido.txt"] is None
+    assert isinstance(results["trava.txt"], TimeoutError)
+    assert time.monotonic() - started < 10
@@ -0,0 +1,145 @@
+"""
+Suíte comum a todos os backends vetoriais: escrita, leitura, filtros,
+regravação, remoção e recall@10 da busca contra a força bruta exata.
+"""
+import numpy as np
+import pytest
+
+from vector_database import BACKENDS, FaissVectorBase, make_vector_base
+
+DIMENSION = 32
+SIZE = 500
+# Recall@10 mínimo de cada backend nos dados de teste (o IVF roda com
+# poucas listas e nprobe baixo, para exercitar a busca aproximada)
+MIN_RECALL = {"chroma": 0.9, "mmap": 0.99, "faiss-flat": 0.99, "faiss-ivf": 0.5, "faiss-hnsw": 0.9}
+
+
+def open_backend(backend: str, directory):
+    options = {"nlist": 4, "nprobe": 2} if backend == "faiss-ivf" else {}
+    return make_vector_base(backend, str(directory), "verificacao", **options)
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, tmp_path):
+    base = open_backend(request.param, tmp_path)
+    yield request.param, base
+    base.close()
+
+
+def fixture_data(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(SIZE, DIMENSION)).astype(np.float32)
+    ids = [f"c{i}" for i in range(SIZE)]
+    documents = [f"texto {i}" for i in range(SIZE)]
+    # Metadados mistos (com e sem page/article): o SQLite pode listar as
+    # linhas pelos índices de expressão, fora de ordem. A primeira e a última
+    # linha ficam nas pontas de qualquer um deles, o caso em que a busca
+    # tomaria a lista por um intervalo contíguo da matriz
+    metadatas = [{"source": f"doc{i % 5}.pdf", "page": i % 7, "file_type": ".pdf"} for i in range(SIZE)]
+    for i in range(0, SIZE, 3):
+        metadatas[i]["article"] = f"Art. {i % 11}"
+    for i in range(1, SIZE, 4):
+        del metadatas[i]["page"]
+    metadatas[0] = {"source": "doc0.pdf", "file_type": ".pdf"}
+    metadatas[-1] = {"source": "doc9.pdf", "page": 99, "article": "Art. 99", "file_type": ".pdf"}
+    return rng, vectors, ids, documents, metadatas
+
+
+def fill(base, vectors, ids, documents, metadatas):
+    for start in range(0, SIZE, 100):
+        end = start + 100
+        base.upsert(ids[start:end], vectors[start:end], documents[start:end], metadatas[start:end])
+    base.persist()
+
+
+def test_backend(backend):
+    name, base = backend
+    rng, vectors, ids, documents, metadatas = fixture_data()
+    fill(base, vectors, ids, documents, metadatas)
+    assert base.count() == SIZE
+
+    got = base.get(ids=["c3", "c1"], include=("documents", "metadatas", "embeddings"))
+    assert got["ids"] == ["c3", "c1"], "get() deve respeitar a ordem dos IDs"
+    assert got["documents"] == ["texto 3", "texto 1"]
+    assert np.allclose(np.asarray(got["embeddings"])[0], vectors[3], atol=1e-2)
+
+    probes = [0, 1, 2, 3, SIZE // 2, SIZE - 1]
+    own = base.search(vectors[probes], n_results=1)
+    assert [hit[0] for hit in own["ids"]] == [f"c{i}" for i in probes], "o vetor de um chunk deve achar o próprio chunk"
+
+    queries = rng.normal(size=(20, DIMENSION)).astype(np.float32)
+    exact = np.argsort(((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(-1), axis=1)[:, :10]
+    found = base.search(queries, n_results=10)
+    recall = np.mean([
+        len({f"c{i}" for i in truth} & set(hit)) / 10
+        for truth, hit in zip(exact, found["ids"])
+    ])
+    assert recall >= MIN_RECALL[name]
+
+    filtered = base.search(queries[:1], n_results=5, where={"$and": [{"source": "doc2.pdf"}, {"page": {"$gte": 3}}]})
+    assert filtered["ids"][0], "busca filtrada vazia"
+    assert all(m["source"] == "doc2.pdf" and m["page"] >= 3 for m in filtered["metadatas"][0])
+    by_article = base.search(vectors[3:4], n_results=3, where={"article": "Art. 3"})
+    assert by_article["ids"][0][0] == "c3", "busca filtrada por artigo deve achar o próprio chunk"
+
+    # Regravar um chunk com outro vetor: o antigo não pode mais achá-lo
+    # (o HNSW do FAISS guarda os dois vetores no grafo)
+    moved = rng.normal(size=(1, DIMENSION)).astype(np.float32)
+    base.upsert(["c5"], moved, ["texto 5"], [metadatas[5]])
+    base.persist()
+    assert base.count() == SIZE
+    assert "c5" not in base.search(vectors[5:6], n_results=3)["ids"][0], "vetor antigo ainda acha o chunk regravado"
+    hit = base.search(moved, n_results=3)
+    assert hit["ids"][0][0] == "c5" and hit["ids"][0].count("c5") == 1, "vetor novo deve achar o chunk regravado"
+    assert hit["distances"][0][0] < 0.05, "distância do chunk regravado deve vir do vetor novo"
+
+    base.delete(["c0", "c1"])
+    base.persist()
+    assert base.count() == SIZE - 2
+    assert "c0" not in base.search(vectors[:1], n_results=3)["ids"][0], "chunk removido ainda aparece"
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf"])
+def test_faiss_removes_replaced_vectors(tmp_path, monkeypatch, index_type):
+    base = open_backend(f"faiss-{index_type}", tmp_path)
+    _, vectors, ids, documents, metadatas = fixture_data()
+    fill(base, vectors, ids, documents, metadatas)
+    builds = []
+    monkeypatch.setattr(base, "build_index", lambda: builds.append(1))
+
+    # Regravar tudo várias vezes e remover não deixa vetores obsoletos no
+    # índice: nada de reconstrução nem de busca a mais
+    for _ in range(3):
+        fill(base, vectors[::-1].copy(), ids[::-1], documents[::-1], metadatas[::-1])
+    base.delete(ids[:50])
+    base.persist()
+    assert base._index.ntotal == SIZE - 50
+    assert base._stale_vectors(base.count()) == 0
+    assert not builds
+    base.close()
+
+
+def test_faiss_hnsw_counts_stale_vectors(tmp_path, monkeypatch):
+    base = open_backend("faiss-hnsw", tmp_path)
+    _, vectors, ids, documents, metadatas = fixture_data()
+    fill(base, vectors, ids, documents, metadatas)
+    assert base._stale_vectors(base.count()) == 0
+
+    base.upsert(ids[:40], vectors[:40] + 1, documents[:40], metadatas[:40])
+    base.delete(ids[40:50])
+    assert base._stale_vectors(base.count()) == 50
+
+    # A busca a mais tem teto, por maior que seja o número de obsoletos
+    requested = []
+    search = base._index.search
+    monkeypatch.setattr(base._index, "search", lambda queries, k, **kwargs: (
+        requested.append(k), search(queries, k, **kwargs))[1])
+    base.search(vectors[100:101], n_results=5)
+    assert requested == [5 * FaissVectorBase.MAX_OVERFETCH]
+
+    # Passou da fração de obsoletos: o persist() reconstrói o índice
+    base.upsert(ids[50:150], vectors[50:150] + 1, documents[50:150], metadatas[50:150])
+    base.persist()
+    assert base._index.ntotal == SIZE - 10
+    assert base._stale_vectors(base.count()) == 0
+    base.close()
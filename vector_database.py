@@ -1,13 +0,0 @@
-
-class VectorBase:
-
-    def __init__(self, name, age):
-      self.name = name
-    pass
-
-    def create_db(args):
-     pass
-
-    def search(query:str):
-      pass
-      
\ No newline at end of file